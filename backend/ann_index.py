@@ -0,0 +1,424 @@
+"""
+Nearest-neighbour indexes over the paper embedding store
+"""
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+
+def top_k(ids: np.ndarray, scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    """Best ``k`` (id, score) pairs, highest score first, without a full sort"""
+    if len(scores) == 0 or k <= 0:
+        return []
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    order = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return [(int(ids[i]), float(scores[i])) for i in order]
+
+
+def blocked_top_k(queries, matrix, k: int, block_size: int = 20000,
+                  adjust: Optional[Callable[[np.ndarray, int, int], None]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Row-wise top ``k`` of ``queries @ matrix.T`` without materialising the whole product
+
+    ``matrix`` is scored ``block_size`` rows at a time, keeping a running
+    top-k per query. ``adjust(scores, start, stop)`` may rewrite each dense
+    (queries x block) score block in place, e.g. to apply boosts or set
+    excluded rows to -inf.
+
+    Returns:
+        (rows, scores), each queries x min(k, n): matrix row positions and
+        their scores, best first
+    """
+    n_queries, n_rows = queries.shape[0], matrix.shape[0]
+    best_rows = np.zeros((n_queries, 0), dtype=np.int64)
+    best_scores = np.zeros((n_queries, 0))
+    for start in range(0, n_rows, block_size):
+        stop = min(n_rows, start + block_size)
+        scores = queries @ matrix[start:stop].T
+        scores = scores.toarray() if hasattr(scores, "toarray") else np.asarray(scores, dtype=np.float64)
+        if adjust is not None:
+            adjust(scores, start, stop)
+
+        candidate_scores = np.hstack((best_scores, scores))
+        candidate_rows = np.hstack((best_rows, np.broadcast_to(np.arange(start, stop), scores.shape)))
+        keep = min(k, candidate_scores.shape[1])
+        if keep < candidate_scores.shape[1]:
+            chosen = np.argpartition(-candidate_scores, keep - 1, axis=1)[:, :keep]
+            candidate_scores = np.take_along_axis(candidate_scores, chosen, axis=1)
+            candidate_rows = np.take_along_axis(candidate_rows, chosen, axis=1)
+        best_scores, best_rows = candidate_scores, candidate_rows
+
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class ExactIndex:
+    """Brute-force inner product over the whole embedding store"""
+
+    name = "exact"
+    # NumPy has no BLAS path for float16, so rows are upcast block by block
+    BLOCK = 8192
+
+    def __init__(self, store):
+        self.store = store
+
+    @property
+    def ready(self) -> bool:
+        return True
+
+    def upsert(self, paper_ids: List[int], vectors: np.ndarray):
+        """Nothing to do: rows are read straight from the store"""
+
+    def remove(self, paper_ids: Iterable[int]):
+        """Nothing to do: rows are read straight from the store"""
+
+    def search(self, query: np.ndarray, k: int, **kwargs) -> List[Tuple[int, float]]:
+        matrix = self.store.matrix
+        query = query.astype(np.float32)
+        scores = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), self.BLOCK):
+            block = np.asarray(matrix[start:start + self.BLOCK], dtype=np.float32)
+            scores[start:start + len(block)] = block @ query
+        return top_k(self.store.ids, scores, k)
+
+    def save(self):
+        """Nothing to persist"""
+
+
+class _InvertedList:
+    """Growable block of (id, vector) rows belonging to one IVF cell"""
+
+    __slots__ = ("ids", "vectors", "size")
+
+    def __init__(self, dim: int, dtype):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, dim), dtype=dtype)
+        self.size = 0
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray) -> int:
+        start = self.size
+        needed = start + len(ids)
+        if needed > len(self.ids):
+            capacity = max(needed, 2 * len(self.ids), 16)
+            grown_ids = np.empty(capacity, dtype=np.int64)
+            grown_vectors = np.empty((capacity, self.vectors.shape[1]), dtype=self.vectors.dtype)
+            grown_ids[:start] = self.ids[:start]
+            grown_vectors[:start] = self.vectors[:start]
+            self.ids, self.vectors = grown_ids, grown_vectors
+        self.ids[start:needed] = ids
+        self.vectors[start:needed] = vectors
+        self.size = needed
+        return start
+
+    def pop(self, pos: int) -> Optional[int]:
+        """Remove row ``pos`` by moving the last row into it; returns the moved id"""
+        last = self.size - 1
+        moved = None
+        if pos != last:
+            self.ids[pos] = self.ids[last]
+            self.vectors[pos] = self.vectors[last]
+            moved = int(self.ids[pos])
+        self.size = last
+        return moved
+
+
+class IVFIndex:
+    """
+    Inverted-file (IVF-Flat) approximate index.
+
+    Vectors are clustered around ``nlist`` spherical k-means centroids and a
+    query only scans the ``nprobe`` closest cells, so cost grows with
+    N * nprobe / nlist instead of N. ``nprobe`` is the recall/latency knob:
+    raising it towards ``nlist`` converges on exact search. Inserts are
+    assigned to their nearest existing centroid and deletes swap-remove
+    within a cell; the centroids are retrained when the corpus has grown
+    well past the size they were trained on.
+    """
+
+    name = "ivf"
+    TRAIN_ITERATIONS = 8
+    TRAIN_SAMPLE_PER_LIST = 48
+    ASSIGN_BLOCK = 8192
+
+    def __init__(self, store, nprobe: int = 16, dtype: str = "float32", directory: Optional[str] = None):
+        self.store = store
+        self.dim = store.dim
+        self.nprobe = nprobe
+        self.dtype = np.dtype(dtype)
+        self.directory = directory
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_size = 0
+        self.lists: List[_InvertedList] = []
+        self.location: Dict[int, Tuple[int, int]] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self):
+        return len(self.location)
+
+    @staticmethod
+    def default_nlist(n: int) -> int:
+        return int(min(4096, max(16, np.sqrt(n))))
+
+    def needs_retrain(self) -> bool:
+        return not self.ready or len(self.store) > 4 * max(self.trained_size, 1)
+
+    def _assign(self, vectors: np.ndarray, centroids: Optional[np.ndarray] = None) -> np.ndarray:
+        centroids = self.centroids if centroids is None else centroids
+        assignment = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), self.ASSIGN_BLOCK):
+            block = np.asarray(vectors[start:start + self.ASSIGN_BLOCK], dtype=np.float32)
+            assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return assignment
+
+    def train(self, vectors: np.ndarray, nlist: Optional[int] = None, seed: int = 0) -> np.ndarray:
+        """Spherical k-means on a sample of ``vectors``; returns the centroids"""
+        n = len(vectors)
+        nlist = min(nlist or self.default_nlist(n), n)
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, nlist * self.TRAIN_SAMPLE_PER_LIST)
+        sample = np.asarray(vectors[np.sort(rng.choice(n, sample_size, replace=False))], dtype=np.float32)
+
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.TRAIN_ITERATIONS):
+            assignment = self._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Re-seed empty cells from random sample points
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+        return centroids.astype(np.float32)
+
+    def build(self, ids: np.ndarray, vectors: np.ndarray, nlist: Optional[int] = None):
+        """Train centroids and bulk-load every (id, vector) pair"""
+        centroids = self.train(vectors, nlist)
+        assignment = self._assign(vectors, centroids)
+        self._load_lists(centroids, ids, vectors, assignment)
+        self.trained_size = len(ids)
+
+    def _load_lists(self, centroids: np.ndarray, ids: np.ndarray, vectors: np.ndarray, assignment: np.ndarray):
+        lists = [_InvertedList(self.dim, self.dtype) for _ in range(len(centroids))]
+        location = {}
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+        for cell in range(len(centroids)):
+            rows = order[bounds[cell]:bounds[cell + 1]]
+            if len(rows) == 0:
+                continue
+            lists[cell].append(ids[rows], np.asarray(vectors[rows], dtype=self.dtype))
+            for pos, pid in enumerate(ids[rows]):
+                location[int(pid)] = (cell, pos)
+        self.centroids = centroids
+        self.lists = lists
+        self.location = location
+
+    def remove(self, paper_ids: Iterable[int]):
+        for pid in paper_ids:
+            loc = self.location.pop(int(pid), None)
+            if loc is None:
+                continue
+            cell, pos = loc
+            moved = self.lists[cell].pop(pos)
+            if moved is not None:
+                self.location[moved] = (cell, pos)
+
+    def upsert(self, paper_ids: List[int], vectors: np.ndarray):
+        """Insert new vectors, or move changed ones to their nearest cell"""
+        if not self.ready or not len(paper_ids):
+            return
+        self.remove(paper_ids)
+        ids = np.asarray(paper_ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        assignment = self._assign(vectors)
+        for cell in np.unique(assignment):
+            mask = assignment == cell
+            start = self.lists[cell].append(ids[mask], vectors[mask].astype(self.dtype))
+            for offset, pid in enumerate(ids[mask]):
+                self.location[int(pid)] = (int(cell), start + offset)
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        nprobe = min(nprobe or self.nprobe, len(self.lists))
+        query = query.astype(np.float32)
+        cell_scores = self.centroids @ query
+        if nprobe < len(cell_scores):
+            probes = np.argpartition(-cell_scores, nprobe)[:nprobe]
+        else:
+            probes = np.arange(len(cell_scores))
+
+        ids, scores = [], []
+        query = query.astype(self.dtype)
+        for cell in probes:
+            inverted = self.lists[cell]
+            if inverted.size:
+                ids.append(inverted.ids[:inverted.size])
+                scores.append(inverted.vectors[:inverted.size] @ query)
+        if not ids:
+            return []
+        return top_k(np.concatenate(ids), np.concatenate(scores).astype(np.float32), k)
+
+    def save(self):
+        """Persist centroids and cell assignments next to the embedding store"""
+        if not self.ready or not self.directory:
+            return
+        ids = np.fromiter(self.location.keys(), dtype=np.int64, count=len(self.location))
+        cells = np.fromiter((loc[0] for loc in self.location.values()), dtype=np.int32, count=len(self.location))
+        tmp_path = os.path.join(self.directory, "ivf.tmp.npz")
+        np.savez(tmp_path, centroids=self.centroids, ids=ids, cells=cells, trained_size=self.trained_size)
+        os.replace(tmp_path, os.path.join(self.directory, "ivf.npz"))
+
+    def load(self) -> bool:
+        """Restore a saved index, reconciling it with the current store contents"""
+        path = os.path.join(self.directory or "", "ivf.npz")
+        if not self.directory or not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as saved:
+                centroids = saved["centroids"]
+                ids = saved["ids"]
+                cells = saved["cells"]
+                trained_size = int(saved["trained_size"])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not load IVF index, rebuilding: {e}")
+            return False
+        if centroids.shape[1] != self.dim:
+            return False
+
+        keep = np.fromiter((int(pid) in self.store for pid in ids), dtype=bool, count=len(ids))
+        ids, cells = ids[keep], cells[keep]
+        self._load_lists(centroids, ids, self.store.vectors_for(ids.tolist()), cells)
+        self.trained_size = trained_size
+
+        missing = [int(pid) for pid in self.store.ids if int(pid) not in self.location]
+        if missing:
+            self.upsert(missing, self.store.vectors_for(missing))
+        return True
+
+
+ANN_BACKENDS = {
+    ExactIndex.name: ExactIndex,
+    IVFIndex.name: IVFIndex,
+}
+
+
+class ANNManager:
+    """
+    Chooses and maintains the nearest-neighbour backend for an embedding store.
+
+    backend="auto" serves small corpora with exact search and switches to
+    the IVF index once the store holds ``min_size`` papers. The IVF index is
+    (re)built on a background thread; exact search answers queries until
+    it is ready. All store/index mutations happen under ``lock``.
+    """
+
+    SAVE_EVERY = 1000
+
+    def __init__(self, store, lock, backend: str = "auto", min_size: int = 20000,
+                 nprobe: int = 16, dtype: str = "float32"):
+        if backend not in ("auto",) + tuple(ANN_BACKENDS):
+            raise ValueError(f"Unknown ANN backend: {backend}")
+        self.store = store
+        self.lock = lock
+        self.backend = backend
+        self.min_size = min_size
+        self.nprobe = nprobe
+        self.dtype = dtype
+        self.exact = ExactIndex(store)
+        self.approx: Optional[IVFIndex] = None
+        self._building = False
+        self._pending: List[Tuple[str, List[int]]] = []
+        self._unsaved = 0
+
+        if self._wants_approx():
+            index = IVFIndex(store, nprobe=nprobe, dtype=dtype, directory=store.directory)
+            if index.load():
+                self.approx = index
+                print(f"Loaded IVF index with {len(index)} papers")
+
+    def _wants_approx(self) -> bool:
+        if self.backend == "exact":
+            return False
+        if self.backend == IVFIndex.name:
+            return len(self.store) > 0
+        return len(self.store) >= self.min_size
+
+    @property
+    def active(self):
+        if self.approx is not None and self.approx.ready and self._wants_approx():
+            return self.approx
+        return self.exact
+
+    def upsert(self, paper_ids: List[int]):
+        """Mirror store inserts/updates into the approximate index (caller holds lock)"""
+        if not paper_ids:
+            return
+        if self._building:
+            self._pending.append(("upsert", list(paper_ids)))
+        if self.approx is not None:
+            self.approx.upsert(paper_ids, self.store.vectors_for(paper_ids))
+            self._unsaved += len(paper_ids)
+
+    def remove(self, paper_ids: List[int]):
+        """Mirror store deletes into the approximate index (caller holds lock)"""
+        if not paper_ids:
+            return
+        if self._building:
+            self._pending.append(("remove", list(paper_ids)))
+        if self.approx is not None:
+            self.approx.remove(paper_ids)
+            self._unsaved += len(paper_ids)
+
+    def maybe_rebuild(self):
+        """Start a background (re)build if the corpus crossed the size thresholds"""
+        if self._building or not self._wants_approx():
+            return
+        if self.approx is not None and not self.approx.needs_retrain():
+            return
+        self._building = True
+        self._pending = []
+        ids = self.store.ids.copy()
+        vectors = np.array(self.store.matrix)
+        threading.Thread(target=self._build, args=(ids, vectors), daemon=True).start()
+
+    def _build(self, ids: np.ndarray, vectors: np.ndarray):
+        try:
+            index = IVFIndex(self.store, nprobe=self.nprobe, dtype=self.dtype, directory=self.store.directory)
+            index.build(ids, vectors)
+            del vectors
+            with self.lock:
+                # Replay writes that landed while the index was being built
+                for op, paper_ids in self._pending:
+                    if op == "remove":
+                        index.remove(paper_ids)
+                    else:
+                        present = [pid for pid in paper_ids if pid in self.store]
+                        index.upsert(present, self.store.vectors_for(present))
+                self.approx = index
+                self._pending = []
+                self._building = False
+            index.save()
+            print(f"Built IVF index over {len(index)} papers ({len(index.lists)} cells)")
+        except Exception as e:
+            print(f"Error building IVF index: {e}")
+            with self.lock:
+                self._building = False
+                self._pending = []
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        return self.active.search(query, k, nprobe=nprobe)
+
+    def save(self, force: bool = False):
+        """Persist the approximate index once enough writes have accumulated"""
+        if self.approx is None or (not force and self._unsaved < self.SAVE_EVERY):
+            return
+        self.approx.save()
+        self._unsaved = 0
@@ -0,0 +1,276 @@
+"""
+Non-blocking arXiv / PubMed fetchers for use inside async request handlers
+
+One pooled httpx.AsyncClient is shared by all requests. Each source has a
+token-bucket rate limiter (arXiv asks for one request every three seconds,
+NCBI allows three per second without an API key), failed requests are
+retried a bounded number of times with jittered exponential backoff, and
+multi-source fetches run the sources concurrently. Response bodies are
+streamed through the incremental parsers in paper_fetchers.py chunk by
+chunk, so a large efetch batch is never held in memory (or in one element
+tree) at once, and each chunk is parsed in well under a millisecond on the
+event loop.
+
+Point ARXIV_API_URL / PUBMED_API_URL at stub_fetch_server.py to exercise
+the fetchers without network access.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+from paper_fetchers import (
+    ARXIV_API_URL, PUBMED_API_URL, PUBMED_RECENT_QUERY, PARSE_CHUNK_SIZE,
+    ArxivFeedParser, PubmedArticleParser, StreamingRecordParser,
+    arxiv_params, pubmed_search_params, pubmed_fetch_params, pubmed_history_fetch_params
+)
+
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "10"))
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "20"))
+FETCH_MAX_RETRIES = int(os.getenv("FETCH_MAX_RETRIES", "3"))
+FETCH_RETRY_BACKOFF = float(os.getenv("FETCH_RETRY_BACKOFF", "0.5"))
+# Longest Retry-After honoured; a longer one would stall a harvest or scheduled job
+FETCH_MAX_RETRY_AFTER = float(os.getenv("FETCH_MAX_RETRY_AFTER", "30"))
+# Requests per second and burst size per source
+ARXIV_RATE = float(os.getenv("ARXIV_RATE", "0.34"))
+ARXIV_BURST = int(os.getenv("ARXIV_BURST", "1"))
+PUBMED_RATE = float(os.getenv("PUBMED_RATE", "3"))
+PUBMED_BURST = int(os.getenv("PUBMED_BURST", "3"))
+
+# Statuses worth retrying: rate limited or a transient server error
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Rate limiter allowing ``rate`` requests per second with bursts of ``capacity``
+
+    Callers take a token each; when the bucket is empty the balance goes
+    negative and each caller sleeps until its own token has accrued, so
+    waiting requests are released in order at the configured rate.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token; returns the seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class AsyncPaperFetcher:
+    """Rate-limited, retrying fetches from arXiv and PubMed over one connection pool"""
+
+    def __init__(self, arxiv_url: str = ARXIV_API_URL, pubmed_url: str = PUBMED_API_URL,
+                 max_retries: int = FETCH_MAX_RETRIES, backoff: float = FETCH_RETRY_BACKOFF,
+                 timeout: float = FETCH_TIMEOUT, max_connections: int = FETCH_MAX_CONNECTIONS):
+        self.arxiv_url = arxiv_url
+        self.pubmed_url = pubmed_url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.buckets = {
+            "arxiv": TokenBucket(ARXIV_RATE, ARXIV_BURST),
+            "pubmed": TokenBucket(PUBMED_RATE, PUBMED_BURST),
+        }
+        self.counters = {source: {"requests": 0, "retries": 0, "failures": 0} for source in self.buckets}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+
+    def _client_for_loop(self) -> httpx.AsyncClient:
+        """The shared client, created on first use in the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            if self._client is not None:
+                self._discard_client(self._client, self._client_loop)
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                follow_redirects=True,
+            )
+            self._client_loop = loop
+        return self._client
+
+    @staticmethod
+    def _discard_client(client: httpx.AsyncClient, loop):
+        """Close a client left by an earlier event loop, on that loop if it still runs"""
+        if loop is not None and loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            # Its connections belong to a stopped loop and cannot be closed from this one
+            print("Warning: fetcher client of a stopped event loop was not closed; "
+                  "call close() before the loop ends")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        """Retry-After when the server sent one (at most FETCH_MAX_RETRY_AFTER), else jittered exponential backoff"""
+        if response is not None:
+            try:
+                return min(max(0.0, float(response.headers.get("retry-after", ""))), FETCH_MAX_RETRY_AFTER)
+            except ValueError:
+                pass
+        return self.backoff * (2 ** attempt) * (0.5 + random.random())
+
+    async def get(self, source: str, url: str, params: Dict, stream: bool = False) -> httpx.Response:
+        """
+        GET through the source's rate limiter, retrying transient failures
+
+        With ``stream`` the body is left unread; the caller must close the response.
+        """
+        client = self._client_for_loop()
+        counters = self.counters[source]
+        for attempt in range(self.max_retries + 1):
+            await self.buckets[source].acquire()
+            counters["requests"] += 1
+            try:
+                response = await client.send(client.build_request("GET", url, params=params), stream=stream)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    counters["failures"] += 1
+                    raise
+                print(f"Retrying {source} request after {type(e).__name__}")
+                counters["retries"] += 1
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                counters["retries"] += 1
+                await response.aclose()
+                await asyncio.sleep(self._retry_delay(attempt, response))
+                continue
+            if response.is_error:
+                counters["failures"] += 1
+                await response.aclose()
+            response.raise_for_status()
+            return response
+
+    async def stream_papers(self, source: str, url: str, params: Dict,
+                            parser: StreamingRecordParser) -> AsyncIterator[Dict]:
+        """Papers yielded as the response body arrives and ``parser`` works through it"""
+        response = await self.get(source, url, params, stream=True)
+        try:
+            async for chunk in response.aiter_bytes(PARSE_CHUNK_SIZE):
+                for paper in parser.feed(chunk):
+                    yield paper
+            for paper in parser.close():
+                yield paper
+        finally:
+            await response.aclose()
+
+    async def search_arxiv(self, query: str, max_results: int = 50, sort_by: str = "submittedDate",
+                           raise_errors: bool = False) -> List[Dict]:
+        """Search arXiv; errors are logged and give no results unless ``raise_errors``"""
+        try:
+            return [paper async for paper in self.stream_papers(
+                "arxiv", self.arxiv_url, arxiv_params(query, max_results, sort_by), ArxivFeedParser()
+            )]
+        except Exception as e:
+            if raise_errors:
+                raise
+            print(f"Error fetching from arXiv: {e}")
+            return []
+
+    async def recent_arxiv(self, category: Optional[str] = None, max_results: int = 50,
+                           raise_errors: bool = False) -> List[Dict]:
+        """Recently submitted arXiv papers, optionally in one category"""
+        query = f"cat:{category}" if category else "all"
+        return await self.search_arxiv(query, max_results=max_results, sort_by="submittedDate",
+                                       raise_errors=raise_errors)
+
+    async def search_pubmed(self, query: str, max_results: int = 50, sort: Optional[str] = None,
+                            raise_errors: bool = False) -> List[Dict]:
+        """Search PubMed (esearch for ids, then efetch); errors are logged and give no results unless ``raise_errors``"""
+        try:
+            response = await self.get("pubmed", f"{self.pubmed_url}/esearch.fcgi",
+                                      pubmed_search_params(query, max_results, sort=sort))
+            pmids = response.json().get("esearchresult", {}).get("idlist", [])
+            if not pmids:
+                return []
+            return [paper async for paper in self.stream_papers(
+                "pubmed", f"{self.pubmed_url}/efetch.fcgi", pubmed_fetch_params(pmids), PubmedArticleParser(pmids)
+            )]
+        except Exception as e:
+            if raise_errors:
+                raise
+            print(f"Error fetching from PubMed: {e}")
+            return []
+
+    async def recent_pubmed(self, query: str, max_results: int = 50, raise_errors: bool = False) -> List[Dict]:
+        """The most recently published PubMed papers matching a query"""
+        return await self.search_pubmed(query, max_results=max_results, sort="pub_date", raise_errors=raise_errors)
+
+    # --- paging (bulk harvests); these raise on failure ---------------------
+
+    async def arxiv_page(self, query: str, start: int, size: int) -> Tuple[List[Dict], Optional[int]]:
+        """
+        One page of an arXiv search and the total the feed reports
+
+        Oldest submissions first, so pages do not shift as new papers arrive.
+        """
+        parser = ArxivFeedParser()
+        papers = [paper async for paper in self.stream_papers(
+            "arxiv", self.arxiv_url, arxiv_params(query, size, "submittedDate", start, sort_order="ascending"), parser
+        )]
+        return papers, parser.total
+
+    async def pubmed_history(self, query: str, sort: Optional[str] = None) -> Tuple[str, str, int]:
+        """Run a PubMed search on the history server: (WebEnv, query_key, result count)"""
+        response = await self.get("pubmed", f"{self.pubmed_url}/esearch.fcgi",
+                                  pubmed_search_params(query, 0, use_history=True, sort=sort))
+        result = response.json()["esearchresult"]
+        return result["webenv"], result["querykey"], int(result["count"])
+
+    async def pubmed_page(self, web_env: str, query_key: str, start: int, size: int) -> List[Dict]:
+        """One page of a PubMed result set kept on the history server"""
+        return [paper async for paper in self.stream_papers(
+            "pubmed", f"{self.pubmed_url}/efetch.fcgi", pubmed_history_fetch_params(web_env, query_key, start, size),
+            PubmedArticleParser()
+        )]
+
+    async def search_sources(self, query: str, sources: List[str], max_per_source: int = 20) -> List[Dict]:
+        """Search every requested source concurrently; results in arXiv, PubMed order"""
+        tasks = []
+        if "arxiv" in sources:
+            tasks.append(self.search_arxiv(query, max_results=max_per_source))
+        if "pubmed" in sources:
+            tasks.append(self.search_pubmed(query, max_results=max_per_source))
+        return [paper for papers in await asyncio.gather(*tasks) for paper in papers]
+
+    async def fetch_recent_papers(self, sources: List[str] = ["arxiv"], max_per_source: int = 20) -> List[Dict]:
+        """Recent papers from every requested source, fetched concurrently"""
+        tasks = []
+        if "arxiv" in sources:
+            tasks.append(self.recent_arxiv(max_results=max_per_source))
+        if "pubmed" in sources:
+            tasks.append(self.search_pubmed(PUBMED_RECENT_QUERY, max_results=max_per_source))
+        return [paper for papers in await asyncio.gather(*tasks) for paper in papers]
+
+    def stats(self) -> Dict:
+        return {source: dict(counters) for source, counters in self.counters.items()}
+
+
+# Global instance
+async_fetcher = AsyncPaperFetcher()
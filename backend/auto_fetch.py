@@ -1,13 +1,18 @@
 """
 Auto-fetch new articles from external sources
+
+The periodic fetch jobs (fetch_arxiv_category, fetch_pubmed_query) are
+run by scheduler.py.
 """
-import asyncio
 from datetime import datetime, timedelta
+from typing import Dict, List
 from sqlalchemy.orm import Session
-from database import SessionLocal
 from models import Paper
 from paper_fetchers import PaperFetcherService, ArxivFetcher
+from async_fetchers import async_fetcher
 from smart_tagger import SmartTagger
+from ingest import save_new_papers
+from ingest_pipeline import ingest_pipeline
 import time
 
 class AutoFetcher:
@@ -25,52 +30,15 @@ class AutoFetcher:
             db: Database session
             max_papers: Maximum number of papers to fetch
         """
+        print(f"[AutoFetch] Starting to fetch new papers at {datetime.now()}")
+        
+        # Fetch recent papers from arXiv
+        return self.save_papers(db, ArxivFetcher.get_recent(max_results=max_papers))
+    
+    def save_papers(self, db: Session, papers: List[Dict]) -> int:
+        """Tag and save fetched papers that are not in the database yet"""
         try:
-            print(f"[AutoFetch] Starting to fetch new papers at {datetime.now()}")
-            
-            # Fetch recent papers from arXiv
-            arxiv_papers = ArxivFetcher.get_recent(max_results=max_papers)
-            
-            saved_count = 0
-            for paper_data in arxiv_papers:
-                # Check if paper already exists (by title)
-                existing = db.query(Paper).filter(
-                    Paper.title == paper_data.get("title", "")
-                ).first()
-                
-                if existing:
-                    continue  # Skip duplicates
-                
-                # Ensure required fields
-                if not paper_data.get("title") or not paper_data.get("abstract"):
-                    continue
-                
-                # Apply smart tagging
-                tag_result = self.smart_tagger.tag_paper(
-                    title=paper_data.get("title", ""),
-                    abstract=paper_data.get("abstract", ""),
-                    existing_keywords=paper_data.get("keywords")
-                )
-                
-                # Create paper
-                db_paper = Paper(
-                    title=paper_data.get("title", ""),
-                    authors=paper_data.get("authors", ""),
-                    abstract=paper_data.get("abstract", ""),
-                    venue=paper_data.get("venue", "arXiv"),
-                    year=paper_data.get("year"),
-                    url=paper_data.get("url", ""),
-                    doi=paper_data.get("doi"),
-                    keywords=tag_result["keywords"],
-                    smart_tags=tag_result["smart_tags"],
-                    domains=", ".join(tag_result["domains"]) if tag_result["domains"] else None,
-                    citation_count=paper_data.get("citation_count", 0)
-                )
-                
-                db.add(db_paper)
-                saved_count += 1
-            
-            db.commit()
+            saved_count = save_new_papers(db, papers)
             self.last_fetch_time = datetime.now()
             print(f"[AutoFetch] Saved {saved_count} new papers")
             return saved_count
@@ -83,17 +51,21 @@ class AutoFetcher:
 # Global instance
 auto_fetcher = AutoFetcher()
 
-async def periodic_fetch():
-    """Periodically fetch new papers"""
-    while True:
-        try:
-            db = SessionLocal()
-            try:
-                auto_fetcher.fetch_and_save_new_papers(db, max_papers=30)
-            finally:
-                db.close()
-        except Exception as e:
-            print(f"[AutoFetch] Error in periodic fetch: {e}")
-        
-        # Wait 1 hour before next fetch
-        await asyncio.sleep(3600)
+async def _save_fetched(papers: List[Dict], default_venue: str) -> int:
+    # Tagging and writes run in the ingest pipeline, off the event loop
+    saved_count = await ingest_pipeline.ingest(papers, default_venue=default_venue)
+    auto_fetcher.last_fetch_time = datetime.now()
+    print(f"[AutoFetch] Saved {saved_count} of {len(papers)} fetched papers")
+    return saved_count
+
+async def fetch_arxiv_category(category: str, max_results: int = 50) -> int:
+    """Fetch the latest papers of an arXiv category and save the new ones; raises if the fetch fails"""
+    print(f"[AutoFetch] Fetching recent arXiv papers in {category} at {datetime.now()}")
+    papers = await async_fetcher.recent_arxiv(category, max_results=max_results, raise_errors=True)
+    return await _save_fetched(papers, "arXiv")
+
+async def fetch_pubmed_query(query: str, max_results: int = 50) -> int:
+    """Fetch the latest PubMed papers matching a query and save the new ones; raises if the fetch fails"""
+    print(f"[AutoFetch] Fetching recent PubMed papers for {query!r} at {datetime.now()}")
+    papers = await async_fetcher.recent_pubmed(query, max_results=max_results, raise_errors=True)
+    return await _save_fetched(papers, "PubMed")
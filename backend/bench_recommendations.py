@@ -0,0 +1,173 @@
+"""
+Benchmark recommendation scoring: 100k papers x 500 interactions by default
+
+Compares the vectorized RecommendationEngine with the previous scoring
+loop (np.where per interaction, one query per candidate paper for the
+boosts, a full sort, one query per result). Both run on the same TF-IDF
+vectors in a throwaway SQLite database, so the difference is the scoring
+path alone.
+
+Usage:
+    python bench_recommendations.py
+    python bench_recommendations.py --papers 100000 --interactions 500 --repeat 5 --legacy-repeat 1
+    python bench_recommendations.py --papers 20000 --legacy-repeat 0 --graph
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from models import Paper, User, UserPaperInteraction, InteractionStatus
+from recommendation_engine import RecommendationEngine
+from similarity_graph import SimilarityGraph
+
+WORDS = (
+    "neural network transformer attention vision image protein graph reinforcement policy "
+    "robot privacy security language model learning optimization theory cancer gene cell "
+    "diffusion retrieval federated quantum causal inference benchmark dataset sparse kernel "
+    "bayesian variational sampling convex stochastic gradient adversarial robustness fairness"
+).split()
+DOMAINS = ["machine learning", "nlp", "computer vision", "security", "biology", "robotics", "theory"]
+STATUSES = [InteractionStatus.READ, InteractionStatus.STUDIED, InteractionStatus.CITED,
+            InteractionStatus.IMPLEMENTED, InteractionStatus.READING]
+
+
+def populate(session_factory, n_papers: int, n_interactions: int) -> int:
+    """Insert synthetic papers and a user with ``n_interactions`` interactions; return the user id"""
+    rng = random.Random(n_papers)
+    batch = 20000
+    with session_factory() as db:
+        for start in range(0, n_papers, batch):
+            rows = []
+            for i in range(start, min(n_papers, start + batch)):
+                words = rng.sample(WORDS, 8)
+                rows.append({
+                    "title": f"{words[0].title()} {words[1]} for {words[2]}",
+                    "authors": f"Author {i % 997}",
+                    "abstract": " ".join(rng.choice(WORDS) for _ in range(120)),
+                    "year": 2000 + i % 25,
+                    "keywords": ", ".join(words[3:7]),
+                    "domains": ", ".join(rng.sample(DOMAINS, 2)),
+                    "citation_count": rng.randint(0, 1000),
+                })
+            db.execute(insert(Paper), rows)
+
+        user = User(username="bench", email="bench@example.com", preferred_domains="security, biology",
+                    research_interests="protein graph learning, privacy attacks")
+        db.add(user)
+        db.flush()
+        paper_ids = rng.sample(range(1, n_papers + 1), n_interactions)
+        db.execute(insert(UserPaperInteraction), [
+            {"user_id": user.id, "paper_id": pid, "status": rng.choice(STATUSES), "rating": rng.randint(1, 5)}
+            for pid in paper_ids
+        ])
+        db.commit()
+        return user.id
+
+
+def legacy_recommendations(engine: RecommendationEngine, user_id: int, db, limit: int):
+    """The scoring loop get_recommendations used before vectorization"""
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    vectors = engine.tfidf.snapshot()
+    paper_vectors, paper_ids = vectors.matrix, vectors.paper_ids
+    user = db.query(User).filter(User.id == user_id).first()
+    interactions = db.query(UserPaperInteraction).filter(UserPaperInteraction.user_id == user_id).all()
+    interacted_paper_ids = {interaction.paper_id for interaction in interactions}
+
+    user_vector = None
+    for interaction in interactions:
+        if interaction.paper_id in paper_ids:
+            idx = np.where(paper_ids == interaction.paper_id)[0][0]
+            weight = engine._interaction_weight(interaction)
+            if user_vector is None:
+                user_vector = paper_vectors[idx] * weight
+            else:
+                user_vector += paper_vectors[idx] * weight
+    user_vector = user_vector / np.linalg.norm(user_vector.toarray())
+    similarities = cosine_similarity(user_vector, paper_vectors)[0]
+
+    recommendations = []
+    for idx, paper_id in enumerate(paper_ids.tolist()):
+        if paper_id not in interacted_paper_ids:
+            score = float(similarities[idx])
+            paper = db.query(Paper).filter(Paper.id == paper_id).first()
+            if paper and user:
+                user_domains = [d.strip().lower() for d in user.preferred_domains.split(',')]
+                paper_domains = [d.strip().lower() for d in paper.domains.split(',')]
+                if any(domain in paper_domains for domain in user_domains):
+                    score *= 1.3
+                user_interests = user.research_interests.lower()
+                if any(keyword in user_interests for keyword in paper.keywords.lower().split(',')
+                       if len(keyword.strip()) > 3):
+                    score *= 1.2
+            recommendations.append((paper_id, score))
+    recommendations.sort(key=lambda x: x[1], reverse=True)
+    return [db.query(Paper).filter(Paper.id == pid).first() for pid, _ in recommendations[:limit]]
+
+
+def timed(fn, repeat: int) -> float:
+    """Median wall-clock milliseconds over ``repeat`` calls"""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.median(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--papers", type=int, default=100000)
+    parser.add_argument("--interactions", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--legacy-repeat", type=int, default=1, help="0 skips the old scoring loop")
+    parser.add_argument("--graph", action="store_true", help="also build the similarity graph and time lookups")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_recommendations_")
+    try:
+        db_engine = create_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        Base.metadata.create_all(bind=db_engine)
+        session_factory = sessionmaker(bind=db_engine)
+
+        start = time.perf_counter()
+        user_id = populate(session_factory, args.papers, args.interactions)
+        engine = RecommendationEngine()
+        with session_factory() as db:
+            engine.tfidf.sync(db, force=True)
+            print(f"{args.papers:,} papers, {args.interactions} interactions "
+                  f"(setup {time.perf_counter() - start:.1f}s)")
+
+            ms = timed(lambda: engine.get_recommendations(user_id, db, args.limit), args.repeat)
+            print(f"  get_recommendations:          {ms:9.1f} ms")
+            some_paper = int(engine.tfidf.snapshot().paper_ids[0])
+            ms = timed(lambda: engine._live_similar_papers(some_paper, db, args.limit), args.repeat)
+            print(f"  get_similar_papers (live):    {ms:9.1f} ms")
+
+            if args.graph:
+                engine.similarity = SimilarityGraph(engine.tfidf, directory=os.path.join(workdir, "similarity_graph"))
+                start = time.perf_counter()
+                engine.similarity.update(db, force=True)
+                print(f"  similarity graph build:       {time.perf_counter() - start:9.1f} s")
+                ms = timed(lambda: engine.get_similar_papers(some_paper, db, args.limit), args.repeat)
+                print(f"  get_similar_papers (graph):   {ms:9.1f} ms")
+
+            if args.legacy_repeat:
+                ms = timed(lambda: legacy_recommendations(engine, user_id, db, args.limit), args.legacy_repeat)
+                print(f"  get_recommendations (legacy): {ms:9.1f} ms")
+        db_engine.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Benchmark per-request memory and latency of /api/papers?search= as the catalogue grows
+
+Compares the old path (load every Paper row, then rank) with the indexed
+path used by get_papers (rank on the persisted embedding store, hydrate
+the top-k rows with one IN query). Each catalogue size gets its own
+throwaway SQLite database and embedding store.
+
+A deterministic hashing encoder stands in for the sentence-transformers
+model so the numbers measure the search path rather than model inference,
+and store rows are filled with random unit vectors instead of encoding a
+million abstracts.
+
+Usage:
+    python bench_search.py
+    python bench_search.py --sizes 10000 100000 1000000 --queries 20 --legacy-max 100000
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zlib
+from typing import List
+
+import numpy as np
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from ann_index import ExactIndex
+from models import Paper
+from semantic_search import SemanticSearchEngine
+
+DIM = 384
+WORDS = (
+    "neural network transformer attention vision image protein graph reinforcement policy "
+    "robot privacy security language model learning optimization theory cancer gene cell "
+    "diffusion retrieval federated quantum causal inference benchmark dataset sparse kernel"
+).split()
+QUERIES = [
+    "transformer attention", "protein structure", "graph neural network", "reinforcement learning policy",
+    "privacy attack", "diffusion model", "causal inference", "quantum kernel", "federated learning",
+    "retrieval benchmark",
+]
+
+
+class HashingEncoder:
+    """Stand-in for SentenceTransformer: bag of hashed words projected to DIM"""
+
+    def __init__(self):
+        self.projection = np.random.default_rng(0).normal(size=(4096, DIM)).astype(np.float32)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return DIM
+
+    def encode(self, texts: List[str], batch_size: int = 64, show_progress_bar: bool = False) -> np.ndarray:
+        out = np.zeros((len(texts), DIM), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                out[i] += self.projection[zlib.crc32(word.encode()) % 4096]
+        return out
+
+
+def populate(session_factory, engine: SemanticSearchEngine, size: int):
+    """Insert ``size`` synthetic papers and matching store rows"""
+    rng = random.Random(size)
+    batch = 20000
+    with session_factory() as db:
+        for start in range(0, size, batch):
+            rows = []
+            for i in range(start, min(size, start + batch)):
+                words = rng.sample(WORDS, 8)
+                rows.append({
+                    "title": f"{words[0].title()} {words[1]} for {words[2]} ({i})",
+                    "authors": f"Author {i % 997}, Author {i % 389}",
+                    "abstract": " ".join(rng.choice(WORDS) for _ in range(120)),
+                    "venue": rng.choice(["NeurIPS", "ICML", "Nature", "arXiv"]),
+                    "year": 2000 + i % 25,
+                    "keywords": ", ".join(words[3:7]),
+                    "domains": rng.choice(["machine learning", "nlp, machine learning", "computer vision"]),
+                    "citation_count": rng.randint(0, 1000),
+                })
+            db.execute(insert(Paper), rows)
+        db.commit()
+
+        ids = [pid for (pid,) in db.query(Paper.id).order_by(Paper.id)]
+        vectors_rng = np.random.default_rng(size)
+        for start in range(0, len(ids), batch):
+            chunk = ids[start:start + batch]
+            engine.store.upsert(chunk, [b"\0" * 16] * len(chunk), vectors_rng.normal(size=(len(chunk), DIM)))
+        # Baseline the change tracker so searches do not try to re-encode
+        engine.tracker.changes(db, force=True)
+        engine.store.flush(engine.tracker.state())
+
+
+def measure(fn, queries: List[str]):
+    """Median latency (ms) and max tracemalloc peak (MB) over the queries"""
+    latencies, peaks = [], []
+    for query in queries:
+        tracemalloc.start()
+        start = time.perf_counter()
+        results = fn(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 2 ** 20)
+        tracemalloc.stop()
+        assert results, f"no results for {query!r}"
+    return float(np.median(latencies)), max(peaks)
+
+
+def run(size: int, n_queries: int, limit: int, legacy_max: int):
+    workdir = tempfile.mkdtemp(prefix="bench_search_")
+    try:
+        db_engine = create_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        Base.metadata.create_all(bind=db_engine)
+        session_factory = sessionmaker(bind=db_engine)
+
+        engine = SemanticSearchEngine(store_dir=os.path.join(workdir, "embeddings"))
+        engine.model = HashingEncoder()
+        engine._open_store()
+
+        start = time.perf_counter()
+        populate(session_factory, engine, size)
+        # Build the ANN index up front so it does not run during measurement
+        engine.ann.maybe_rebuild()
+        while engine.ann._building:
+            time.sleep(0.1)
+        print(f"\n{size:>9,} papers (setup {time.perf_counter() - start:.1f}s)")
+
+        queries = [QUERIES[i % len(QUERIES)] for i in range(n_queries)]
+        with session_factory() as db:
+            def indexed(query):
+                return engine.search_papers(query, db, top_k=limit)
+
+            ms, mb = measure(indexed, queries)
+            print(f"  indexed ({type(engine.ann.active).__name__}): {ms:8.1f} ms/request  {mb:8.1f} MB peak")
+
+            if size <= legacy_max:
+                exact = ExactIndex(engine.store)
+
+                def legacy(query):
+                    # The previous get_papers: hydrate the whole table, rank, map back
+                    db.expunge_all()
+                    papers = db.query(Paper).all()
+                    paper_map = {paper.id: paper for paper in papers}
+                    ranked = exact.search(engine._encode_query(query), limit)
+                    return [paper_map[pid] for pid, _ in ranked if pid in paper_map]
+
+                ms, mb = measure(legacy, queries[:max(1, n_queries // 4)])
+                print(f"  legacy:  {ms:8.1f} ms/request  {mb:8.1f} MB peak")
+            else:
+                print("  legacy:  skipped (above --legacy-max)")
+        db_engine.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=300, help="page size, as in get_papers")
+    parser.add_argument("--legacy-max", type=int, default=100000,
+                        help="largest catalogue to run the load-everything path on")
+    args = parser.parse_args()
+
+    print(f"limit={args.limit}, queries={args.queries}")
+    for size in args.sizes:
+        run(size, args.queries, args.limit, args.legacy_max)
+
+
+if __name__ == "__main__":
+    main()
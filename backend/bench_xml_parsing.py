@@ -0,0 +1,203 @@
+"""
+Benchmark parse throughput and memory of the arXiv / PubMed response parsers
+
+Compares the previous approach (ET.fromstring on the whole body, then
+repeated find() calls per field) with the streaming parsers in
+paper_fetchers.py, which read the body in chunks and drop each record once
+it is turned into a paper dict. Both parse the same recorded response
+files and must produce the same papers.
+
+By default fixtures are recorded from the generators in
+stub_fetch_server.py (same formats as the real services) at each size.
+Real responses saved with e.g.
+    curl -o efetch.xml "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pubmed&id=...&retmode=xml"
+can be passed with --fixtures; the kind is detected from the root element.
+
+Usage:
+    python bench_xml_parsing.py
+    python bench_xml_parsing.py --sizes 100 1000 10000 --repeat 3
+    python bench_xml_parsing.py --fixtures arxiv.xml efetch.xml
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from paper_fetchers import PARSE_CHUNK_SIZE, iter_arxiv_feed, iter_pubmed_articles
+from stub_fetch_server import _pmid, arxiv_feed, pubmed_articles
+
+
+def tree_parse_arxiv(content: bytes) -> List[Dict]:
+    """The previous arXiv parser: one element tree, several finds per field"""
+    root = ET.fromstring(content)
+    namespace = {'atom': 'http://www.w3.org/2005/Atom'}
+    papers = []
+    for entry in root.findall('atom:entry', namespace):
+        paper = {
+            "title": entry.find('atom:title', namespace).text.strip().replace('\n', ' ') if entry.find('atom:title', namespace) is not None else "",
+            "authors": ", ".join([author.find('atom:name', namespace).text for author in entry.findall('atom:author', namespace) if author.find('atom:name', namespace) is not None]),
+            "abstract": entry.find('atom:summary', namespace).text.strip().replace('\n', ' ') if entry.find('atom:summary', namespace) is not None else "",
+            "url": entry.find('atom:id', namespace).text if entry.find('atom:id', namespace) is not None else "",
+            "doi": None,
+            "venue": "arXiv",
+            "year": None,
+            "keywords": None,
+            "citation_count": 0
+        }
+        published = entry.find('atom:published', namespace)
+        if published is not None and published.text:
+            paper["year"] = datetime.fromisoformat(published.text.replace('Z', '+00:00')).year
+        categories = [cat.get('term') for cat in entry.findall('atom:category', namespace)]
+        if categories:
+            paper["keywords"] = ", ".join(categories[:5])
+        papers.append(paper)
+    return papers
+
+
+def tree_parse_pubmed(content: bytes) -> List[Dict]:
+    """The previous PubMed parser: one element tree, a subtree search per field"""
+    root = ET.fromstring(content)
+    papers = []
+    for article in root.findall('.//PubmedArticle'):
+        title_elem = article.find('.//ArticleTitle')
+        authors = []
+        for author in article.findall('.//Author'):
+            last_name = author.find('LastName')
+            first_name = author.find('FirstName')
+            if last_name is not None:
+                name = last_name.text
+                if first_name is not None:
+                    name += f" {first_name.text}"
+                authors.append(name)
+        abstract_elem = article.find('.//AbstractText')
+        year = None
+        pub_date = article.find('.//PubDate')
+        if pub_date is not None:
+            year_elem = pub_date.find('Year')
+            if year_elem is not None:
+                year = int(year_elem.text)
+        doi = None
+        for article_id in article.findall('.//ArticleId'):
+            if article_id.get('IdType') == 'doi':
+                doi = article_id.text
+                break
+        journal_elem = article.find('.//Journal')
+        venue = None
+        if journal_elem is not None:
+            journal_title = journal_elem.find('Title')
+            if journal_title is not None:
+                venue = journal_title.text
+        keywords = [mesh.text for mesh in article.findall('.//DescriptorName')[:5] if mesh.text]
+        pmid_elem = article.find('.//PMID')
+        pmid = pmid_elem.text if pmid_elem is not None else ""
+        papers.append({
+            "title": title_elem.text if title_elem is not None else "",
+            "authors": ", ".join(authors[:10]),
+            "abstract": abstract_elem.text if abstract_elem is not None else "",
+            "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}" if pmid else None,
+            "doi": doi,
+            "venue": venue or "PubMed",
+            "year": year,
+            "keywords": ", ".join(keywords) if keywords else None,
+            "citation_count": 0
+        })
+    return papers
+
+
+def record_fixtures(directory: str, sizes: List[int]) -> List[str]:
+    """Write generated arXiv and PubMed responses of each size to ``directory``"""
+    paths = []
+    for size in sizes:
+        for name, body in (("arxiv", arxiv_feed("cat:cs.LG", size, total=size)),
+                           ("pubmed", pubmed_articles([_pmid("bench", i) for i in range(size)]))):
+            path = os.path.join(directory, f"{name}_{size}.xml")
+            with open(path, "wb") as f:
+                f.write(body)
+            paths.append(path)
+    return paths
+
+
+def fixture_kind(path: str) -> str:
+    for _, elem in ET.iterparse(path, events=("start",)):
+        return "arxiv" if elem.tag.endswith("feed") else "pubmed"
+
+
+def read_whole(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def read_chunks(path: str):
+    """The file as a stream of chunks, like an HTTP body being read"""
+    with open(path, "rb") as f:
+        yield from iter(lambda: f.read(PARSE_CHUNK_SIZE), b"")
+
+
+def measure(parse: Callable[[], List[Dict]], repeat: int):
+    """(best seconds, tracemalloc peak MB, papers) over ``repeat`` runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        papers = parse()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    parse()
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return best, peak, papers
+
+
+def run(path: str, repeat: int):
+    kind = fixture_kind(path)
+    megabytes = os.path.getsize(path) / 2 ** 20
+    if kind == "arxiv":
+        tree = lambda: tree_parse_arxiv(read_whole(path))
+        stream = lambda: list(iter_arxiv_feed(read_chunks(path)))
+        # Count records without keeping them, as an ingest consumer would
+        consume = lambda: [sum(1 for _ in iter_arxiv_feed(read_chunks(path)))]
+    else:
+        tree = lambda: tree_parse_pubmed(read_whole(path))
+        stream = lambda: list(iter_pubmed_articles(read_chunks(path)))
+        consume = lambda: [sum(1 for _ in iter_pubmed_articles(read_chunks(path)))]
+
+    print(f"\n{os.path.basename(path)} ({kind}, {megabytes:.1f} MB)")
+    tree_s, tree_mb, expected = measure(tree, repeat)
+    stream_s, stream_mb, papers = measure(stream, repeat)
+    consume_s, consume_mb, _ = measure(consume, repeat)
+    assert papers == expected, "streaming parser output differs from the tree parser"
+    for label, seconds, peak in (("tree (fromstring + find)", tree_s, tree_mb),
+                                 ("streaming, list", stream_s, stream_mb),
+                                 ("streaming, consumed", consume_s, consume_mb)):
+        print(f"  {label:<26} {len(expected) / seconds:>10,.0f} records/s  {megabytes / seconds:7.1f} MB/s"
+              f"  {peak:8.1f} MB peak")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="records per generated fixture")
+    parser.add_argument("--fixtures", nargs="+", help="recorded response files to parse instead")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = None
+    try:
+        if args.fixtures:
+            paths = args.fixtures
+        else:
+            workdir = tempfile.mkdtemp(prefix="bench_xml_")
+            paths = record_fixtures(workdir, args.sizes)
+        for path in paths:
+            run(path, args.repeat)
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Persistent, memory-mapped store for paper embeddings
+"""
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from numpy.lib.format import open_memmap
+
+
+class EmbeddingStore:
+    """
+    Embedding matrix on disk with an id -> row map.
+
+    Rows are L2-normalised so cosine similarity is a plain dot product.
+    Each row carries a content hash of the text it was encoded from, which
+    lets callers re-encode only papers that are new or whose text changed.
+    Layout of ``directory``:
+
+        vectors.npy   (capacity, dim) float16/float32, memory-mapped
+        ids.npy       (capacity,) int64 paper ids
+        hashes.npy    (capacity,) 16-byte content hashes
+        meta.json     row count, dim, dtype, model name, tracker state
+    """
+
+    HASH_DTYPE = np.dtype("S16")
+    MIN_CAPACITY = 1024
+
+    def __init__(self, directory: str, dim: int, model_name: str, dtype: str = "float16"):
+        self.directory = directory
+        self.dim = dim
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self.tracker_state: Dict = {}
+        self.row_of: Dict[int, int] = {}
+        self._vectors = None
+        self._ids = None
+        self._hashes = None
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def content_hash(text: str) -> bytes:
+        """Hash of the text a paper embedding was computed from"""
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        """Open an existing store, or start an empty one if it is missing or incompatible"""
+        meta_path = self._path("meta.json")
+        meta = None
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Embedding store metadata unreadable, rebuilding: {e}")
+
+        compatible = (
+            meta is not None
+            and meta.get("dim") == self.dim
+            and meta.get("dtype") == self.dtype.name
+            and meta.get("model") == self.model_name
+        )
+        if compatible:
+            try:
+                self._vectors = np.load(self._path("vectors.npy"), mmap_mode="r+")
+                self._ids = np.load(self._path("ids.npy"), mmap_mode="r+")
+                self._hashes = np.load(self._path("hashes.npy"), mmap_mode="r+")
+                self.count = int(meta["count"])
+                self.tracker_state = meta.get("tracker", {})
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Embedding store files unreadable, rebuilding: {e}")
+                compatible = False
+
+        if not compatible:
+            self._allocate(self.MIN_CAPACITY)
+            self.count = 0
+            self.tracker_state = {}
+            self.flush()
+
+        self.row_of = {int(pid): row for row, pid in enumerate(self._ids[:self.count])}
+        if len(self.row_of) != self.count:
+            # An interrupted delete can leave a paper in two rows; keep one copy
+            self._compact()
+        print(f"Loaded embedding store with {self.count} papers from {self.directory}")
+
+    def _allocate(self, capacity: int, keep: int = 0):
+        """(Re)create the backing files with room for ``capacity`` rows, keeping the first ``keep``"""
+        for attr, name, shape, dtype in (
+            ("_vectors", "vectors.npy", (capacity, self.dim), self.dtype),
+            ("_ids", "ids.npy", (capacity,), np.dtype(np.int64)),
+            ("_hashes", "hashes.npy", (capacity,), self.HASH_DTYPE),
+        ):
+            path = self._path(name)
+            tmp_path = path + ".tmp"
+            arr = open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape)
+            previous = getattr(self, attr)
+            if previous is not None and keep:
+                arr[:keep] = previous[:keep]
+            arr.flush()
+            del arr
+            setattr(self, attr, None)
+            os.replace(tmp_path, path)
+            setattr(self, attr, np.load(path, mmap_mode="r+"))
+
+    def _compact(self):
+        rows = sorted(self.row_of.values())
+        self._vectors[:len(rows)] = self._vectors[rows]
+        self._ids[:len(rows)] = self._ids[rows]
+        self._hashes[:len(rows)] = self._hashes[rows]
+        self.count = len(rows)
+        self.row_of = {int(pid): row for row, pid in enumerate(self._ids[:self.count])}
+
+    @property
+    def capacity(self) -> int:
+        return self._ids.shape[0]
+
+    @property
+    def ids(self) -> np.ndarray:
+        """Paper ids, aligned with the rows of ``matrix``"""
+        return self._ids[:self.count]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Memory-mapped (count, dim) embedding matrix"""
+        return self._vectors[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, paper_id: int) -> bool:
+        return paper_id in self.row_of
+
+    def hash_of(self, paper_id: int) -> Optional[bytes]:
+        row = self.row_of.get(paper_id)
+        if row is None:
+            return None
+        # Raw bytes: numpy drops trailing NULs from an S16 scalar, and digests can end in one
+        return self._hashes[row:row + 1].tobytes()
+
+    def vectors_for(self, paper_ids: Iterable[int]) -> np.ndarray:
+        """Rows for the given ids (ids must be present)"""
+        rows = [self.row_of[pid] for pid in paper_ids]
+        return np.asarray(self._vectors[rows], dtype=np.float32)
+
+    def upsert(self, paper_ids: List[int], hashes: List[bytes], vectors: np.ndarray):
+        """Insert or overwrite embeddings; vectors are normalised here"""
+        if not paper_ids:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+
+        new_ids = [pid for pid in paper_ids if pid not in self.row_of]
+        needed = self.count + len(set(new_ids))
+        if needed > self.capacity:
+            capacity = self.capacity
+            while capacity < needed:
+                capacity *= 2
+            self._allocate(capacity, keep=self.count)
+
+        for pid, digest, vector in zip(paper_ids, hashes, vectors):
+            row = self.row_of.get(pid)
+            if row is None:
+                row = self.count
+                self.count += 1
+                self.row_of[pid] = row
+                self._ids[row] = pid
+            self._vectors[row] = vector
+            self._hashes[row] = digest
+
+    def remove(self, paper_ids: Iterable[int]):
+        """Delete embeddings, moving the last row into each freed slot"""
+        for pid in paper_ids:
+            row = self.row_of.pop(pid, None)
+            if row is None:
+                continue
+            last = self.count - 1
+            if row != last:
+                moved_id = int(self._ids[last])
+                self._vectors[row] = self._vectors[last]
+                self._ids[row] = moved_id
+                self._hashes[row] = self._hashes[last]
+                self.row_of[moved_id] = row
+            self.count = last
+
+    def flush(self, tracker_state: Optional[Dict] = None):
+        """Write rows to disk, then atomically publish the new row count"""
+        if tracker_state is not None:
+            self.tracker_state = tracker_state
+        for arr in (self._vectors, self._ids, self._hashes):
+            arr.flush()
+        meta = {
+            "count": self.count,
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "model": self.model_name,
+            "tracker": self.tracker_state,
+        }
+        tmp_path = self._path("meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path("meta.json"))
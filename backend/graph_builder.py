@@ -0,0 +1,210 @@
+"""
+Link construction for the /api/papers/graph visualisation
+"""
+import os
+import time
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import Query, Session
+
+from hybrid_search import SearchTimings
+from map_layout import layout_positions
+from models import Paper, UserPaperInteraction, InteractionStatus
+from topic_progression import TopicProgressionAnalyzer, PROGRESSION_MAX_PAPERS
+
+# Most links any one node gets from the domain and venue passes
+GRAPH_MAX_DEGREE = int(os.getenv("GRAPH_MAX_DEGREE", "15"))
+# Members of a domain or venue group that take part in its links
+GRAPH_DOMAIN_SAMPLE = int(os.getenv("GRAPH_DOMAIN_SAMPLE", "100"))
+GRAPH_VENUE_SAMPLE = int(os.getenv("GRAPH_VENUE_SAMPLE", "50"))
+
+
+def sample_group(paper_ids: List[int], size: int, salt: str = "") -> List[int]:
+    """
+    Up to ``size`` members of a group, in their original order
+
+    The sample is chosen by a hash of (salt, paper id), so the same group
+    yields the same sample on every request, and it does not depend on the
+    order the query happened to return.
+    """
+    if len(paper_ids) <= size:
+        return list(paper_ids)
+    chosen = set(sorted(paper_ids, key=lambda pid: zlib.crc32(f"{salt}:{pid}".encode()))[:size])
+    return [pid for pid in paper_ids if pid in chosen]
+
+
+class GraphBuilder:
+    """
+    Accumulates graph links over a fixed node set.
+
+    Pairs are de-duplicated with a set regardless of direction, the total
+    number of links is capped at ``max_links``, group links stop at
+    ``max_degree`` per node, and each group pass records its duration in
+    ``timings`` (rendered as a Server-Timing header).
+    """
+
+    def __init__(self, node_ids: Iterable[int], max_links: int,
+                 max_degree: int = GRAPH_MAX_DEGREE, timings: Optional[SearchTimings] = None):
+        self.nodes: Set[int] = set(node_ids)
+        self.max_links = max_links
+        self.max_degree = max_degree
+        self.timings = timings or SearchTimings()
+        self.links: List[Dict] = []
+        self.pairs: Set[Tuple[int, int]] = set()
+        self.degree: Counter = Counter()
+        self.counts: Counter = Counter()
+
+    @property
+    def full(self) -> bool:
+        return len(self.links) >= self.max_links
+
+    def add(self, source: int, target: int, link_type: str, value: float,
+            capped: bool = True, **extra) -> bool:
+        """Add a link unless it is a duplicate, a self-loop, off the node set or over a cap"""
+        if self.full or source == target or source not in self.nodes or target not in self.nodes:
+            return False
+        pair = (source, target) if source < target else (target, source)
+        if pair in self.pairs:
+            return False
+        if capped and (self.degree[source] >= self.max_degree or self.degree[target] >= self.max_degree):
+            return False
+        self.pairs.add(pair)
+        self.degree[source] += 1
+        self.degree[target] += 1
+        self.counts[link_type] += 1
+        self.links.append({"source": int(source), "target": int(target), "value": value, "type": link_type, **extra})
+        return True
+
+    def add_progression_links(self, links: List[Dict]):
+        """Topic progression links, added first and exempt from the degree cap"""
+        for link in links:
+            extra = {key: link[key] for key in ("progression_type", "similarity") if key in link}
+            self.add(link["source"], link["target"], link["type"], link["value"], capped=False, **extra)
+
+    def add_group_links(self, groups: Dict[str, List[int]], link_type: str, value: float,
+                        sample_size: int, per_node: int, window: Optional[int] = None):
+        """
+        Link members of each group (domain, venue, ...)
+
+        Each sampled member links to up to ``per_node`` later members, looking
+        at most ``window`` members ahead (all of them if None).
+        """
+        started = time.perf_counter()
+        for name, paper_ids in groups.items():
+            if self.full:
+                break
+            if len(paper_ids) < 2:
+                continue
+            members = sample_group(paper_ids, sample_size, salt=name)
+            for i, source in enumerate(members):
+                if self.full:
+                    break
+                connected = 0
+                stop = len(members) if window is None else i + 1 + window
+                for target in members[i + 1:stop]:
+                    if connected >= per_node or self.full:
+                        break
+                    if self.add(source, target, link_type, value):
+                        connected += 1
+        self.timings.record(link_type, started)
+
+
+def popular_papers_query(db: Session) -> Query:
+    """
+    Papers ranked by community engagement and citations (the anonymous graph)
+
+    Prioritizes papers that have been read/studied by users, combined with
+    high citation counts, in one ordered query.
+    """
+    # Engagement score based on user interactions
+    engagement = db.query(
+        UserPaperInteraction.paper_id,
+        func.sum(
+            case(
+                (UserPaperInteraction.status == InteractionStatus.CITED, 5),
+                (UserPaperInteraction.status == InteractionStatus.IMPLEMENTED, 4),
+                (UserPaperInteraction.status == InteractionStatus.STUDIED, 3),
+                (UserPaperInteraction.status == InteractionStatus.READ, 2),
+                (UserPaperInteraction.status == InteractionStatus.READING, 1),
+                else_=0
+            )
+        ).label('engagement_score')
+    ).group_by(UserPaperInteraction.paper_id).subquery()
+
+    return db.query(Paper).outerjoin(
+        engagement, Paper.id == engagement.c.paper_id
+    ).order_by(
+        # Combined score: engagement (weighted) + normalized citation count
+        (
+            func.coalesce(engagement.c.engagement_score, 0) * 10 +
+            func.coalesce(Paper.citation_count, 0) / 10.0
+        ).desc(),
+        Paper.citation_count.desc()
+    )
+
+
+def build_paper_graph(papers: List[Paper], db: Session, topic_progression: TopicProgressionAnalyzer,
+                      timings: Optional[SearchTimings] = None) -> Dict:
+    """Nodes and links of the graph visualisation for the given papers"""
+    timings = timings or SearchTimings()
+    # Precomputed map positions (unit square); papers not laid out yet have none
+    positions = layout_positions(db, [paper.id for paper in papers])
+    nodes = []
+    for paper in papers:
+        position = positions.get(paper.id)
+        nodes.append({
+            "id": int(paper.id),
+            "label": paper.title[:50] + "..." if len(paper.title) > 50 else paper.title,
+            "title": paper.title,
+            "authors": paper.authors or "",
+            "venue": paper.venue or "",
+            "year": int(paper.year) if paper.year else None,
+            "keywords": paper.keywords or "",
+            "url": paper.url or "",
+            "doi": paper.doi or "",
+            "group": paper.venue or "Other" if paper.venue else "Other",
+            "layout_x": position[0] if position else None,
+            "layout_y": position[1] if position else None,
+        })
+
+    # Links based on topic progression (primary) and other criteria
+    max_links = min(5000, len(papers) * 10)  # Cap at 5000 links or 10 per paper
+    graph = GraphBuilder((paper.id for paper in papers), max_links, timings=timings)
+    if papers:
+        try:
+            # 1. Topic progression paths (PRIMARY - most important)
+            if len(papers) <= PROGRESSION_MAX_PAPERS:
+                started = time.perf_counter()
+                graph.add_progression_links(
+                    topic_progression.create_progression_paths(papers, max_paths_per_paper=4, db=db)
+                )
+                timings.record("topic_progression", started)
+
+            # 2. Domain/topic-based links (for papers without progression paths)
+            domain_groups: Dict[str, List[int]] = {}
+            venue_groups: Dict[str, List[int]] = {}
+            for paper in papers:
+                if paper.domains:
+                    for domain in paper.domains.split(','):
+                        domain = domain.strip()
+                        if domain:
+                            domain_groups.setdefault(domain, []).append(paper.id)
+                if paper.venue:
+                    venue_groups.setdefault(paper.venue, []).append(paper.id)
+
+            # Connect each paper to at most 5 others in the same domain
+            graph.add_group_links(domain_groups, "domain", 1, sample_size=GRAPH_DOMAIN_SAMPLE, per_node=5)
+
+            # 3. Venue-based links (for additional context): the next 5 papers from the same venue
+            graph.add_group_links(venue_groups, "venue", 0.5, sample_size=GRAPH_VENUE_SAMPLE,
+                                  per_node=5, window=5)
+        except Exception as e:
+            print(f"Error creating links: {e}")
+            import traceback
+            traceback.print_exc()
+            # Continue without links if similarity fails
+
+    return {"nodes": nodes, "links": graph.links}
@@ -0,0 +1,192 @@
+"""
+Materialized paper-graph snapshot for anonymous /api/papers/graph requests
+
+Every anonymous visitor without a search sees the same graph, so it is
+built once, serialized and pre-compressed (gzip, and Brotli when the
+``brotli`` package is installed) and served with an ETag for conditional
+GETs. A background check rebuilds it once enough papers or interactions
+changed, or once anything changed and the snapshot is older than
+GRAPH_SNAPSHOT_MAX_AGE, and after every map layout pass (nodes carry
+their layout positions).
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from map_layout import layout_version
+from models import Paper, PaperLayout, UserPaperInteraction
+
+# Brotli is optional: without it snapshots are offered as gzip only
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+GRAPH_SNAPSHOT_LIMIT = int(os.getenv("GRAPH_SNAPSHOT_LIMIT", "2000"))
+# Changed papers + interactions that trigger a rebuild
+GRAPH_SNAPSHOT_MIN_CHANGES = int(os.getenv("GRAPH_SNAPSHOT_MIN_CHANGES", "25"))
+# Seconds after which any change triggers a rebuild
+GRAPH_SNAPSHOT_MAX_AGE = float(os.getenv("GRAPH_SNAPSHOT_MAX_AGE", "900"))
+# Seconds between checks for changes
+GRAPH_SNAPSHOT_CHECK_INTERVAL = float(os.getenv("GRAPH_SNAPSHOT_CHECK_INTERVAL", "30"))
+
+
+def catalogue_signature(db: Session) -> Dict:
+    """Row counts, max ids and last update times of papers and interactions, and the layout version"""
+    signature = {}
+    for name, model in (("papers", Paper), ("interactions", UserPaperInteraction)):
+        count, max_id, updated = db.query(func.count(model.id), func.max(model.id), func.max(model.updated_at)).one()
+        signature[name] = (count or 0, max_id or 0, updated)
+    # Nodes carry layout positions: placed papers, and the end of the last committed layout pass
+    count, max_id = db.query(func.count(PaperLayout.paper_id), func.max(PaperLayout.paper_id)).one()
+    signature["layout"] = (count or 0, max_id or 0, layout_version(db))
+    return signature
+
+
+def count_changes(old: Dict, new: Dict) -> int:
+    """Rough number of rows inserted, deleted or edited between two signatures"""
+    changes = 0
+    for name, (count, max_id, updated) in new.items():
+        old_count, old_max_id, old_updated = old[name]
+        changes += max(abs(count - old_count), max_id - old_max_id)
+        if updated != old_updated:
+            changes += 1
+    return changes
+
+
+class GraphSnapshot:
+    """One serialized graph and its pre-compressed encodings"""
+
+    def __init__(self, version: int, graph: Dict, signature: Dict):
+        body = json.dumps(graph, separators=(",", ":")).encode()
+        self.version = version
+        self.signature = signature
+        self.built_at = time.time()
+        self.n_nodes = len(graph["nodes"])
+        self.n_links = len(graph["links"])
+        # Derived from the content, so rebuilding an unchanged graph keeps clients' caches valid
+        self.etag = f'W/"{hashlib.sha1(body).hexdigest()[:20]}"'
+        self.encodings = {"identity": body, "gzip": gzip.compress(body, compresslevel=9)}
+        if BROTLI_AVAILABLE:
+            self.encodings["br"] = brotli.compress(body, quality=11)
+
+    def body_for(self, accept_encoding: str) -> Tuple[str, bytes]:
+        """Best (encoding, body) for an Accept-Encoding header"""
+        accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.encodings:
+                return encoding, self.encodings[encoding]
+        return "identity", self.encodings["identity"]
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """Does an If-None-Match header name this snapshot (weak comparison)"""
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or self.etag.removeprefix("W/") in tags
+
+
+class GraphSnapshotManager:
+    """Builds, refreshes and serves the anonymous graph snapshot"""
+
+    def __init__(self, build: Callable[[Session, int], Dict], limit: int = GRAPH_SNAPSHOT_LIMIT,
+                 min_changes: int = GRAPH_SNAPSHOT_MIN_CHANGES, max_age: float = GRAPH_SNAPSHOT_MAX_AGE,
+                 check_interval: float = GRAPH_SNAPSHOT_CHECK_INTERVAL):
+        self.build = build
+        self.limit = limit
+        self.min_changes = min_changes
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self._snapshot: Optional[GraphSnapshot] = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._last_check = 0.0
+        self.rebuilds = 0
+        self.not_modified = 0
+
+    def get(self, db: Session) -> GraphSnapshot:
+        """Current snapshot; built inline the first time, then refreshed in the background"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._rebuild(db, catalogue_signature(db))
+                return self._snapshot
+        self._schedule_check(db.get_bind())
+        return snapshot
+
+    def _schedule_check(self, bind):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval or (self._thread and self._thread.is_alive()):
+            return
+        self._last_check = now
+        self._thread = threading.Thread(target=self._check, args=(bind,), daemon=True)
+        self._thread.start()
+
+    def _check(self, bind):
+        with Session(bind=bind) as db:
+            try:
+                signature = catalogue_signature(db)
+                snapshot = self._snapshot
+                changes = count_changes(snapshot.signature, signature)
+                due = changes >= self.min_changes or time.time() - snapshot.built_at >= self.max_age
+                # New positions are served straight away, so the map never falls back to a browser simulation
+                moved = signature["layout"] != snapshot.signature["layout"]
+                if moved or (changes and due):
+                    with self._lock:
+                        self._rebuild(db, signature)
+            except Exception as e:
+                print(f"Error refreshing graph snapshot: {e}")
+
+    def _rebuild(self, db: Session, signature: Dict):
+        """Build a new snapshot (caller holds the lock); ``signature`` is read before building"""
+        started = time.perf_counter()
+        graph = self.build(db, self.limit)
+        self._version += 1
+        self._snapshot = GraphSnapshot(self._version, graph, signature)
+        self.rebuilds += 1
+        print(f"Built graph snapshot v{self._version}: {self._snapshot.n_nodes} nodes, "
+              f"{self._snapshot.n_links} links in {time.perf_counter() - started:.1f}s")
+
+    def respond(self, snapshot: GraphSnapshot, request: Request) -> Response:
+        """Serve a snapshot, honouring If-None-Match and Accept-Encoding"""
+        headers = {
+            "ETag": snapshot.etag,
+            "Vary": "Accept-Encoding",
+            # Cacheable, but revalidated on every use
+            "Cache-Control": "no-cache",
+            "X-Graph-Version": str(snapshot.version),
+        }
+        if snapshot.matches(request.headers.get("if-none-match")):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        encoding, body = snapshot.body_for(request.headers.get("accept-encoding", ""))
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def stats(self) -> Dict:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"built": False, "rebuilds": self.rebuilds}
+        return {
+            "built": True,
+            "version": snapshot.version,
+            "etag": snapshot.etag,
+            "built_at": snapshot.built_at,
+            "nodes": snapshot.n_nodes,
+            "links": snapshot.n_links,
+            "bytes": {encoding: len(body) for encoding, body in snapshot.encodings.items()},
+            "rebuilds": self.rebuilds,
+            "not_modified": self.not_modified,
+        }
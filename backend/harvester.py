@@ -0,0 +1,278 @@
+"""
+Bulk harvesting of arXiv and PubMed search results with resumable cursors
+
+A harvest pages through every result of one query: arXiv by ``start``
+offset (oldest submissions first, so pages stay put while new papers
+arrive), PubMed by ``retstart`` into a result set kept on the NCBI
+history server (esearch with ``usehistory``, sorted by publication date
+so a recreated set keeps its order). Up to HARVEST_CONCURRENCY
+pages of a source are in flight at once; the fetcher's per-source token
+bucket keeps the actual request rate within the source's limit.
+
+Fetched pages are saved through the staged ingest pipeline
+(ingest_pipeline.py), so tagging one window of pages runs on all cores
+while the next is fetched. Progress is stored per (source, query) in
+harvest_cursors and only advances over pages that were fetched and
+saved, in order, so an interrupted or failed run resumes where it
+stopped. Saving de-duplicates, so a page repeated after a crash is
+harmless. Run from the command line, the pipeline leaves embeddings to
+the API's semantic index sync.
+
+arXiv serves at most 30000 results per query: backfill larger sets as
+several queries, e.g. by submittedDate range.
+
+Usage:
+    python harvester.py arxiv "cat:cs.LG AND submittedDate:[202301010000 TO 202312312359]"
+    python harvester.py pubmed "deep learning[Title/Abstract]" --max-papers 50000
+    python harvester.py arxiv "cat:cs.LG" --restart
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from async_fetchers import AsyncPaperFetcher, async_fetcher
+from database import SessionLocal
+from ingest_pipeline import IngestPipeline, ingest_pipeline
+from models import HarvestCursor
+
+HARVEST_SOURCES = ("arxiv", "pubmed")
+HARVEST_CONCURRENCY = int(os.getenv("HARVEST_CONCURRENCY", "4"))
+# Most papers one API request may harvest (the CLI has no limit); resuming harvests the next slice
+HARVEST_MAX_PAPERS = int(os.getenv("HARVEST_MAX_PAPERS", "10000"))
+# PubMed result sets are ordered by publication date, newest first: when an expired
+# history session is recreated, papers added since only push records to later positions
+PUBMED_HARVEST_SORT = "pub_date"
+HARVEST_PAGE_SIZE = {
+    "arxiv": int(os.getenv("ARXIV_HARVEST_PAGE_SIZE", "500")),  # API maximum is 2000
+    "pubmed": int(os.getenv("PUBMED_HARVEST_PAGE_SIZE", "500")),
+}
+
+CURSOR_FIELDS = ("id", "source", "query", "position", "total", "web_env", "query_key",
+                 "fetched", "saved", "status", "last_error")
+
+
+def cursor_dict(cursor: HarvestCursor) -> Dict:
+    return {field: getattr(cursor, field) for field in CURSOR_FIELDS}
+
+
+class Harvester:
+    """Runs resumable bulk harvests; database work happens on worker threads"""
+
+    def __init__(self, fetcher: AsyncPaperFetcher = async_fetcher, concurrency: int = HARVEST_CONCURRENCY,
+                 page_sizes: Optional[Dict[str, int]] = None, session_factory=SessionLocal,
+                 pipeline: IngestPipeline = ingest_pipeline):
+        self.fetcher = fetcher
+        self.pipeline = pipeline
+        self.concurrency = concurrency
+        self.page_sizes = page_sizes or dict(HARVEST_PAGE_SIZE)
+        self.session_factory = session_factory
+        self.tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    # --- cursors ------------------------------------------------------------
+
+    def _open_cursor(self, source: str, query: str, restart: bool) -> Dict:
+        with self.session_factory() as db:
+            cursor = db.query(HarvestCursor).filter(
+                HarvestCursor.source == source, HarvestCursor.query == query
+            ).first()
+            if cursor is None:
+                cursor = HarvestCursor(source=source, query=query, position=0, fetched=0, saved=0)
+                db.add(cursor)
+            elif restart:
+                cursor.position, cursor.total, cursor.web_env, cursor.query_key = 0, None, None, None
+                cursor.fetched, cursor.saved, cursor.last_error = 0, 0, None
+            cursor.status = "running"
+            db.commit()
+            return cursor_dict(cursor)
+
+    def _update_cursor(self, cursor_id: int, **fields):
+        with self.session_factory() as db:
+            db.query(HarvestCursor).filter(HarvestCursor.id == cursor_id).update(fields)
+            db.commit()
+
+    def _advance_cursor(self, cursor_id: int, position: int, total: Optional[int], fetched: int, saved: int):
+        """Move the cursor past a saved page"""
+        with self.session_factory() as db:
+            db.query(HarvestCursor).filter(HarvestCursor.id == cursor_id).update({
+                "position": position,
+                "total": total,
+                "fetched": HarvestCursor.fetched + fetched,
+                "saved": HarvestCursor.saved + saved,
+            })
+            db.commit()
+
+    async def _wait_saved(self, cursor_id: int, submitted: List[Tuple[asyncio.Future, int, int]], position: int,
+                          total: Optional[int]) -> Tuple[int, int, Optional[str]]:
+        """
+        Wait for pages submitted to the pipeline, in order, advancing the cursor over each saved one
+
+        Returns the new position, papers saved and the first error; pages
+        after a failed one are not counted and will be fetched again.
+        """
+        saved_total, error = 0, None
+        for batches, next_position, fetched in submitted:
+            try:
+                saved = sum(await batches)
+            except Exception as e:
+                error = error or f"Saving page at {position} failed: {e}"
+                continue
+            if error is None:
+                saved_total += saved
+                position = next_position
+                await asyncio.to_thread(self._advance_cursor, cursor_id, position, total, fetched, saved)
+        return position, saved_total, error
+
+    def cursors(self) -> List[Dict]:
+        with self.session_factory() as db:
+            return [cursor_dict(cursor) for cursor in db.query(HarvestCursor).order_by(HarvestCursor.id)]
+
+    # --- harvesting ---------------------------------------------------------
+
+    async def _fetch_page(self, source: str, query: str, cursor: Dict, offset: int,
+                          size: int) -> Tuple[List[Dict], Optional[int]]:
+        if source == "arxiv":
+            return await self.fetcher.arxiv_page(query, offset, size)
+        return await self.fetcher.pubmed_page(cursor["web_env"], cursor["query_key"], offset, size), cursor["total"]
+
+    async def _refresh_history(self, cursor: Dict) -> int:
+        """
+        (Re)create the PubMed result set on the history server
+
+        Returns by how many records the set shrank: records deleted since
+        move earlier ones up, so resuming that much earlier skips nothing.
+        """
+        previous = cursor["total"]
+        cursor["web_env"], cursor["query_key"], cursor["total"] = await self.fetcher.pubmed_history(
+            cursor["query"], sort=PUBMED_HARVEST_SORT
+        )
+        await asyncio.to_thread(self._update_cursor, cursor["id"], web_env=cursor["web_env"],
+                                query_key=cursor["query_key"], total=cursor["total"])
+        return max(0, previous - cursor["total"]) if previous is not None else 0
+
+    async def harvest(self, source: str, query: str, max_papers: Optional[int] = None,
+                      restart: bool = False) -> Dict:
+        """
+        Fetch and save results of ``query`` from the stored cursor onwards
+
+        Stops at the end of the results, after ``max_papers`` papers, or at
+        the first page that fails; the returned cursor tells which.
+        """
+        if source not in HARVEST_SOURCES:
+            raise ValueError(f"Unknown harvest source: {source}")
+        cursor = await asyncio.to_thread(self._open_cursor, source, query, restart)
+        size = self.page_sizes[source]
+        position, total = cursor["position"], cursor["total"]
+        limit = position + max_papers if max_papers else None
+        started = time.perf_counter()
+        venue = "arXiv" if source == "arxiv" else "PubMed"
+        saved_run = 0
+        history_refreshed = False
+        error = None
+        try:
+            if source == "pubmed" and not cursor["web_env"]:
+                await self._refresh_history(cursor)
+                total, history_refreshed = cursor["total"], True
+
+            fetch_position = position  # End of the pages handed to the pipeline
+            submitted: List[Tuple[asyncio.Future, int, int]] = []
+            while error is None:
+                # Until arXiv reports a total, fetch one window and look again
+                stop = total if total is not None else fetch_position + size * self.concurrency
+                if limit is not None:
+                    stop = min(stop, limit)
+                if fetch_position >= stop:
+                    break
+                offsets = list(range(fetch_position, stop, size))[:self.concurrency]
+                results = await asyncio.gather(*(
+                    self._fetch_page(source, query, cursor, offset, min(size, stop - offset)) for offset in offsets
+                ), return_exceptions=True)
+
+                # The previous window was being saved meanwhile
+                position, saved, error = await self._wait_saved(cursor["id"], submitted, position, total)
+                saved_run += saved
+                submitted = []
+                if error:
+                    break
+
+                # Hand the pages that succeeded to the pipeline, in order
+                for offset, result in zip(offsets, results):
+                    requested = min(size, stop - offset)
+                    if isinstance(result, Exception):
+                        if source == "pubmed" and not history_refreshed:
+                            # The history session may have expired; recreate it once and retry
+                            shrunk = await self._refresh_history(cursor)
+                            total, history_refreshed = cursor["total"], True
+                            fetch_position = max(0, fetch_position - shrunk)
+                        else:
+                            error = f"Page at {offset} failed: {result}"
+                        break
+                    papers, page_total = result
+                    if page_total is not None:
+                        total = page_total
+                    if total is not None and offset >= total:
+                        break
+                    if not papers:
+                        error = f"Empty page at {offset} of {total}"
+                        break
+                    # A short arXiv page is taken as far as it goes; the rest is fetched again
+                    advance = requested if source == "pubmed" else len(papers)
+                    submitted.append((await self.pipeline.submit(papers, venue), offset + advance, len(papers)))
+                    fetch_position = offset + advance
+                    if advance < requested:
+                        break
+                print(f"[Harvest] {source} {query!r}: {fetch_position}/{total if total is not None else '?'} "
+                      f"fetched ({saved_run} new saved this run)")
+
+            position, saved, save_error = await self._wait_saved(cursor["id"], submitted, position, total)
+            saved_run += saved
+            error = error or save_error
+        except Exception as e:
+            error = str(e)
+
+        done = total is not None and position >= total
+        status = "failed" if error else "done" if done else "pending"
+        await asyncio.to_thread(self._update_cursor, cursor["id"], status=status, last_error=error, total=total)
+        if error:
+            print(f"[Harvest] {source} {query!r} stopped at {position}: {error}")
+        print(f"[Harvest] {source} {query!r} {status} at {position} in {time.perf_counter() - started:.1f}s")
+        return {**cursor, "position": position, "total": total, "status": status, "last_error": error,
+                "saved_this_run": saved_run}
+
+    def start(self, source: str, query: str, max_papers: Optional[int] = None, restart: bool = False) -> bool:
+        """Run a harvest as a background task; False if that harvest is already running"""
+        key = (source, query)
+        task = self.tasks.get(key)
+        if task is not None and not task.done():
+            return False
+        self.tasks[key] = asyncio.create_task(self.harvest(source, query, max_papers, restart))
+        return True
+
+
+# Global instance
+harvester = Harvester()
+
+
+if __name__ == "__main__":
+    from database import engine as db_engine
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source", choices=HARVEST_SOURCES)
+    parser.add_argument("query")
+    parser.add_argument("--max-papers", type=int, default=None, help="stop after this many papers")
+    parser.add_argument("--restart", action="store_true", help="ignore the stored cursor and start over")
+    args = parser.parse_args()
+
+    # The job may run before the API has created its tables
+    HarvestCursor.__table__.create(bind=db_engine, checkfirst=True)
+
+    async def run():
+        try:
+            return await harvester.harvest(args.source, args.query, args.max_papers, args.restart)
+        finally:
+            print(ingest_pipeline.metrics())
+            await ingest_pipeline.close()
+            await async_fetcher.close()
+
+    print(asyncio.run(run()))
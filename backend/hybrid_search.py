@@ -0,0 +1,143 @@
+"""
+Hybrid lexical + dense retrieval with rank fusion
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from models import Paper
+from semantic_search import semantic_search_engine
+from keyword_index import keyword_index
+from paper_catalogue import load_papers_in_order
+
+# "hybrid" (BM25 + dense, fused), "semantic" or "keyword". Modes that need
+# the dense index fall back to keyword search when it is unavailable.
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid")
+# "rrf" (reciprocal rank fusion) or "weighted" (blend of normalised scores)
+SEARCH_FUSION = os.getenv("SEARCH_FUSION", "rrf")
+SEARCH_RRF_K = int(os.getenv("SEARCH_RRF_K", "60"))
+# Share of the dense score in the weighted blend
+SEARCH_DENSE_WEIGHT = float(os.getenv("SEARCH_DENSE_WEIGHT", "0.5"))
+# Each retriever returns this many times top_k candidates before fusion
+SEARCH_CANDIDATE_FACTOR = int(os.getenv("SEARCH_CANDIDATE_FACTOR", "2"))
+
+SEARCH_MODES = ("hybrid", "semantic", "keyword")
+FUSION_METHODS = ("rrf", "weighted")
+
+Ranking = List[Tuple[int, float]]
+
+
+def reciprocal_rank_fusion(rankings: List[Ranking], k: int = SEARCH_RRF_K) -> Ranking:
+    """Score each id by the sum of 1 / (k + rank) over the rankings it appears in"""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (paper_id, _) in enumerate(ranking, start=1):
+            fused[paper_id] = fused.get(paper_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def weighted_fusion(rankings: List[Ranking], weights: List[float]) -> Ranking:
+    """Blend min-max normalised scores; ids missing from a ranking score 0 there"""
+    fused: Dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        if not ranking:
+            continue
+        scores = [score for _, score in ranking]
+        low, high = min(scores), max(scores)
+        span = high - low
+        for paper_id, score in ranking:
+            normalised = (score - low) / span if span > 0 else 1.0
+            fused[paper_id] = fused.get(paper_id, 0.0) + weight * normalised
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class SearchTimings:
+    """Per-stage wall-clock timings, rendered as a Server-Timing header"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    def record(self, stage: str, started: float):
+        self.stages[stage] = (time.perf_counter() - started) * 1000
+
+    def header(self) -> str:
+        return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in self.stages.items())
+
+
+class HybridSearchEngine:
+    """Query the BM25 and dense indexes in parallel and fuse their rankings"""
+
+    def __init__(self, mode: str = SEARCH_MODE, fusion: str = SEARCH_FUSION):
+        self.mode = mode if mode in SEARCH_MODES else "hybrid"
+        self.fusion = fusion if fusion in FUSION_METHODS else "rrf"
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hybrid-search")
+
+    def _timed(self, timings: SearchTimings, stage: str, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        timings.record(stage, started)
+        return result
+
+    def search_ids(self, query: str, db: Session, top_k: int = 20,
+                   mode: Optional[str] = None, fusion: Optional[str] = None,
+                   timings: Optional[SearchTimings] = None) -> Ranking:
+        """
+        Rank paper ids for a query
+
+        Args:
+            mode: "hybrid", "semantic" or "keyword" (defaults to SEARCH_MODE)
+            fusion: "rrf" or "weighted" (defaults to SEARCH_FUSION)
+            timings: Collects per-stage latencies if given
+
+        Returns:
+            List of (paper_id, score) pairs, best first
+        """
+        mode = mode or self.mode
+        fusion = fusion or self.fusion
+        timings = timings if timings is not None else SearchTimings()
+        if mode != "keyword" and not semantic_search_engine.available:
+            mode = "keyword"
+
+        # Index syncs read from the request's session, so they run here;
+        # the searches themselves only touch in-memory indexes
+        started = time.perf_counter()
+        if mode != "semantic":
+            keyword_index.sync(db)
+        if mode != "keyword":
+            semantic_search_engine.sync(db)
+        timings.record("sync", started)
+
+        if mode == "keyword":
+            return self._timed(timings, "bm25", keyword_index.search, query, top_k)
+        if mode == "semantic":
+            return self._timed(timings, "dense", semantic_search_engine.search_index, query, top_k)
+
+        depth = top_k * SEARCH_CANDIDATE_FACTOR
+        dense_future = self._executor.submit(
+            self._timed, timings, "dense", semantic_search_engine.search_index, query, depth
+        )
+        lexical = self._timed(timings, "bm25", keyword_index.search, query, depth)
+        dense = dense_future.result()
+
+        started = time.perf_counter()
+        if fusion == "weighted":
+            fused = weighted_fusion([dense, lexical], [SEARCH_DENSE_WEIGHT, 1.0 - SEARCH_DENSE_WEIGHT])
+        else:
+            fused = reciprocal_rank_fusion([dense, lexical])
+        timings.record("fusion", started)
+        return fused[:top_k]
+
+    def search_papers(self, query: str, db: Session, top_k: int = 20,
+                      mode: Optional[str] = None, fusion: Optional[str] = None,
+                      timings: Optional[SearchTimings] = None) -> List[Paper]:
+        """search_ids(), then load the ranked papers with a single IN (...) query"""
+        timings = timings if timings is not None else SearchTimings()
+        ranked = self.search_ids(query, db, top_k, mode, fusion, timings)
+        started = time.perf_counter()
+        papers = load_papers_in_order(db, [paper_id for paper_id, _ in ranked])
+        timings.record("hydrate", started)
+        return papers
+
+# Global instance
+hybrid_search_engine = HybridSearchEngine()
@@ -0,0 +1,437 @@
+"""
+Streaming import of local metadata dumps into the catalogue
+
+Seeds or refreshes the papers table from bulk files instead of the live
+APIs:
+
+- arxiv-jsonl: the arXiv metadata snapshot (one JSON object per line, as
+  in arxiv-metadata-oai-snapshot.json), optionally gzipped
+- oai-pmh: OAI-PMH ListRecords XML in the oai_dc or arXiv metadata
+  format, optionally gzipped
+
+Files are read as a stream (JSON line by line, XML through the incremental
+parser of paper_fetchers.py), so memory does not grow with the file.
+Records become the paper dicts the fetchers produce and are saved through
+the ingest pipeline: de-duplicated, tagged by a process pool and written
+in batches of IMPORT_BATCH_SIZE (with COPY on PostgreSQL).
+
+Progress is checkpointed per file in import_checkpoints after each batch
+is saved, in order, so an interrupted import resumes where it stopped:
+JSON lines by seeking to the stored byte offset, XML by skipping the
+records already imported. A file whose size or modification time changed
+is imported from the start. Embeddings are left to the API's semantic
+index sync.
+
+Usage:
+    python import_dump.py arxiv-metadata-oai-snapshot.json
+    python import_dump.py dumps/*.xml.gz --workers 8
+    python import_dump.py snapshot.json.gz --max-records 100000
+    python import_dump.py snapshot.json --restart
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import re
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from database import SessionLocal
+from ingest_pipeline import INGEST_TAG_WORKERS, IngestPipeline
+from models import ImportCheckpoint
+from paper_fetchers import PARSE_CHUNK_SIZE, StreamingRecordParser, _local
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+IMPORT_FORMATS = ("arxiv-jsonl", "oai-pmh")
+OAI = "{http://www.openarchives.org/OAI/2.0/}"
+MAX_KEYWORDS = 5  # Categories or subjects kept as keywords, as the arXiv fetcher does
+
+CHECKPOINT_FIELDS = ("id", "path", "format", "records", "offset", "saved", "status", "last_error")
+
+_WHITESPACE = re.compile(r"\s+")
+_DOI = re.compile(r"10\.\d{4,9}/\S+")
+_YEAR = re.compile(r"\d{4}")
+
+# One batch of papers, the records read up to its end and the byte offset there (JSON lines only)
+Batch = Tuple[List[Dict], int, Optional[int]]
+
+
+def checkpoint_dict(checkpoint: ImportCheckpoint) -> Dict:
+    return {field: getattr(checkpoint, field) for field in CHECKPOINT_FIELDS}
+
+
+def detect_format(path: str) -> str:
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith((".json", ".jsonl", ".ndjson")):
+        return "arxiv-jsonl"
+    if name.endswith(".xml"):
+        return "oai-pmh"
+    raise ValueError(f"Cannot tell the format of {path}; pass --format")
+
+
+def _open(path: str):
+    return gzip.open(path, "rb") if path.lower().endswith(".gz") else open(path, "rb")
+
+
+def _text(value: Optional[str]) -> str:
+    """Whitespace collapsed; dump titles and abstracts keep their line breaks"""
+    return _WHITESPACE.sub(" ", value or "").strip()
+
+
+# --- record mapping ---------------------------------------------------------
+
+def _year_from_arxiv_id(arxiv_id: str) -> Optional[int]:
+    """Submission year encoded in an arXiv id: 0704.0001 or hep-th/9901001"""
+    digits = arxiv_id.rpartition("/")[2]
+    if len(digits) < 4 or not digits[:2].isdigit():
+        return None
+    yy = int(digits[:2])
+    return 1900 + yy if yy >= 91 else 2000 + yy
+
+
+def arxiv_json_paper(record: Dict) -> Optional[Dict]:
+    """Paper dict of one record of the arXiv metadata snapshot, or None without id or title"""
+    arxiv_id = record.get("id")
+    title = _text(record.get("title"))
+    if not arxiv_id or not title:
+        return None
+    if record.get("authors_parsed"):
+        authors = ", ".join(
+            " ".join(part for part in (name[1:2] + name[:1] + name[2:]) if part)
+            for name in record["authors_parsed"]
+        )
+    else:
+        authors = _text(record.get("authors")).replace(" and ", ", ")
+    year = None
+    try:
+        year = parsedate_to_datetime(record["versions"][0]["created"]).year
+    except (KeyError, IndexError, TypeError, ValueError):
+        year = _year_from_arxiv_id(arxiv_id)
+    doi = (record.get("doi") or "").split()
+    categories = (record.get("categories") or "").split()
+    return {
+        "title": title,
+        "authors": authors,
+        "abstract": _text(record.get("abstract")),
+        "url": f"http://arxiv.org/abs/{arxiv_id}",
+        "doi": doi[0] if doi else None,
+        "venue": "arXiv",
+        "year": year,
+        "keywords": ", ".join(categories[:MAX_KEYWORDS]) if categories else None,
+        "citation_count": 0
+    }
+
+
+def _person(name: str) -> str:
+    """'Last, First' as 'First Last'"""
+    last, _, first = name.partition(",")
+    return f"{first.strip()} {last.strip()}".strip() if first else name
+
+
+def _oai_dc_paper(dc) -> Optional[Dict]:
+    """Paper dict of an oai_dc record, reading its elements in a single pass"""
+    title = abstract = year = url = doi = publisher = None
+    creators, subjects = [], []
+    for child in dc:
+        tag = _local(child.tag)
+        value = _text(child.text)
+        if not value:
+            continue
+        if tag == "title" and title is None:
+            title = value
+        elif tag == "creator":
+            creators.append(_person(value))
+        elif tag == "description" and abstract is None:
+            abstract = value
+        elif tag == "date" and year is None:
+            match = _YEAR.match(value)
+            year = int(match.group(0)) if match else None
+        elif tag == "identifier":
+            lowered = value.lower()
+            if lowered.startswith("doi:") or "doi.org/" in lowered:
+                match = _DOI.search(value)
+                doi = doi or (match.group(0) if match else None)
+            elif lowered.startswith(("http://", "https://")) and url is None:
+                url = value
+        elif tag == "subject":
+            subjects.append(value)
+        elif tag == "publisher" and publisher is None:
+            publisher = value
+    if not title:
+        return None
+    return {
+        "title": title,
+        "authors": ", ".join(creators),
+        "abstract": abstract or "",
+        "url": url or "",
+        "doi": doi,
+        "venue": "arXiv" if url and "arxiv.org/" in url else publisher,
+        "year": year,
+        "keywords": ", ".join(subjects[:MAX_KEYWORDS]) if subjects else None,
+        "citation_count": 0
+    }
+
+
+def _oai_arxiv_paper(meta) -> Optional[Dict]:
+    """Paper dict of a record in arXiv's own OAI metadata format"""
+    record: Dict = {"authors_parsed": []}
+    created = None
+    for child in meta:
+        tag = _local(child.tag)
+        if tag == "authors":
+            for author in child:
+                parts = {_local(part.tag): _text(part.text) for part in author}
+                record["authors_parsed"].append(
+                    [parts.get("keyname", ""), parts.get("forenames", ""), parts.get("suffix", "")]
+                )
+        elif tag == "created":
+            created = child.text
+        elif tag in ("id", "title", "abstract", "doi", "categories"):
+            record[tag] = child.text
+    paper = arxiv_json_paper(record)
+    if paper is not None and created:
+        match = _YEAR.match(created.strip())
+        paper["year"] = int(match.group(0)) if match else paper["year"]
+    return paper
+
+
+class OaiPmhParser(StreamingRecordParser):
+    """
+    Papers from OAI-PMH ListRecords XML (oai_dc or arXiv metadata)
+
+    ``records`` counts every record read, deleted ones included; the first
+    ``skip`` records are read but give no papers.
+    """
+
+    record_tags = frozenset({OAI + "record"})
+    container_tags = frozenset({OAI + "ListRecords"})
+
+    def __init__(self, skip: int = 0):
+        super().__init__()
+        self.skip = skip
+        self.records = 0
+
+    def _record(self, elem) -> Optional[Dict]:
+        self.records += 1
+        if self.records <= self.skip:
+            return None
+        header = elem.find(OAI + "header")
+        if header is not None and header.get("status") == "deleted":
+            return None
+        metadata = elem.find(OAI + "metadata")
+        if metadata is None or len(metadata) == 0:
+            return None
+        kind = _local(metadata[0].tag)
+        if kind == "dc":
+            return _oai_dc_paper(metadata[0])
+        if kind == "arXiv":
+            return _oai_arxiv_paper(metadata[0])
+        return None
+
+
+# --- reading ----------------------------------------------------------------
+
+def iter_jsonl_batches(path: str, records: int, offset: int, batch_size: int,
+                       limit: Optional[int] = None) -> Iterator[Batch]:
+    """Batches of papers from a JSON lines snapshot, starting at a byte offset"""
+    malformed = 0
+    papers: List[Dict] = []
+    with _open(path) as f:
+        if offset:
+            f.seek(offset)  # Decompresses up to the offset for .gz, without parsing
+        for line in f:
+            offset += len(line)
+            records += 1
+            if line.strip():
+                try:
+                    paper = arxiv_json_paper(json.loads(line))
+                except (ValueError, TypeError, AttributeError):
+                    paper = None
+                    malformed += 1
+                    if malformed <= 10:
+                        print(f"[Import] Skipping malformed record {records} of {path}")
+                if paper is not None:
+                    papers.append(paper)
+            if len(papers) >= batch_size or (limit is not None and records >= limit):
+                yield papers, records, offset
+                papers = []
+                if limit is not None and records >= limit:
+                    return
+    yield papers, records, offset
+
+
+def iter_oai_batches(path: str, records: int, batch_size: int, limit: Optional[int] = None) -> Iterator[Batch]:
+    """Batches of papers from OAI-PMH XML, skipping the records already imported"""
+    parser = OaiPmhParser(skip=records)
+    papers: List[Dict] = []
+    with _open(path) as f:
+        while True:
+            chunk = f.read(PARSE_CHUNK_SIZE)
+            if not chunk:
+                break
+            papers.extend(parser.feed(chunk))
+            if parser.records <= records:
+                continue
+            if len(papers) >= batch_size or (limit is not None and parser.records >= limit):
+                yield papers, parser.records, None
+                papers = []
+                if limit is not None and parser.records >= limit:
+                    return
+        papers.extend(parser.close())
+    yield papers, parser.records, None
+
+
+# --- importing --------------------------------------------------------------
+
+class DumpImporter:
+    """Imports dump files through an ingest pipeline, checkpointing each file as batches are saved"""
+
+    def __init__(self, pipeline: IngestPipeline, batch_size: int = IMPORT_BATCH_SIZE, session_factory=SessionLocal):
+        self.pipeline = pipeline
+        self.batch_size = batch_size
+        self.session_factory = session_factory
+
+    def _open_checkpoint(self, path: str, fmt: str, restart: bool) -> Dict:
+        stat = os.stat(path)
+        with self.session_factory() as db:
+            checkpoint = db.query(ImportCheckpoint).filter(ImportCheckpoint.path == path).first()
+            if checkpoint is None:
+                checkpoint = ImportCheckpoint(path=path, format=fmt, records=0, saved=0)
+                db.add(checkpoint)
+            changed = checkpoint.file_size != stat.st_size or checkpoint.file_mtime != stat.st_mtime
+            if restart or changed or checkpoint.format != fmt:
+                if checkpoint.records and not restart:
+                    print(f"[Import] {path} changed since the last import; starting over")
+                checkpoint.format, checkpoint.file_size, checkpoint.file_mtime = fmt, stat.st_size, stat.st_mtime
+                checkpoint.records, checkpoint.offset, checkpoint.saved = 0, 0, 0
+                checkpoint.status, checkpoint.last_error = "pending", None
+            if checkpoint.status != "done":
+                checkpoint.status = "running"
+            db.commit()
+            return checkpoint_dict(checkpoint)
+
+    def _update(self, checkpoint_id: int, **fields):
+        with self.session_factory() as db:
+            db.query(ImportCheckpoint).filter(ImportCheckpoint.id == checkpoint_id).update(fields)
+            db.commit()
+
+    def _advance(self, checkpoint_id: int, records: int, offset: Optional[int], saved: int):
+        """Move the checkpoint past a saved batch"""
+        self._update(checkpoint_id, records=records, offset=offset, saved=ImportCheckpoint.saved + saved)
+
+    def _batches(self, path: str, fmt: str, checkpoint: Dict, limit: Optional[int]) -> Iterator[Batch]:
+        if fmt == "arxiv-jsonl":
+            return iter_jsonl_batches(path, checkpoint["records"], checkpoint["offset"] or 0, self.batch_size, limit)
+        return iter_oai_batches(path, checkpoint["records"], self.batch_size, limit)
+
+    async def import_file(self, path: str, fmt: Optional[str] = None, max_records: Optional[int] = None,
+                          restart: bool = False) -> Dict:
+        """
+        Import a dump file from its checkpoint onwards
+
+        Stops at the end of the file, after ``max_records`` records, or at
+        the first batch that fails to save; the returned checkpoint tells
+        which.
+        """
+        path = os.path.abspath(path)
+        fmt = fmt or detect_format(path)
+        if fmt not in IMPORT_FORMATS:
+            raise ValueError(f"Unknown dump format: {fmt}")
+        checkpoint = await asyncio.to_thread(self._open_checkpoint, path, fmt, restart)
+        if checkpoint["status"] == "done":
+            print(f"[Import] {path} was imported completely; pass --restart to import it again")
+            return checkpoint
+        if checkpoint["records"]:
+            print(f"[Import] Resuming {path} after {checkpoint['records']:,} records")
+
+        venue = "arXiv" if fmt == "arxiv-jsonl" else None
+        records = checkpoint["records"]
+        limit = records + max_records if max_records else None
+        batches = self._batches(path, fmt, checkpoint, limit)
+        pending = deque()
+        started = time.perf_counter()
+        offset = checkpoint["offset"]
+        start_records, saved_run, read_to = records, 0, records
+        error = None
+        reading = None  # Thread currently running the batch generator
+
+        async def save_head():
+            nonlocal records, offset, saved_run
+            futures, batch_records, batch_offset = pending.popleft()
+            saved = sum(await futures)
+            await asyncio.to_thread(self._advance, checkpoint["id"], batch_records, batch_offset, saved)
+            records, offset, saved_run = batch_records, batch_offset, saved_run + saved
+            rate = (records - start_records) / max(time.perf_counter() - started, 1e-9)
+            print(f"[Import] {os.path.basename(path)}: {records:,} records, {saved_run:,} new this run "
+                  f"({rate:,.0f} records/s)")
+
+        try:
+            while True:
+                # Reading and parsing run on a worker thread, one batch at a time; shielded so
+                # that a cancellation does not lose track of a thread still inside the generator
+                reading = asyncio.ensure_future(asyncio.to_thread(next, batches, None))
+                batch = await asyncio.shield(reading)
+                if batch is None:
+                    break
+                papers, read_to, read_offset = batch
+                pending.append((await self.pipeline.submit(papers, venue), read_to, read_offset))
+                # Checkpoint over the batches saved so far, in order
+                while pending and pending[0][0].done():
+                    await save_head()
+            while pending:
+                await save_head()
+        except asyncio.CancelledError:
+            if reading is not None and not reading.done():
+                # The generator cannot be closed while the thread is running it
+                await asyncio.wait([reading])
+            await asyncio.to_thread(self._update, checkpoint["id"], status="pending")
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        finally:
+            batches.close()
+
+        done = error is None and (limit is None or read_to < limit)
+        status = "failed" if error else "done" if done else "pending"
+        await asyncio.to_thread(self._update, checkpoint["id"], status=status, last_error=error)
+        if error:
+            print(f"[Import] {path} stopped after {records:,} records: {error}")
+        print(f"[Import] {path} {status} at {records:,} records in {time.perf_counter() - started:.1f}s")
+        return {**checkpoint, "records": records, "offset": offset, "saved": checkpoint["saved"] + saved_run,
+                "status": status, "last_error": error, "saved_this_run": saved_run}
+
+
+if __name__ == "__main__":
+    from database import Base, engine as db_engine
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="dump files (.json/.jsonl or .xml, optionally .gz)")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, default=None, help="default: from the file name")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="papers per write")
+    parser.add_argument("--workers", type=int, default=INGEST_TAG_WORKERS, help="tagging processes (1 = inline)")
+    parser.add_argument("--max-records", type=int, default=None, help="stop after this many records per file")
+    parser.add_argument("--restart", action="store_true", help="ignore stored checkpoints and start over")
+    args = parser.parse_args()
+
+    # Seeding may start from an empty database
+    Base.metadata.create_all(bind=db_engine)
+
+    async def run():
+        pipeline = IngestPipeline(tag_workers=args.workers, batch_size=args.batch_size, queue_size=2)
+        importer = DumpImporter(pipeline, args.batch_size)
+        try:
+            for path in args.paths:
+                result = await importer.import_file(path, args.format, args.max_records, args.restart)
+                print(result)
+                if result["status"] == "failed":
+                    break
+        finally:
+            print(pipeline.metrics())
+            await pipeline.close()
+
+    asyncio.run(run())
@@ -0,0 +1,450 @@
+"""
+Incrementally maintained TF-IDF vectors for the paper catalogue
+"""
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+from sqlalchemy.orm import Session
+from models import Paper
+from paper_catalogue import CatalogueTracker, iter_papers_by_ids
+
+TFIDF_N_FEATURES = int(os.getenv("TFIDF_N_FEATURES", str(2 ** 18)))
+# Refit the IDF weights once this fraction of the catalogue changed since the last fit
+TFIDF_REFIT_DRIFT = float(os.getenv("TFIDF_REFIT_DRIFT", "0.1"))
+# Catalogues up to this size are refit inline; larger ones in a background thread
+TFIDF_SYNC_REFIT_MAX = int(os.getenv("TFIDF_SYNC_REFIT_MAX", "20000"))
+
+# Columns needed to vectorize a paper and derive its boost features
+TEXT_COLUMNS = (Paper.id, Paper.title, Paper.abstract, Paper.keywords, Paper.domains)
+
+
+def paper_text(title, abstract, keywords) -> str:
+    """Text a paper is vectorized from: title, abstract and keywords"""
+    text = f"{title} {abstract}"
+    if keywords:
+        text += f" {keywords}"
+    return text
+
+
+def split_domains(domains: Optional[str]) -> List[str]:
+    """Lowercased, stripped entries of a comma-separated domains string"""
+    if not domains:
+        return []
+    return [d for d in (part.strip().lower() for part in domains.split(',')) if d]
+
+
+def split_keywords(keywords: Optional[str]) -> List[str]:
+    """Lowercased entries of a comma-separated keywords string, as matched against research interests"""
+    if not keywords:
+        return []
+    return [k for k in keywords.lower().split(',') if len(k.strip()) > 3]
+
+
+def _stack(blocks: List[sp.csr_matrix]) -> sp.csr_matrix:
+    """vstack blocks whose column counts may differ (zero-padding the narrower ones)"""
+    width = max(block.shape[1] for block in blocks)
+    padded = []
+    for block in blocks:
+        if block.shape[1] < width:
+            block = sp.csr_matrix((block.data, block.indices, block.indptr), shape=(block.shape[0], width))
+        padded.append(block)
+    return sp.vstack(padded, format="csr")
+
+
+class TfidfSnapshot:
+    """
+    Consistent view of the vectors for one request.
+
+    Rows are split across a few CSR blocks so that appending papers does
+    not copy the whole matrix; ``paper_ids``, ``alive``, ``domain_bits``
+    and the keyword incidence blocks are indexed by row across all blocks.
+    Rows of deleted papers stay in place (with ``alive`` False) until the
+    next refit compacts them away.
+    """
+
+    def __init__(self, blocks: List[sp.csr_matrix], paper_ids: np.ndarray, alive: np.ndarray,
+                 row_of: Dict[int, int], domain_vocab: Dict[str, int], domain_bits: np.ndarray,
+                 keyword_vocab: Dict[str, int], n_keywords: int, max_keyword_length: int,
+                 keyword_blocks: List[sp.csr_matrix]):
+        self.blocks = blocks
+        self.offsets = np.cumsum([0] + [block.shape[0] for block in blocks])
+        self.paper_ids = paper_ids
+        self.alive = alive
+        self.row_of = row_of
+        self.domain_vocab = domain_vocab
+        self.domain_bits = domain_bits
+        self.keyword_vocab = keyword_vocab
+        self.n_keywords = n_keywords
+        self.max_keyword_length = max_keyword_length
+        self.keyword_blocks = keyword_blocks
+
+    def __len__(self):
+        return len(self.paper_ids)
+
+    def row(self, paper_id: int) -> Optional[sp.csr_matrix]:
+        """1 x n_features vector of a paper, or None if it is not indexed"""
+        position = self.row_of.get(paper_id)
+        if position is None or position >= len(self.paper_ids):
+            return None
+        return self.rows(np.array([position]))
+
+    def rows(self, positions: np.ndarray) -> sp.csr_matrix:
+        """Vectors at the given row positions, in order"""
+        positions = np.asarray(positions, dtype=np.int64)
+        block_of = np.searchsorted(self.offsets, positions, side="right") - 1
+        parts, order = [], []
+        for b in np.unique(block_of):
+            selected = np.flatnonzero(block_of == b)
+            parts.append(self.blocks[b][positions[selected] - self.offsets[b]])
+            order.append(selected)
+        if not parts:
+            return sp.csr_matrix((0, self.blocks[0].shape[1] if self.blocks else 0))
+        stacked = sp.vstack(parts, format="csr")
+        return stacked[np.argsort(np.concatenate(order), kind="stable")]
+
+    def dot(self, vector) -> np.ndarray:
+        """Dot product of every row with a 1 x n_features (sparse or dense) vector"""
+        vector = vector.toarray().ravel() if sp.issparse(vector) else np.asarray(vector).ravel()
+        scores = [block @ vector for block in self.blocks]
+        return np.concatenate(scores) if scores else np.empty(0)
+
+    def domain_mask(self, domains: List[str]) -> np.ndarray:
+        """Bitset (one row of ``domain_bits``) of the given normalised domains"""
+        mask = np.zeros(self.domain_bits.shape[1], dtype=np.uint64)
+        for domain in domains:
+            bit = self.domain_vocab.get(domain)
+            if bit is not None and bit // 64 < len(mask):
+                mask[bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+        return mask
+
+    def domain_match(self, domains: List[str]) -> np.ndarray:
+        """Per row: does the paper list any of the given (normalised) domains"""
+        mask = self.domain_mask(domains)
+        if not mask.any():
+            return np.zeros(len(self.paper_ids), dtype=bool)
+        return (self.domain_bits & mask).any(axis=1)
+
+    def keywords_in(self, text: str) -> np.ndarray:
+        """
+        Ids of the paper keywords that occur as substrings of ``text``
+
+        Enumerates the substrings of ``text`` up to the longest keyword and
+        looks them up, so the cost does not depend on the vocabulary size.
+        """
+        found = set()
+        for start in range(len(text)):
+            for end in range(start + 1, min(len(text), start + self.max_keyword_length) + 1):
+                term_id = self.keyword_vocab.get(text[start:end])
+                if term_id is not None and term_id < self.n_keywords:
+                    found.add(term_id)
+        return np.array(sorted(found), dtype=np.int64)
+
+    def keyword_match(self, keyword_ids: np.ndarray) -> np.ndarray:
+        """Per row: does the paper have any of the given keywords"""
+        if len(keyword_ids) == 0:
+            return np.zeros(len(self.paper_ids), dtype=bool)
+        selected = np.zeros(self.n_keywords, dtype=np.float64)
+        selected[keyword_ids] = 1.0
+        hits = [block @ selected[:block.shape[1]] for block in self.keyword_blocks]
+        return np.concatenate(hits) > 0 if hits else np.zeros(0, dtype=bool)
+
+    @property
+    def matrix(self) -> sp.csr_matrix:
+        """All rows as one CSR matrix (copies when there is more than one block)"""
+        if len(self.blocks) == 1:
+            return self.blocks[0]
+        return sp.vstack(self.blocks, format="csr")
+
+    @property
+    def keyword_matrix(self) -> sp.csr_matrix:
+        """Paper x keyword incidence for all rows, ``n_keywords`` columns wide"""
+        blocks = self.keyword_blocks or [sp.csr_matrix((0, max(self.n_keywords, 1)))]
+        return _stack(blocks)
+
+
+class IncrementalTfidf:
+    """
+    TF-IDF vectors that follow the papers table without refitting on every change.
+
+    Terms are hashed (HashingVectorizer) so the feature space never changes,
+    and document frequencies are kept as running counts. New or edited papers
+    are weighted with the IDF from the last fit and appended; deletes only
+    clear a row's ``alive`` flag. When the share of papers changed since the
+    last fit exceeds ``refit_drift``, the IDF is recomputed from the running
+    counts and every row is re-weighted, in a background thread for large
+    catalogues, and the result is swapped in under the lock.
+    """
+
+    MAX_BLOCKS = 8
+    MIN_REFIT_CHANGES = 50
+
+    def __init__(self, n_features: int = TFIDF_N_FEATURES, refit_drift: float = TFIDF_REFIT_DRIFT,
+                 sync_refit_max: int = TFIDF_SYNC_REFIT_MAX):
+        self.hasher = HashingVectorizer(
+            n_features=n_features, stop_words='english', alternate_sign=False, norm=None
+        )
+        self.refit_drift = refit_drift
+        self.sync_refit_max = sync_refit_max
+        self.tracker = CatalogueTracker()
+        self._lock = threading.RLock()
+        self._refitting = False
+        self._reset()
+
+    def _reset(self):
+        n_features = self.hasher.n_features
+        self.df = np.zeros(n_features, dtype=np.int64)
+        self.n_docs = 0
+        self.idf = np.ones(n_features)
+        self.fitted = False
+        self.count_blocks: List[sp.csr_matrix] = []
+        self.blocks: List[sp.csr_matrix] = []
+        self.paper_ids = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.row_of: Dict[int, int] = {}
+        # Boost features, row-aligned with the vectors: a bitset of each
+        # paper's domains and a sparse paper x keyword incidence matrix
+        self.domain_vocab: Dict[str, int] = {}
+        self.domain_bits = np.zeros((0, 1), dtype=np.uint64)
+        self.keyword_vocab: Dict[str, int] = {}
+        self.max_keyword_length = 0
+        self.keyword_blocks: List[sp.csr_matrix] = []
+        self._pending_ids: List[int] = []
+        self._pending_counts: List[sp.csr_matrix] = []
+        self._pending_domains: List[List[int]] = []
+        self._pending_keywords: List[List[int]] = []
+        self.changes_since_fit = 0
+        self.docs_at_fit = 0
+        # alive and row_of are handed to snapshots; copied before the next change
+        self._shared = False
+
+    def __len__(self):
+        return len(self.row_of)
+
+    # --- weighting --------------------------------------------------------
+
+    @staticmethod
+    def _idf(df: np.ndarray, n_docs: int) -> np.ndarray:
+        """Smoothed IDF, as TfidfVectorizer computes it"""
+        return np.log((1.0 + n_docs) / (1.0 + df)) + 1.0
+
+    @staticmethod
+    def _weigh(counts: sp.csr_matrix, idf: np.ndarray) -> sp.csr_matrix:
+        weighted = counts.copy()
+        weighted.data = weighted.data * idf[weighted.indices]
+        return normalize(weighted, norm='l2', copy=False)
+
+    def transform(self, texts: List[str]) -> sp.csr_matrix:
+        """TF-IDF vectors for arbitrary texts, using the current IDF"""
+        return self._weigh(self.hasher.transform(texts).tocsr(), self.idf)
+
+    # --- writes -----------------------------------------------------------
+
+    def _n_rows(self) -> int:
+        return len(self.paper_ids) + len(self._pending_ids)
+
+    def _counts_row(self, position: int) -> sp.csr_matrix:
+        start = 0
+        for block in self.count_blocks + self._pending_counts:
+            if position < start + block.shape[0]:
+                return block[position - start]
+            start += block.shape[0]
+        raise IndexError(position)
+
+    @staticmethod
+    def _term_ids(vocab: Dict[str, int], terms: List[str]) -> List[int]:
+        ids = []
+        for term in terms:
+            term_id = vocab.get(term)
+            if term_id is None:
+                term_id = vocab[term] = len(vocab)
+            ids.append(term_id)
+        return sorted(set(ids))
+
+    def add(self, items: List[Tuple[int, str, Optional[str], Optional[str]]]):
+        """Vectorize (paper_id, text, domains, keywords) tuples, replacing earlier versions"""
+        if not items:
+            return
+        with self._lock:
+            self.remove([item[0] for item in items])
+            self._unshare()
+            counts = self.hasher.transform([item[1] for item in items]).tocsr()
+            # Each term appears once per row in CSR indices
+            self.df += np.bincount(counts.indices, minlength=len(self.df))
+            for paper_id, _, domains, keywords in items:
+                self.row_of[paper_id] = self._n_rows()
+                self._pending_ids.append(paper_id)
+                self._pending_domains.append(self._term_ids(self.domain_vocab, split_domains(domains)))
+                paper_keywords = split_keywords(keywords)
+                self._pending_keywords.append(self._term_ids(self.keyword_vocab, paper_keywords))
+                self.max_keyword_length = max([self.max_keyword_length] + [len(k) for k in paper_keywords])
+            self._pending_counts.append(counts)
+            self.n_docs += len(items)
+            self.changes_since_fit += len(items)
+
+    def _unshare(self):
+        """Copy alive and row_of if a snapshot holds them, so snapshots never see later changes"""
+        if self._shared:
+            self.alive = self.alive.copy()
+            self.row_of = dict(self.row_of)
+            self._shared = False
+
+    def remove(self, paper_ids: List[int]):
+        with self._lock:
+            self._unshare()
+            for paper_id in paper_ids:
+                position = self.row_of.pop(paper_id, None)
+                if position is None:
+                    continue
+                self.df[self._counts_row(position).indices] -= 1
+                self.n_docs -= 1
+                self.changes_since_fit += 1
+                if position < len(self.alive):
+                    self.alive[position] = False
+
+    def _flush(self):
+        """Append pending rows as a new block, merging trailing blocks if there are many"""
+        if not self._pending_ids:
+            return
+        start = len(self.paper_ids)
+        ids = np.array(self._pending_ids, dtype=np.int64)
+        counts = sp.vstack(self._pending_counts, format="csr")
+        self.count_blocks.append(counts)
+        self.blocks.append(self._weigh(counts, self.idf))
+        self.keyword_blocks.append(self._incidence(self._pending_keywords, len(self.keyword_vocab)))
+        self.domain_bits = self._append_bits(self.domain_bits, self._pending_domains, len(self.domain_vocab))
+        if len(self.blocks) > self.MAX_BLOCKS:
+            self.count_blocks[1:] = [sp.vstack(self.count_blocks[1:], format="csr")]
+            self.blocks[1:] = [sp.vstack(self.blocks[1:], format="csr")]
+            self.keyword_blocks[1:] = [_stack(self.keyword_blocks[1:])]
+        alive = np.fromiter(
+            (self.row_of.get(pid) == start + i for i, pid in enumerate(self._pending_ids)),
+            dtype=bool, count=len(ids)
+        )
+        self.paper_ids = np.concatenate((self.paper_ids, ids))
+        self.alive = np.concatenate((self.alive, alive))
+        self._pending_ids = []
+        self._pending_counts = []
+        self._pending_domains = []
+        self._pending_keywords = []
+
+    @staticmethod
+    def _incidence(rows: List[List[int]], width: int) -> sp.csr_matrix:
+        indptr = np.cumsum([0] + [len(row) for row in rows])
+        indices = np.fromiter((term for row in rows for term in row), dtype=np.int32, count=indptr[-1])
+        data = np.ones(len(indices), dtype=np.float64)
+        return sp.csr_matrix((data, indices, indptr), shape=(len(rows), max(width, 1)))
+
+    @staticmethod
+    def _append_bits(bits: np.ndarray, rows: List[List[int]], n_terms: int) -> np.ndarray:
+        words = max(bits.shape[1], (n_terms + 63) // 64, 1)
+        if bits.shape[1] < words:
+            bits = np.hstack((bits, np.zeros((len(bits), words - bits.shape[1]), dtype=np.uint64)))
+        new = np.zeros((len(rows), words), dtype=np.uint64)
+        for i, row in enumerate(rows):
+            for term in row:
+                new[i, term // 64] |= np.uint64(1) << np.uint64(term % 64)
+        return np.vstack((bits, new))
+
+    # --- refitting --------------------------------------------------------
+
+    def _needs_refit(self) -> bool:
+        if not self.fitted:
+            return self.n_docs > 0
+        return (self.changes_since_fit >= self.MIN_REFIT_CHANGES
+                and self.changes_since_fit > self.refit_drift * max(self.docs_at_fit, 1))
+
+    def _start_refit(self):
+        """Snapshot the counts and refit inline or in the background (caller holds the lock)"""
+        if self._refitting:
+            return
+        self._flush()
+        self._refitting = True
+        job = (list(self.count_blocks), len(self.paper_ids), self.df.copy(), self.n_docs, self.changes_since_fit)
+        if not self.fitted or self.n_docs <= self.sync_refit_max:
+            self._refit(*job)
+        else:
+            threading.Thread(target=self._refit, args=job, daemon=True).start()
+
+    def _refit(self, count_blocks: List[sp.csr_matrix], n_rows: int, df: np.ndarray,
+               n_docs: int, changes: int):
+        try:
+            idf = self._idf(df, n_docs)
+            counts = sp.vstack(count_blocks, format="csr") if count_blocks else None
+            matrix = self._weigh(counts, idf) if counts is not None else None
+            with self._lock:
+                self._install(idf, counts, matrix, n_rows, n_docs, changes)
+            print(f"Refit TF-IDF weights over {n_docs} papers")
+        except Exception as e:
+            print(f"Error refitting TF-IDF model: {e}")
+        finally:
+            self._refitting = False
+
+    def _install(self, idf: np.ndarray, counts: Optional[sp.csr_matrix], matrix: Optional[sp.csr_matrix],
+                 n_rows: int, n_docs: int, changes: int):
+        """Swap in refit rows, re-weighting rows appended meanwhile and dropping dead ones"""
+        self._flush()
+        count_parts = [counts] if counts is not None else []
+        parts = [matrix] if matrix is not None else []
+        if len(self.paper_ids) > n_rows:
+            tail = sp.vstack(self.count_blocks, format="csr")[n_rows:]
+            count_parts.append(tail)
+            parts.append(self._weigh(tail, idf))
+        counts = sp.vstack(count_parts, format="csr") if count_parts else None
+        matrix = sp.vstack(parts, format="csr") if parts else None
+
+        keywords = _stack(self.keyword_blocks) if self.keyword_blocks else None
+
+        keep = np.flatnonzero(self.alive)
+        if len(keep) < len(self.alive) and counts is not None:
+            counts, matrix, keywords = counts[keep], matrix[keep], keywords[keep]
+            self.paper_ids = self.paper_ids[keep]
+            self.alive = np.ones(len(keep), dtype=bool)
+            self.domain_bits = self.domain_bits[keep]
+            self.row_of = {int(pid): row for row, pid in enumerate(self.paper_ids)}
+
+        self.count_blocks = [counts] if counts is not None and counts.shape[0] else []
+        self.blocks = [matrix] if matrix is not None and matrix.shape[0] else []
+        self.keyword_blocks = [keywords] if keywords is not None and keywords.shape[0] else []
+        self.idf = idf
+        self.fitted = True
+        self.docs_at_fit = n_docs
+        self.changes_since_fit -= changes
+
+    # --- catalogue sync ---------------------------------------------------
+
+    def sync(self, db: Session, force: bool = False):
+        """Fold in papers inserted/updated/deleted since the last sync"""
+        with self._lock:
+            try:
+                changes = self.tracker.changes(db, force=force)
+                if changes:
+                    self.remove(changes.deleted_ids)
+                    batch = []
+                    for row in iter_papers_by_ids(db, changes.upserted_ids, TEXT_COLUMNS):
+                        batch.append((
+                            row.id, paper_text(row.title, row.abstract, row.keywords), row.domains, row.keywords
+                        ))
+                        if len(batch) >= 1000:
+                            self.add(batch)
+                            batch = []
+                    self.add(batch)
+                if self._needs_refit():
+                    self._start_refit()
+            except Exception as e:
+                print(f"Error syncing TF-IDF model: {e}")
+                self.tracker.reset()
+
+    def snapshot(self) -> TfidfSnapshot:
+        """Current vectors; safe to use after the lock is released"""
+        with self._lock:
+            self._flush()
+            self._shared = True
+            return TfidfSnapshot(
+                list(self.blocks), self.paper_ids, self.alive, self.row_of,
+                self.domain_vocab, self.domain_bits, self.keyword_vocab, len(self.keyword_vocab),
+                self.max_keyword_length, list(self.keyword_blocks)
+            )
@@ -0,0 +1,349 @@
+"""
+Saving fetched and imported papers: de-duplication, smart tagging and bulk writes
+
+Incoming papers are matched against the catalogue on their normalised
+identity keys (paper_identity.py: DOI, arXiv id, title), a whole batch per
+query, and the rest against the MinHash/LSH index of near_duplicates.py,
+which catches the same work with a reworded title. New papers go in with
+multi-row INSERT ... ON CONFLICT DO NOTHING against the unique DOI and
+arXiv id indexes, so a paper inserted concurrently by another job is
+picked up rather than duplicated
+(on PostgreSQL, large batches are COPYed into a temporary table first);
+matches can be updated with one executemany.
+"""
+import io
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, func, insert, or_, text, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from models import Paper
+from near_duplicates import near_duplicate_index
+from paper_identity import STRONG_KEYS, conflicting, identity_keys
+from smart_tagger import SmartTagger
+import paper_catalogue
+
+KEY_BATCH = 2000  # Candidates resolved per query (up to three IN lists of this size)
+INSERT_BATCH = 1000  # Rows per multi-row INSERT
+COPY_MIN_ROWS = 1000  # PostgreSQL: inserts of at least this many rows go through COPY
+
+PAPER_FIELDS = ("title", "authors", "abstract", "venue", "year", "url", "doi",
+                "keywords", "smart_tags", "domains", "citation_count")
+KEY_COLUMNS = ("doi_key", "arxiv_id", "title_key")  # Strongest identifier first
+
+
+def paper_row(paper_data: Dict, default_venue: Optional[str] = None) -> Dict:
+    """Column values of a paper, identity keys included"""
+    row = {field: paper_data.get(field) for field in PAPER_FIELDS}
+    row["authors"] = row["authors"] or ""
+    row["abstract"] = row["abstract"] or ""
+    row["venue"] = row["venue"] or default_venue
+    row["citation_count"] = row["citation_count"] or 0
+    row.update(identity_keys(row["title"], row["doi"], row["url"]))
+    return row
+
+
+def resolve_papers(db: Session, rows: Sequence[Dict]) -> List[Optional[int]]:
+    """
+    Id of the stored paper each row matches, else None
+
+    A DOI or arXiv id match wins; otherwise the oldest paper with the same
+    title_key whose DOI and arXiv id do not conflict with the row's.
+    Resolves KEY_BATCH rows per query instead of one lookup per paper.
+    """
+    matches: List[Optional[int]] = [None] * len(rows)
+    for start in range(0, len(rows), KEY_BATCH):
+        chunk = rows[start:start + KEY_BATCH]
+        conditions = []
+        for column in KEY_COLUMNS:
+            values = {row[column] for row in chunk if row[column]}
+            if values:
+                conditions.append(getattr(Paper, column).in_(values))
+        if not conditions:
+            continue
+        found = {column: {} for column in STRONG_KEYS}
+        by_title: Dict[str, List] = {}
+        for stored in db.query(Paper.id, *(getattr(Paper, c) for c in KEY_COLUMNS)).filter(
+            or_(*conditions)
+        ).order_by(Paper.id):
+            for column in STRONG_KEYS:
+                value = getattr(stored, column)
+                if value:
+                    found[column].setdefault(value, stored.id)
+            if stored.title_key:
+                by_title.setdefault(stored.title_key, []).append(stored)  # Oldest paper first
+        for offset, row in enumerate(chunk):
+            paper_id = next((found[c][row[c]] for c in STRONG_KEYS if row[c] and row[c] in found[c]), None)
+            if paper_id is None and row["title_key"]:
+                paper_id = next((stored.id for stored in by_title.get(row["title_key"], ())
+                                 if not conflicting(row, stored._mapping)), None)
+            matches[start + offset] = paper_id
+    return matches
+
+
+def first_occurrences(rows: Sequence[Dict]) -> List[int]:
+    """
+    For each row, the index of the first row in the batch it is the same paper as
+
+    Same rule as resolve_papers, with a group's DOI and arXiv id being those
+    of any of its rows.
+    """
+    first_by_key: Dict = {}
+    by_title: Dict[str, List[int]] = {}
+    group_keys: Dict[int, Dict] = {}
+    first = []
+    for i, row in enumerate(rows):
+        strong = [(column, row[column]) for column in STRONG_KEYS if row[column]]
+        index = next((first_by_key[key] for key in strong if key in first_by_key), None)
+        if index is None and row["title_key"]:
+            index = next((g for g in by_title.get(row["title_key"], ()) if not conflicting(row, group_keys[g])), None)
+        if index is None:
+            index = i
+            group_keys[i] = {}
+        if row["title_key"] and index not in by_title.setdefault(row["title_key"], []):
+            by_title[row["title_key"]].append(index)
+        for column, value in strong:
+            first_by_key.setdefault((column, value), index)
+            group_keys[index].setdefault(column, value)
+        first.append(index)
+    return first
+
+
+def match_batch(db: Session, rows: Sequence[Dict],
+                signatures: Optional[Sequence] = None) -> Tuple[List[Optional[int]], List[int], List]:
+    """
+    Stored paper (or None) and first occurrence in the batch of each row
+
+    Exact identity keys first; the rows left over are checked for
+    near-duplicates of stored papers and of each other. Also returns the
+    MinHash signature of every row that was checked, for indexing;
+    ``signatures`` from an earlier call on the same rows are reused.
+    """
+    ids = resolve_papers(db, rows)
+    first = first_occurrences(rows)
+    unmatched = [i for i in range(len(rows)) if ids[i] is None and first[i] == i]
+    signatures = list(signatures) if signatures is not None else [None] * len(rows)
+    for i in unmatched:
+        if signatures[i] is None:
+            signatures[i] = near_duplicate_index.signature(rows[i]["title"], rows[i]["abstract"])
+    near, near_first = near_duplicate_index.match(db, [signatures[i] for i in unmatched],
+                                                  [rows[i] for i in unmatched])
+    for j, i in enumerate(unmatched):
+        if near[j] is not None:
+            ids[i] = near[j]
+        elif near_first[j] != j:
+            first[i] = unmatched[near_first[j]]
+    for i in range(len(rows)):
+        first[i] = first[first[i]]  # Earlier rows are already final
+    return ids, first, signatures
+
+
+def _insert_statement(db: Session):
+    table = Paper.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        statement = sqlite_insert(table).on_conflict_do_nothing()
+    elif dialect == "postgresql":
+        statement = postgresql_insert(table).on_conflict_do_nothing()
+    else:
+        statement = insert(table)
+    return statement.returning(table.c.id, *(table.c[column] for column in KEY_COLUMNS))
+
+
+def _copy_field(value) -> str:
+    """One CSV field for COPY: NULL is an unquoted empty field, strings are always quoted"""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+
+def _row_identity(row) -> Tuple:
+    return tuple(row[column] for column in KEY_COLUMNS)
+
+
+def _copy_insert(db: Session, rows: Sequence[Dict]) -> Dict[Tuple, int]:
+    """
+    PostgreSQL: COPY rows into a temporary table, then INSERT ... SELECT ... ON CONFLICT DO NOTHING
+
+    COPY skips per-row statement overhead entirely; the INSERT ... SELECT
+    keeps the conflict handling of the plain path. Returns the new ids by
+    their identity keys.
+    """
+    columns = PAPER_FIELDS + KEY_COLUMNS
+    column_list = ", ".join(columns)
+    db.execute(text(
+        f"CREATE TEMPORARY TABLE IF NOT EXISTS paper_copy ON COMMIT DROP AS "
+        f"SELECT {column_list} FROM papers WITH NO DATA"
+    ))
+    db.execute(text("TRUNCATE paper_copy"))
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(",".join(_copy_field(row[column]) for column in columns))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()  # psycopg2 cursor in the session's transaction
+    try:
+        cursor.copy_expert(f"COPY paper_copy ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+    return {
+        tuple(returned[1:]): returned[0] for returned in db.execute(text(
+            f"INSERT INTO papers ({column_list}) SELECT {column_list} FROM paper_copy "
+            f"ON CONFLICT DO NOTHING RETURNING id, {', '.join(KEY_COLUMNS)}"
+        ))
+    }
+
+
+def insert_papers(db: Session, rows: Sequence[Dict]) -> Tuple[List[Optional[int]], List[bool]]:
+    """
+    Insert rows (from paper_row) with multi-row INSERT ... ON CONFLICT DO NOTHING
+
+    Executed as one executemany, which SQLAlchemy sends as multi-row
+    INSERT ... VALUES statements of up to INSERT_BATCH rows; on PostgreSQL,
+    COPY_MIN_ROWS rows or more are COPYed instead. Returns the id of each
+    row (the new paper, or the one that already held its DOI or arXiv id when
+    a concurrent insert got there first) and whether the row was inserted.
+    Does not commit.
+    """
+    if not rows:
+        return [], []
+    if len(rows) >= COPY_MIN_ROWS and db.get_bind().dialect.name == "postgresql":
+        inserted = _copy_insert(db, rows)
+    else:
+        inserted = {
+            tuple(returned[1:]): returned[0] for returned in
+            db.execute(_insert_statement(db), list(rows),
+                       execution_options={"insertmanyvalues_page_size": INSERT_BATCH})
+        }
+    ids: List[Optional[int]] = [inserted.get(_row_identity(row)) for row in rows]
+    was_inserted = [paper_id is not None for paper_id in ids]
+    # Conflicts: rows another writer inserted after they were resolved
+    missing = [i for i, paper_id in enumerate(ids) if paper_id is None]
+    if missing:
+        for i, paper_id in zip(missing, resolve_papers(db, [rows[i] for i in missing])):
+            ids[i] = paper_id
+    return ids, was_inserted
+
+
+def _index_inserted(db: Session, ids: Sequence[Optional[int]], inserted: Sequence[bool], signatures: Sequence):
+    """Add the signatures of newly inserted papers to the near-duplicate index"""
+    new = [(paper_id, signature) for paper_id, was_new, signature in zip(ids, inserted, signatures) if was_new]
+    if new:
+        near_duplicate_index.add(db, [paper_id for paper_id, _ in new], [signature for _, signature in new])
+
+
+def insert_new_rows(db: Session, rows: Sequence[Dict],
+                    signatures: Optional[Sequence] = None) -> List[Tuple[int, int]]:
+    """
+    Insert the rows (from paper_row) that match no stored paper nor an earlier row
+
+    Returns (row index, paper id) of each row inserted. Does not commit.
+    """
+    existing, first, signatures = match_batch(db, rows, signatures)
+    new = [i for i, row in enumerate(rows) if existing[i] is None and first[i] == i and row["title_key"]]
+    new_ids, inserted = insert_papers(db, [rows[i] for i in new])
+    _index_inserted(db, new_ids, inserted, [signatures[i] for i in new])
+    return [(i, paper_id) for i, paper_id, was_new in zip(new, new_ids, inserted) if was_new]
+
+
+def update_papers(db: Session, updates: Sequence[Dict], overwrite: Iterable[str] = (),
+                  fill: Iterable[str] = ()):
+    """
+    Update matched papers with one executemany; each dict has paper_id and the fields
+
+    ``overwrite`` fields replace the stored value, ``fill`` fields only set
+    it where it is empty. Does not commit.
+    """
+    table = Paper.__table__
+    values = {field: bindparam(f"new_{field}") for field in overwrite}
+    for field in fill:
+        values[field] = func.coalesce(func.nullif(table.c[field], ""), bindparam(f"new_{field}"))
+    if not updates or not values:
+        return
+    statement = update(table).where(table.c.id == bindparam("paper_id")).values(values)
+    params = [{"paper_id": u["paper_id"], **{f"new_{field}": u.get(field) for field in (*overwrite, *fill)}}
+              for u in updates]
+    db.execute(statement, params)
+
+
+def upsert_papers(db: Session, papers: Sequence[Dict], overwrite: Iterable[str] = (),
+                  fill: Iterable[str] = ()) -> List[Optional[int]]:
+    """
+    Insert new papers and update matched ones; the paper id of each input, in order
+
+    Papers repeated within the batch resolve to the same id. Commits once.
+    """
+    rows = [paper_row(p) for p in papers]
+    ids, first, signatures = match_batch(db, rows)
+    new = [i for i in range(len(rows)) if ids[i] is None and first[i] == i and rows[i]["title_key"]]
+    new_ids, inserted = insert_papers(db, [rows[i] for i in new])
+    for i, paper_id in zip(new, new_ids):
+        ids[i] = paper_id
+    _index_inserted(db, new_ids, inserted, [signatures[i] for i in new])
+    for i in range(len(rows)):
+        if ids[i] is None:
+            ids[i] = ids[first[i]]
+
+    overwrite, fill = tuple(overwrite), tuple(fill)
+    if {"doi", "url"} & set(overwrite + fill):
+        fill += ("doi_key", "arxiv_id")  # Keys of a DOI or URL added by this update
+    if overwrite or fill:
+        inserted = set(new)
+        updates, updated = [], set()
+        for i, paper_id in enumerate(ids):
+            if paper_id is not None and i not in inserted and paper_id not in updated:
+                updated.add(paper_id)
+                updates.append({"paper_id": paper_id, **rows[i]})
+        update_papers(db, updates, overwrite, fill)
+    db.commit()
+    paper_catalogue.touch()
+    return ids
+
+
+def papers_by_ids(db: Session, paper_ids: Iterable[Optional[int]]) -> List[Paper]:
+    """The distinct papers of the given ids in first-seen order, loaded with one query per KEY_BATCH"""
+    ordered = list(dict.fromkeys(pid for pid in paper_ids if pid is not None))
+    loaded = {}
+    for start in range(0, len(ordered), KEY_BATCH):
+        for paper in db.query(Paper).filter(Paper.id.in_(ordered[start:start + KEY_BATCH])):
+            loaded[paper.id] = paper
+    return [loaded[pid] for pid in ordered if pid in loaded]
+
+
+def tag_paper_data(paper_data: Dict) -> Dict:
+    """Paper data with smart tags, keywords and domains filled in"""
+    tag_result = SmartTagger.tag_paper(
+        title=paper_data.get("title", ""),
+        abstract=paper_data.get("abstract", ""),
+        existing_keywords=paper_data.get("keywords")
+    )
+    return {
+        **paper_data,
+        "keywords": tag_result["keywords"],
+        "smart_tags": tag_result["smart_tags"],
+        "domains": ", ".join(tag_result["domains"]) if tag_result["domains"] else None,
+    }
+
+
+def save_new_papers(db: Session, papers: List[Dict], default_venue: str = "arXiv") -> int:
+    """
+    Tag and insert the papers that are not in the database yet
+
+    Papers without a title or abstract are skipped, as are near-duplicates
+    of stored papers. Only papers that will be inserted are tagged. Returns
+    the number of papers inserted.
+    """
+    rows = [paper_row(p, default_venue) for p in papers if p.get("title") and p.get("abstract")]
+    existing, first, signatures = match_batch(db, rows)
+    new = [i for i, row in enumerate(rows) if existing[i] is None and first[i] == i and row["title_key"]]
+    new_ids, inserted = insert_papers(db, [paper_row(tag_paper_data(rows[i]), default_venue) for i in new])
+    _index_inserted(db, new_ids, inserted, [signatures[i] for i in new])
+    saved = sum(inserted)
+    db.commit()
+    if saved:
+        paper_catalogue.touch()
+    return saved
@@ -0,0 +1,293 @@
+"""
+Staged ingest pipeline: fetch -> parse -> tag -> embed -> store
+
+Saving a page of fetched papers used to run start to finish on one
+thread, with NLTK tagging (the bulk of the time) one paper after another.
+Here every stage runs on its own, connected by bounded queues:
+
+- fetch: producers (harvester.py, auto_fetch.py) submit pages of paper
+  dicts; submit() blocks while the parse queue is full
+- parse: normalise the rows and drop papers already stored or repeated
+  in the page (ingest.match_batch), so only new papers are tagged
+- tag: SmartTagger in a process pool, in chunks of TAG_CHUNK_SIZE papers
+- embed: one batched model call per page (when an embedder is attached)
+- store: re-check against papers stored since the parse stage, then a
+  bulk INSERT (ingest.insert_new_rows), and store the embeddings
+
+A full queue holds its producer back, so memory stays bounded however
+far the fetcher runs ahead. Per-stage counters (items, busy time, time
+starved for input, time blocked on the next stage) are served by
+/api/admin/ingest and show which stage limits throughput.
+
+Batches that were submitted but not stored when the pipeline is closed
+fail; harvest cursors only advance over stored pages, so nothing is lost.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from database import SessionLocal
+from ingest import insert_new_rows, match_batch, paper_row, tag_paper_data
+import paper_catalogue
+
+INGEST_TAG_WORKERS = int(os.getenv("INGEST_TAG_WORKERS", str(os.cpu_count() or 1)))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))  # Batches waiting between two stages
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))  # Papers per batch; larger pages are split
+TAG_CHUNK_SIZE = 32  # Papers per process pool task
+TAG_FIELDS = ("keywords", "smart_tags", "domains")
+
+STAGES = ("fetch", "parse", "tag", "embed", "store")
+# Concurrent workers per stage; two taggers keep the pool busy while one waits on its slowest chunk
+STAGE_WORKERS = {"parse": 1, "tag": 2, "embed": 1, "store": 1}
+
+
+def _tag_chunk(papers: List[Tuple[str, str, Optional[str]]]) -> List[Dict]:
+    """Tag fields of (title, abstract, keywords) tuples; runs in a pool process"""
+    tagged = []
+    for title, abstract, keywords in papers:
+        result = tag_paper_data({"title": title, "abstract": abstract, "keywords": keywords})
+        tagged.append({field: result[field] for field in TAG_FIELDS})
+    return tagged
+
+
+class IngestBatch:
+    """One page of papers on its way through the stages"""
+
+    __slots__ = ("papers", "default_venue", "future", "rows", "signatures", "vectors")
+
+    def __init__(self, papers: List[Dict], default_venue: str, future: asyncio.Future):
+        self.papers = papers
+        self.default_venue = default_venue
+        self.future = future
+        self.rows: List[Dict] = []
+        self.signatures: List = []
+        self.vectors = None
+
+
+class StageMetrics:
+    """Counters of one stage"""
+
+    def __init__(self):
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.idle_seconds = 0.0  # Waiting for input
+        self.blocked_seconds = 0.0  # Waiting for room in the next stage's queue
+
+    def as_dict(self, queue: Optional[asyncio.Queue] = None) -> Dict:
+        stats = {
+            "batches": self.batches,
+            "items": self.items,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "idle_seconds": round(self.idle_seconds, 3),
+            "blocked_seconds": round(self.blocked_seconds, 3),
+            "items_per_busy_second": round(self.items / self.busy_seconds, 1) if self.busy_seconds else None,
+        }
+        if queue is not None:
+            stats["queued"] = queue.qsize()
+            stats["queue_size"] = queue.maxsize
+        return stats
+
+
+class IngestPipeline:
+    """Bounded-queue pipeline saving fetched papers; started on first use in the running event loop"""
+
+    def __init__(self, tag_workers: int = INGEST_TAG_WORKERS, queue_size: int = INGEST_QUEUE_SIZE,
+                 batch_size: int = INGEST_BATCH_SIZE, embedder=None, session_factory=SessionLocal):
+        self.tag_workers = tag_workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        # SemanticSearchEngine (or anything with encode_papers/add_encoded); None skips the embed stage
+        self.embedder = embedder
+        self.session_factory = session_factory
+        self.metrics_by_stage = {stage: StageMetrics() for stage in STAGES}
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.tasks: List[asyncio.Task] = []
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.started_at: Optional[float] = None
+        self.saved = 0
+        self._loop = None
+
+    # --- lifecycle ----------------------------------------------------------
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self.tasks:
+            return
+        self._loop = loop
+        self.queues = {stage: asyncio.Queue(maxsize=self.queue_size) for stage in STAGES[1:]}
+        if self.tag_workers > 1 and self.pool is None:
+            self.pool = self._new_pool()
+        handlers = {"parse": self._parse, "tag": self._tag, "embed": self._embed, "store": self._store}
+        downstream = dict(zip(STAGES[1:], STAGES[2:] + (None,)))
+        self.tasks = [
+            asyncio.create_task(self._run_stage(stage, handlers[stage], downstream[stage]))
+            for stage in STAGES[1:] for _ in range(STAGE_WORKERS[stage])
+        ]
+        self.started_at = time.perf_counter()
+        print(f"[Ingest] Pipeline started ({self.tag_workers} tag workers, queues of {self.queue_size})")
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # A fresh interpreter per worker: the API process has threads and a loaded model not to fork
+        return ProcessPoolExecutor(max_workers=self.tag_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    async def close(self):
+        """Stop the stages; batches not stored yet fail"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for queue in self.queues.values():
+            while not queue.empty():
+                self._fail(queue.get_nowait())
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    @staticmethod
+    def _fail(batch: IngestBatch):
+        if not batch.future.done():
+            batch.future.set_exception(RuntimeError("Ingest pipeline closed"))
+
+    # --- producers ----------------------------------------------------------
+
+    async def submit(self, papers: List[Dict], default_venue: str = "arXiv") -> asyncio.Future:
+        """
+        Queue papers for saving; waits while the pipeline is full
+
+        Returns a future of the number of papers inserted per batch.
+        Papers without a title or abstract are skipped.
+        """
+        self._start()
+        metrics = self.metrics_by_stage["fetch"]
+        futures = []
+        for start in range(0, len(papers), self.batch_size):
+            chunk = papers[start:start + self.batch_size]
+            batch = IngestBatch(chunk, default_venue, self._loop.create_future())
+            waited = time.perf_counter()
+            await self.queues["parse"].put(batch)
+            metrics.blocked_seconds += time.perf_counter() - waited
+            metrics.batches += 1
+            metrics.items += len(chunk)
+            futures.append(batch.future)
+        return asyncio.gather(*futures)
+
+    async def ingest(self, papers: List[Dict], default_venue: str = "arXiv") -> int:
+        """Save papers through the pipeline; the number inserted"""
+        return sum(await (await self.submit(papers, default_venue)))
+
+    # --- stages -------------------------------------------------------------
+
+    async def _run_stage(self, stage: str, handler, downstream: Optional[str]):
+        metrics = self.metrics_by_stage[stage]
+        queue = self.queues[stage]
+        while True:
+            waited = time.perf_counter()
+            batch = await queue.get()
+            started = time.perf_counter()
+            metrics.idle_seconds += started - waited
+            try:
+                try:
+                    forward = await handler(batch)
+                except Exception as e:
+                    metrics.errors += 1
+                    print(f"[Ingest] {stage} failed for a batch of {len(batch.papers)}: {e}")
+                    if not batch.future.done():
+                        batch.future.set_exception(e)
+                    forward = False
+                finished = time.perf_counter()
+                metrics.busy_seconds += finished - started
+                metrics.batches += 1
+                metrics.items += len(batch.rows) if stage != "parse" else len(batch.papers)
+                if forward and downstream is not None:
+                    await self.queues[downstream].put(batch)
+                    metrics.blocked_seconds += time.perf_counter() - finished
+            except asyncio.CancelledError:
+                self._fail(batch)
+                raise
+
+    def _match(self, batch: IngestBatch):
+        rows = [paper_row(p, batch.default_venue) for p in batch.papers if p.get("title") and p.get("abstract")]
+        with self.session_factory() as db:
+            existing, first, signatures = match_batch(db, rows)
+        new = [i for i, row in enumerate(rows) if existing[i] is None and first[i] == i and row["title_key"]]
+        batch.rows = [rows[i] for i in new]
+        batch.signatures = [signatures[i] for i in new]
+
+    async def _parse(self, batch: IngestBatch) -> bool:
+        await asyncio.to_thread(self._match, batch)
+        if not batch.rows:
+            batch.future.set_result(0)
+            return False
+        return True
+
+    async def _tag(self, batch: IngestBatch) -> bool:
+        items = [(row["title"], row["abstract"], row["keywords"]) for row in batch.rows]
+        chunks = [items[start:start + TAG_CHUNK_SIZE] for start in range(0, len(items), TAG_CHUNK_SIZE)]
+        pool = self.pool
+        if pool is not None:
+            loop = asyncio.get_running_loop()
+            try:
+                results = await asyncio.gather(*(loop.run_in_executor(pool, _tag_chunk, chunk) for chunk in chunks))
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); later batches get a fresh pool
+                if self.pool is pool:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self.pool = self._new_pool()
+                raise
+        else:
+            results = [await asyncio.to_thread(_tag_chunk, items)]
+        for row, tags in zip(batch.rows, (tags for chunk in results for tags in chunk)):
+            row.update(tags)
+        return True
+
+    async def _embed(self, batch: IngestBatch) -> bool:
+        if self.embedder is not None:
+            batch.vectors = await asyncio.to_thread(self.embedder.encode_papers, batch.rows)
+        return True
+
+    def _insert(self, batch: IngestBatch) -> int:
+        with self.session_factory() as db:
+            # Papers stored after this batch was parsed (by other batches or jobs) are caught here
+            inserted = insert_new_rows(db, batch.rows, batch.signatures)
+            db.commit()
+        if inserted:
+            paper_catalogue.touch()
+            if batch.vectors is not None:
+                self.embedder.add_encoded([paper_id for _, paper_id in inserted],
+                                          [batch.rows[i] for i, _ in inserted],
+                                          batch.vectors[[i for i, _ in inserted]])
+        return len(inserted)
+
+    async def _store(self, batch: IngestBatch) -> bool:
+        saved = await asyncio.to_thread(self._insert, batch)
+        self.saved += saved
+        if not batch.future.done():
+            batch.future.set_result(saved)
+        return True
+
+    # --- metrics ------------------------------------------------------------
+
+    def metrics(self) -> Dict:
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            "running": bool(self.tasks),
+            "tag_workers": self.tag_workers if self.pool is not None else 1,
+            "embedding": self.embedder is not None,
+            "uptime_seconds": round(elapsed, 1),
+            "papers_saved": self.saved,
+            "papers_saved_per_second": round(self.saved / elapsed, 1) if elapsed else None,
+            "stages": {
+                stage: self.metrics_by_stage[stage].as_dict(self.queues.get(stage)) for stage in STAGES
+            },
+        }
+
+
+# Global instance
+ingest_pipeline = IngestPipeline()
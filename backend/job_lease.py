@@ -0,0 +1,85 @@
+"""
+Database leases that keep background table rewrites to one API worker
+
+Every uvicorn worker runs the same background threads. Work that rewrites
+shared tables (similarity_graph.py, map_layout.py) first claims the
+job_leases row named after it with one conditional UPDATE, as scheduler.py
+does for fetch jobs; the other workers skip that pass and try again on
+their next refresh. A lease left by a worker that died expires after
+WORK_LEASE_SECONDS; long passes renew it as they go.
+"""
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import JobLease
+
+WORK_LEASE_SECONDS = int(os.getenv("WORK_LEASE_SECONDS", "600"))
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class LeaseLost(RuntimeError):
+    """Another worker took over the lease while this one was working"""
+
+
+class WorkLease:
+    """Exclusive, expiring claim on the job_leases row ``name``; commits on the session it is given"""
+
+    def __init__(self, name: str, seconds: int = WORK_LEASE_SECONDS):
+        self.name = name
+        self.seconds = seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self, db: Session) -> bool:
+        """Claim the lease; False if another worker holds it"""
+        if db.query(JobLease.name).filter(JobLease.name == self.name).first() is None:
+            db.add(JobLease(name=self.name, papers_total=0, runs=0))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()  # Another worker created it first
+        now = _now()
+        claimed = db.query(JobLease).filter(
+            JobLease.name == self.name,
+            or_(JobLease.holder.is_(None), JobLease.lease_expires_at < now, JobLease.holder == self.holder),
+        ).update({
+            "holder": self.holder,
+            "lease_expires_at": now + timedelta(seconds=self.seconds),
+            "last_started_at": now,
+        }, synchronize_session=False)
+        db.commit()
+        return claimed == 1
+
+    def renew(self, db: Session):
+        """Extend the lease between the commits of a long pass; raises LeaseLost if it was taken over"""
+        renewed = db.query(JobLease).filter(JobLease.name == self.name, JobLease.holder == self.holder).update({
+            "lease_expires_at": _now() + timedelta(seconds=self.seconds),
+        }, synchronize_session=False)
+        db.commit()
+        if renewed != 1:
+            raise LeaseLost(f"Lost the {self.name} lease")
+
+    def release(self, db: Session, duration: Optional[float] = None, error: Optional[str] = None):
+        """Give up the lease; with a ``duration``, also record the pass as a run"""
+        values = {"holder": None, "lease_expires_at": None}
+        if duration is not None:
+            values.update({
+                "last_finished_at": _now(),
+                "last_duration_seconds": round(duration, 3),
+                "last_status": "failed" if error else "done",
+                "last_error": error,
+                "runs": JobLease.runs + 1,
+            })
+        db.query(JobLease).filter(JobLease.name == self.name, JobLease.holder == self.holder).update(
+            values, synchronize_session=False
+        )
+        db.commit()
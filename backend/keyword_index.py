@@ -0,0 +1,399 @@
+"""
+Inverted-index keyword search with BM25F scoring
+"""
+import os
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from models import Paper
+from smart_tagger import SmartTagger
+from paper_catalogue import CatalogueTracker, iter_papers_by_ids
+
+KEYWORD_INDEX_DIR = os.getenv("KEYWORD_INDEX_DIR", "./data/keyword_index")
+# Most ids match() returns, so callers can feed them to an IN (...) filter
+MATCH_LIMIT = int(os.getenv("KEYWORD_MATCH_LIMIT", "10000"))
+
+# Columns needed to index a paper
+INDEX_COLUMNS = (Paper.id, Paper.title, Paper.abstract, Paper.keywords, Paper.smart_tags, Paper.authors)
+
+
+def encode_varints(values: np.ndarray) -> np.ndarray:
+    """Variable-byte encode non-negative integers (7 bits per byte, high bit = more bytes follow)"""
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return np.empty(0, dtype=np.uint8)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28, 35):
+        nbytes += values >= (np.uint64(1) << np.uint64(shift))
+    ends = np.cumsum(nbytes)
+    owner = np.repeat(np.arange(len(values)), nbytes)
+    position = np.arange(ends[-1]) - np.repeat(ends - nbytes, nbytes)
+    out = (values[owner] >> (np.uint64(7) * position.astype(np.uint64))) & np.uint64(0x7F)
+    out[position < nbytes[owner] - 1] |= np.uint64(0x80)
+    return out.astype(np.uint8)
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """Inverse of encode_varints"""
+    if len(data) == 0:
+        return np.empty(0, dtype=np.int64)
+    last = (data & 0x80) == 0
+    ends = np.flatnonzero(last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    owner = np.cumsum(np.concatenate(([0], last[:-1].astype(np.int64))))
+    position = np.arange(len(data)) - starts[owner]
+    parts = (data & 0x7F).astype(np.int64) << (7 * position)
+    return np.add.reduceat(parts, starts)
+
+
+class _PostingList:
+    """
+    Postings for one term, ordered by document number.
+
+    Document numbers are stored as variable-byte encoded gaps; per-field
+    term frequencies as a (n, fields) uint8 matrix. New postings collect in
+    plain Python lists until the index compacts them.
+    """
+
+    __slots__ = ("gaps", "tfs", "count", "last_doc", "pending_docs", "pending_tfs")
+
+    def __init__(self, n_fields: int):
+        self.gaps = np.empty(0, dtype=np.uint8)
+        self.tfs = np.empty((0, n_fields), dtype=np.uint8)
+        self.count = 0
+        self.last_doc = -1
+        self.pending_docs: List[int] = []
+        self.pending_tfs: List[Tuple[int, ...]] = []
+
+    def __len__(self):
+        return self.count + len(self.pending_docs)
+
+    def add(self, doc: int, tfs: Tuple[int, ...]):
+        self.pending_docs.append(doc)
+        self.pending_tfs.append(tfs)
+
+    def compact(self):
+        """Fold pending postings into the compressed arrays"""
+        if not self.pending_docs:
+            return
+        docs = np.asarray(self.pending_docs, dtype=np.int64)
+        gaps = np.diff(docs, prepend=self.last_doc)
+        self.gaps = np.concatenate((self.gaps, encode_varints(gaps)))
+        tfs = np.minimum(np.asarray(self.pending_tfs, dtype=np.int64), 255).astype(np.uint8)
+        self.tfs = np.concatenate((self.tfs, tfs))
+        self.count += len(docs)
+        self.last_doc = int(docs[-1])
+        self.pending_docs = []
+        self.pending_tfs = []
+
+    def decode(self) -> Tuple[np.ndarray, np.ndarray]:
+        """All (doc numbers, per-field tfs), including pending postings"""
+        docs = np.cumsum(decode_varints(self.gaps)) - 1 if self.count else np.empty(0, dtype=np.int64)
+        tfs = self.tfs
+        if self.pending_docs:
+            docs = np.concatenate((docs, np.asarray(self.pending_docs, dtype=np.int64)))
+            tfs = np.concatenate((tfs, np.minimum(np.asarray(self.pending_tfs), 255).astype(np.uint8)))
+        return docs, tfs
+
+    def replace(self, docs: np.ndarray, tfs: np.ndarray):
+        """Overwrite with already-sorted postings"""
+        self.gaps = encode_varints(np.diff(docs, prepend=-1)) if len(docs) else np.empty(0, dtype=np.uint8)
+        self.tfs = tfs
+        self.count = len(docs)
+        self.last_doc = int(docs[-1]) if len(docs) else -1
+        self.pending_docs = []
+        self.pending_tfs = []
+
+
+class KeywordIndex:
+    """
+    BM25F keyword index over title, abstract, keywords, smart_tags and authors.
+
+    Every indexed version of a paper gets a new document number, so posting
+    lists only ever grow at the end and stay delta-encodable. Updating or
+    deleting a paper tombstones its old document; tombstoned postings are
+    skipped at query time and dropped when enough of them accumulate.
+    As in most BM25 engines, document frequencies include tombstoned
+    postings until that compaction runs.
+    """
+
+    FIELDS = ("title", "abstract", "keywords", "smart_tags", "authors")
+    FIELD_WEIGHTS = np.array([3.0, 1.0, 2.0, 2.0, 1.5])
+    FIELD_B = np.array([0.5, 0.75, 0.3, 0.3, 0.3])
+    K1 = 1.2
+    MIN_TOKEN_LENGTH = 1
+    COMPACT_PENDING = 200000
+    PURGE_DEAD_FRACTION = 0.25
+
+    def __init__(self, directory: Optional[str] = KEYWORD_INDEX_DIR):
+        self.directory = directory
+        self.tracker = CatalogueTracker()
+        self._lock = threading.RLock()
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        n_fields = len(self.FIELDS)
+        self.postings: Dict[str, _PostingList] = {}
+        self.doc_paper_ids = np.empty(0, dtype=np.int64)
+        self.doc_lengths = np.empty((0, n_fields), dtype=np.uint32)
+        self.alive = np.empty(0, dtype=bool)
+        self.n_docs = 0
+        self.doc_of: Dict[int, int] = {}
+        self.field_length_sums = np.zeros(n_fields, dtype=np.float64)
+        self.pending = 0
+        self.unsaved = 0
+
+    def __len__(self):
+        return len(self.doc_of)
+
+    @classmethod
+    def tokenize(cls, text: Optional[str]) -> List[str]:
+        return SmartTagger.tokenize(text or "", min_length=cls.MIN_TOKEN_LENGTH)
+
+    # --- writes -----------------------------------------------------------
+
+    def _grow(self, needed: int):
+        capacity = len(self.alive)
+        if needed <= capacity:
+            return
+        capacity = max(needed, 2 * capacity, 1024)
+        for name in ("doc_paper_ids", "doc_lengths", "alive"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.n_docs] = old[:self.n_docs]
+            setattr(self, name, new)
+
+    def add(self, paper_id: int, fields: Sequence[Optional[str]]):
+        """Index (or re-index) a paper; ``fields`` follow FIELDS order"""
+        self.remove([paper_id])
+        counters = [Counter(self.tokenize(text)) for text in fields]
+        terms = set().union(*counters)
+
+        self._grow(self.n_docs + 1)
+        doc = self.n_docs
+        self.n_docs += 1
+        self.doc_paper_ids[doc] = paper_id
+        lengths = [sum(counter.values()) for counter in counters]
+        self.doc_lengths[doc] = lengths
+        self.alive[doc] = True
+        self.doc_of[paper_id] = doc
+        self.field_length_sums += lengths
+
+        n_fields = len(self.FIELDS)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = _PostingList(n_fields)
+            posting.add(doc, tuple(counter.get(term, 0) for counter in counters))
+        self.pending += len(terms)
+        self.unsaved += 1
+        if self.pending >= self.COMPACT_PENDING:
+            self.compact()
+
+    def remove(self, paper_ids: Iterable[int]):
+        for paper_id in paper_ids:
+            doc = self.doc_of.pop(paper_id, None)
+            if doc is None:
+                continue
+            self.alive[doc] = False
+            self.field_length_sums -= self.doc_lengths[doc]
+            self.unsaved += 1
+
+    def compact(self):
+        """Compress pending postings and purge tombstones if there are many"""
+        for posting in self.postings.values():
+            posting.compact()
+        self.pending = 0
+        dead = self.n_docs - len(self.doc_of)
+        if dead > 1000 and dead > self.PURGE_DEAD_FRACTION * self.n_docs:
+            self._purge()
+
+    def _purge(self):
+        """Renumber live documents and drop tombstoned postings"""
+        live = np.flatnonzero(self.alive[:self.n_docs])
+        remap = np.full(self.n_docs, -1, dtype=np.int64)
+        remap[live] = np.arange(len(live))
+        for term in list(self.postings):
+            posting = self.postings[term]
+            docs, tfs = posting.decode()
+            keep = remap[docs] >= 0
+            if not keep.any():
+                del self.postings[term]
+                continue
+            posting.replace(remap[docs[keep]], tfs[keep])
+        n = len(live)
+        self.doc_paper_ids[:n] = self.doc_paper_ids[live]
+        self.doc_lengths[:n] = self.doc_lengths[live]
+        self.alive[:n] = True
+        self.alive[n:] = False
+        self.n_docs = n
+        self.doc_of = {int(pid): doc for doc, pid in enumerate(self.doc_paper_ids[:n])}
+
+    # --- catalogue sync ---------------------------------------------------
+
+    def sync(self, db: Session, force: bool = False):
+        """Apply papers inserted/updated/deleted since the last sync"""
+        with self._lock:
+            try:
+                changes = self.tracker.changes(db, force=force)
+                if not changes:
+                    return
+                self.remove(changes.deleted_ids)
+                for row in iter_papers_by_ids(db, changes.upserted_ids, INDEX_COLUMNS):
+                    self.add(row.id, (row.title, row.abstract, row.keywords, row.smart_tags, row.authors))
+                if len(changes.upserted_ids) + len(changes.deleted_ids) > 100:
+                    print(f"Keyword index synced: {len(changes.upserted_ids)} indexed, "
+                          f"{len(changes.deleted_ids)} removed")
+                if self.unsaved >= 1000:
+                    self.save()
+            except Exception as e:
+                print(f"Error syncing keyword index: {e}")
+                self.tracker.reset()
+
+    # --- queries ----------------------------------------------------------
+
+    def _score(self, terms: List[str], field_mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Summed BM25F scores and matched-term counts per live document"""
+        n_alive = max(len(self.doc_of), 1)
+        avg_lengths = self.field_length_sums / n_alive
+        avg_lengths[avg_lengths <= 0] = 1.0
+        weights = self.FIELD_WEIGHTS * field_mask
+
+        doc_chunks, score_chunks = [], []
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            docs, tfs = posting.decode()
+            keep = self.alive[docs]
+            docs, tfs = docs[keep], tfs[keep]
+            if len(docs) == 0:
+                continue
+            norm = 1.0 - self.FIELD_B + self.FIELD_B * (self.doc_lengths[docs] / avg_lengths)
+            pseudo_tf = (tfs / norm) @ weights
+            matched = pseudo_tf > 0
+            docs, pseudo_tf = docs[matched], pseudo_tf[matched]
+            df = min(len(posting), n_alive)
+            idf = np.log(1.0 + (n_alive - df + 0.5) / (df + 0.5))
+            doc_chunks.append(docs)
+            score_chunks.append(idf * pseudo_tf * (self.K1 + 1) / (pseudo_tf + self.K1))
+
+        if not doc_chunks:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, np.empty(0), empty
+        docs, inverse = np.unique(np.concatenate(doc_chunks), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_chunks))
+        matched_terms = np.bincount(inverse)
+        return docs, scores, matched_terms
+
+    def _field_mask(self, fields: Optional[Sequence[str]]) -> np.ndarray:
+        if fields is None:
+            return np.ones(len(self.FIELDS))
+        return np.array([1.0 if name in fields else 0.0 for name in self.FIELDS])
+
+    def _ranked(self, docs: np.ndarray, scores: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        if top_k < len(scores):
+            best = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(self.doc_paper_ids[docs[i]]), float(scores[i])) for i in best]
+
+    def search(self, query: str, top_k: int = 20, fields: Optional[Sequence[str]] = None) -> List[Tuple[int, float]]:
+        """BM25F-ranked (paper_id, score) pairs matching any query term"""
+        terms = list(dict.fromkeys(self.tokenize(query)))
+        with self._lock:
+            docs, scores, _ = self._score(terms, self._field_mask(fields))
+            return self._ranked(docs, scores, top_k)
+
+    def match(self, query: str, limit: int = MATCH_LIMIT, fields: Optional[Sequence[str]] = None) -> List[int]:
+        """Ids of papers containing every query term in ``fields``, best BM25F score first"""
+        terms = list(dict.fromkeys(self.tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            docs, scores, matched_terms = self._score(terms, self._field_mask(fields))
+            complete = matched_terms == len(terms)
+            return [pid for pid, _ in self._ranked(docs[complete], scores[complete], limit)]
+
+    def search_ids(self, query: str, db: Session, top_k: int = 20,
+                   fields: Optional[Sequence[str]] = None) -> List[Tuple[int, float]]:
+        """Sync with the papers table, then search()"""
+        self.sync(db)
+        return self.search(query, top_k, fields)
+
+    def match_ids(self, query: str, db: Session, limit: int = MATCH_LIMIT,
+                  fields: Optional[Sequence[str]] = None) -> List[int]:
+        """Sync with the papers table, then match()"""
+        self.sync(db)
+        return self.match(query, limit, fields)
+
+    # --- persistence ------------------------------------------------------
+
+    def save(self):
+        """Write the compacted index to ``directory``"""
+        if not self.directory:
+            return
+        with self._lock:
+            self.compact()
+            os.makedirs(self.directory, exist_ok=True)
+            terms = list(self.postings)
+            gap_sizes = np.fromiter((len(self.postings[t].gaps) for t in terms), dtype=np.int64, count=len(terms))
+            counts = np.fromiter((self.postings[t].count for t in terms), dtype=np.int64, count=len(terms))
+            n_fields = len(self.FIELDS)
+            tmp_path = os.path.join(self.directory, "index.tmp.npz")
+            np.savez(
+                tmp_path,
+                terms=np.array(terms, dtype=object),
+                gap_sizes=gap_sizes,
+                counts=counts,
+                gaps=np.concatenate([self.postings[t].gaps for t in terms]) if terms else np.empty(0, np.uint8),
+                tfs=np.concatenate([self.postings[t].tfs for t in terms]) if terms else np.empty((0, n_fields), np.uint8),
+                doc_paper_ids=self.doc_paper_ids[:self.n_docs],
+                doc_lengths=self.doc_lengths[:self.n_docs],
+                alive=self.alive[:self.n_docs],
+                tracker=np.array([self.tracker.state()], dtype=object),
+            )
+            os.replace(tmp_path, os.path.join(self.directory, "index.npz"))
+            self.unsaved = 0
+
+    def _load(self):
+        path = os.path.join(self.directory or "", "index.npz")
+        if not self.directory or not os.path.exists(path):
+            return
+        try:
+            with np.load(path, allow_pickle=True) as saved:
+                terms = saved["terms"]
+                gap_offsets = np.concatenate(([0], np.cumsum(saved["gap_sizes"])))
+                tf_offsets = np.concatenate(([0], np.cumsum(saved["counts"])))
+                gaps, tfs, counts = saved["gaps"], saved["tfs"], saved["counts"]
+                n_fields = len(self.FIELDS)
+                for i, term in enumerate(terms):
+                    posting = _PostingList(n_fields)
+                    posting.gaps = gaps[gap_offsets[i]:gap_offsets[i + 1]]
+                    posting.tfs = tfs[tf_offsets[i]:tf_offsets[i + 1]]
+                    posting.count = int(counts[i])
+                    self.postings[str(term)] = posting
+                self._grow(len(saved["alive"]))
+                self.n_docs = len(saved["alive"])
+                self.doc_paper_ids[:self.n_docs] = saved["doc_paper_ids"]
+                self.doc_lengths[:self.n_docs] = saved["doc_lengths"]
+                self.alive[:self.n_docs] = saved["alive"]
+                tracker_state = saved["tracker"][0]
+            for posting in self.postings.values():
+                if posting.count:
+                    posting.last_doc = int(np.sum(decode_varints(posting.gaps))) - 1
+            live = np.flatnonzero(self.alive[:self.n_docs])
+            self.doc_of = {int(self.doc_paper_ids[doc]): int(doc) for doc in live}
+            self.field_length_sums = self.doc_lengths[live].sum(axis=0).astype(np.float64)
+            self.tracker.restore(tracker_state, self.doc_of.keys())
+            print(f"Loaded keyword index with {len(self.doc_of)} papers from {self.directory}")
+        except Exception as e:
+            print(f"Could not load keyword index, rebuilding: {e}")
+            self._reset()
+
+# Global instance
+keyword_index = KeywordIndex()
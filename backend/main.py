@@ -1,7 +1,11 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import asyncio
 import os
 from dotenv import load_dotenv
 
@@ -12,7 +16,7 @@ from schemas import (
     UserCreate, UserResponse,
     RecommendationResponse, InteractionCreate, InteractionResponse,
     Token, UserLogin,
-    ChatRequest, ChatResponse, FetchPapersRequest, BibTeXUploadRequest,
+    ChatRequest, ChatResponse, FetchPapersRequest, HarvestRequest, BibTeXUploadRequest,
     SignupStep1, SignupStep2, SignupStep3, GuestInteractionCreate,
     PaperURLUpdate,
     OnboardingData, OnboardingResponse,
@@ -22,12 +26,24 @@ from schemas import (
 )
 from models import InteractionStatus
 from recommendation_engine import RecommendationEngine
-from paper_fetchers import PaperFetcherService, ArxivFetcher, PubMedFetcher
+from async_fetchers import async_fetcher
+from harvester import harvester, HARVEST_SOURCES, HARVEST_MAX_PAPERS
+from ingest_pipeline import ingest_pipeline
+from scheduler import scheduler, SCHEDULER_ENABLED
+from ingest import upsert_papers, papers_by_ids
 from chat_service import ChatService
 from smart_tagger import SmartTagger
 from topic_progression import TopicProgressionAnalyzer
 from reading_patterns import ReadingPatternAnalyzer
+from keyword_index import keyword_index
+from near_duplicates import delete_derived_rows
+from hybrid_search import hybrid_search_engine, SearchTimings, SEARCH_MODES, FUSION_METHODS
+from graph_builder import build_paper_graph, popular_papers_query
+from graph_snapshot import GraphSnapshotManager
+from map_layout import MapLayout
+from paper_map import PaperMap, MAX_ZOOM, MAP_MAX_VIEWPORT_TILES
 from semantic_search import semantic_search_engine
+import paper_catalogue
 from auto_fetch import auto_fetcher
 from guest_session import GuestSessionManager
 from reading_habits import ReadingHabitsTracker
@@ -72,10 +88,35 @@ try:
 except Exception as e:
     print(f"Migration v4 note: {e}")
 
+# Run v5 migration for paper identity keys
+try:
+    from migrate_v5 import migrate_v5
+    migrate_v5()
+except Exception as e:
+    print(f"Migration v5 note: {e}")
+
+# Run v6 migration for unique DOI and arXiv keys
+try:
+    from migrate_v6 import migrate_v6
+    migrate_v6()
+except Exception as e:
+    print(f"Migration v6 note: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Every worker runs the scheduler; job leases make each run happen once
+    if SCHEDULER_ENABLED:
+        scheduler.start()
+    yield
+    await scheduler.stop()
+    await ingest_pipeline.close()
+    await async_fetcher.close()
+
 app = FastAPI(
     title="PaperReads API",
     description="A modern research paper recommendation platform",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -121,6 +162,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the frontend read search stage timings
+    expose_headers=["Server-Timing", "ETag", "X-Map-Version"],
 )
 
 # Security
@@ -183,7 +226,21 @@ async def get_current_user(
 # Initialize recommendation engine, chat service, and topic progression
 rec_engine = RecommendationEngine()
 chat_service = ChatService(rec_engine)
-topic_progression = TopicProgressionAnalyzer()
+topic_progression = TopicProgressionAnalyzer(rec_engine.tfidf)
+
+# Anonymous graph snapshot, built with its own analyzer so background
+# rebuilds do not share per-request state with live graph requests
+snapshot_topic_progression = TopicProgressionAnalyzer(rec_engine.tfidf)
+graph_snapshots = GraphSnapshotManager(
+    lambda db, limit: build_paper_graph(popular_papers_query(db).limit(limit).all(), db, snapshot_topic_progression)
+)
+
+# Precomputed map layout and level-of-detail tiles over the whole catalogue
+map_layout = MapLayout(rec_engine.tfidf, semantic_search_engine)
+paper_map = PaperMap(map_layout)
+
+# Harvested and fetched papers are embedded by the ingest pipeline as they are stored
+ingest_pipeline.embedder = semantic_search_engine
 
 @app.get("/")
 async def root():
@@ -193,6 +250,54 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/api/admin/recommendation-cache")
+async def get_recommendation_cache_stats(current_user: User = Depends(get_current_user)):
+    """Hit/miss counters and size of the per-user recommendation cache"""
+    return rec_engine.cache.stats()
+
+@app.get("/api/admin/fetchers")
+async def get_fetcher_stats(current_user: User = Depends(get_current_user)):
+    """Request, retry and failure counts of the external paper fetchers"""
+    return async_fetcher.stats()
+
+@app.get("/api/admin/harvests")
+async def get_harvests(current_user: User = Depends(get_current_user)):
+    """Stored bulk-harvest cursors (progress per source and query)"""
+    return harvester.cursors()
+
+@app.post("/api/admin/harvests", status_code=status.HTTP_202_ACCEPTED)
+async def start_harvest(request: HarvestRequest, current_user: User = Depends(get_current_user)):
+    """Start or resume a bulk harvest in the background"""
+    if request.source not in HARVEST_SOURCES:
+        raise HTTPException(status_code=400, detail=f"Unknown source: {request.source}")
+    if not 1 <= request.max_papers <= HARVEST_MAX_PAPERS:
+        raise HTTPException(status_code=400, detail=f"max_papers must be between 1 and {HARVEST_MAX_PAPERS}")
+    if not harvester.start(request.source, request.query, request.max_papers, request.restart):
+        raise HTTPException(status_code=409, detail="This harvest is already running")
+    return {"source": request.source, "query": request.query, "status": "started"}
+
+@app.get("/api/admin/ingest")
+async def get_ingest_metrics(current_user: User = Depends(get_current_user)):
+    """Per-stage throughput, queue depth and backpressure of the ingest pipeline"""
+    return ingest_pipeline.metrics()
+
+@app.get("/api/admin/jobs")
+async def get_scheduled_jobs(current_user: User = Depends(get_current_user)):
+    """Scheduled background jobs: next run, lease holder, last run's duration, status and papers ingested"""
+    return await asyncio.to_thread(scheduler.status)
+
+@app.post("/api/admin/jobs/{job_name:path}/run", status_code=status.HTTP_202_ACCEPTED)
+async def run_scheduled_job(job_name: str, current_user: User = Depends(get_current_user)):
+    """Make a scheduled job due now; a worker picks it up on its next check"""
+    if not await asyncio.to_thread(scheduler.run_now, job_name):
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_name}")
+    return {"name": job_name, "status": "due"}
+
+@app.get("/api/admin/graph-snapshot")
+async def get_graph_snapshot_stats(current_user: User = Depends(get_current_user)):
+    """Version, size and rebuild counters of the anonymous graph snapshot"""
+    return graph_snapshots.stats()
+
 # Paper endpoints
 @app.post("/api/papers", response_model=PaperResponse, status_code=status.HTTP_201_CREATED)
 async def create_paper(paper: PaperCreate, db: Session = Depends(get_db)):
@@ -213,16 +318,24 @@ async def create_paper(paper: PaperCreate, db: Session = Depends(get_db)):
     
     db_paper = Paper(**paper_data)
     db.add(db_paper)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="A paper with this DOI or arXiv id already exists")
+    paper_catalogue.touch()
     db.refresh(db_paper)
     return db_paper
 
 @app.get("/api/papers", response_model=List[PaperResponse])
 async def get_papers(
+    response: Response,
     skip: int = 0,
     limit: int = 300,  # Increased default to show more papers
     search: Optional[str] = None,
     search_arxiv: bool = False,
+    mode: Optional[str] = None,
+    fusion: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
@@ -231,21 +344,29 @@ async def get_papers(
     Args:
         search: Search query (uses semantic search if available)
         search_arxiv: If True, also search arXiv directly and include results
+        mode: "hybrid" (BM25 + semantic), "semantic" or "keyword"; defaults to SEARCH_MODE
+        fusion: How hybrid mode merges rankings: "rrf" or "weighted"; defaults to SEARCH_FUSION
     """
     papers = []
     
     if search:
-        # First, search local database with semantic search
-        all_local_papers = db.query(Paper).all()
-        if all_local_papers:
-            # Use semantic search
-            local_results = semantic_search_engine.search(search, all_local_papers, top_k=limit * 2)
-            papers.extend(local_results[:limit])
+        if mode is not None and mode not in SEARCH_MODES:
+            raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(SEARCH_MODES)}")
+        if fusion is not None and fusion not in FUSION_METHODS:
+            raise HTTPException(status_code=400, detail=f"fusion must be one of {', '.join(FUSION_METHODS)}")
+
+        # First, search the local database. Ranking runs on the persisted
+        # indexes; only the top results are loaded from the DB
+        timings = SearchTimings()
+        papers.extend(hybrid_search_engine.search_papers(
+            search, db, top_k=limit, mode=mode, fusion=fusion, timings=timings
+        ))
+        response.headers["Server-Timing"] = timings.header()
         
         # If search_arxiv is True, also search arXiv directly
         if search_arxiv:
             try:
-                arxiv_results = ArxivFetcher.search(search, max_results=limit)
+                arxiv_results = await async_fetcher.search_arxiv(search, max_results=limit)
                 # Convert to Paper objects (don't save, just return)
                 for arxiv_paper in arxiv_results:
                     # Check if already in results
@@ -270,7 +391,7 @@ async def get_papers(
         # If no results from local DB, try arXiv
         if not papers and not search_arxiv:
             try:
-                arxiv_results = ArxivFetcher.search(search, max_results=limit)
+                arxiv_results = await async_fetcher.search_arxiv(search, max_results=limit)
                 for arxiv_paper in arxiv_results:
                     temp_paper = Paper(
                         title=arxiv_paper.get("title", ""),
@@ -303,8 +424,13 @@ async def get_papers(
     
     return papers[:limit]
 
+# Search matches kept per graph node, so the id list stays a small IN clause
+GRAPH_SEARCH_MATCH_FACTOR = int(os.getenv("GRAPH_SEARCH_MATCH_FACTOR", "3"))
+
 @app.get("/api/papers/graph")
 async def get_papers_graph(
+    request: Request,
+    response: Response,
     search: Optional[str] = None,
     limit: int = 2000,  # Increased to show thousands of papers
     user_id: Optional[int] = None,
@@ -316,8 +442,19 @@ async def get_papers_graph(
     - If no user: returns general trends (popular papers by domain)
     - If user with no reads: returns papers in user's preferred domains
     - If user with reads: returns papers user has read + related papers
+
+    ``search`` keeps papers whose title, abstract or authors contain every
+    search word as a whole token (keyword_index.py), not as a substring;
+    only the limit x GRAPH_SEARCH_MATCH_FACTOR best-ranked matches are
+    considered, so a very broad search shows its strongest matches.
     """
     try:
+        # Lay out papers added since the last request in the background
+        map_layout.refresh(db.get_bind())
+        if current_user is None and not search and limit == graph_snapshots.limit:
+            # Identical for every anonymous visitor: serve the prebuilt snapshot
+            return graph_snapshots.respond(graph_snapshots.get(db), request)
+        
         # Determine which papers to show
         if current_user:
             # Check if user has read any papers
@@ -366,189 +503,87 @@ async def get_papers_graph(
                     query = db.query(Paper).order_by(Paper.citation_count.desc())
         else:
             # No user logged in - show best papers from history
-            # Prioritize papers that have been read/studied by users (community engagement)
-            # combined with high citation counts
-            
-            from sqlalchemy import func, case, desc
-            
-            # Get all papers with their engagement scores
-            # Calculate engagement score based on user interactions
-            engagement_subquery = db.query(
-                UserPaperInteraction.paper_id,
-                func.sum(
-                    case(
-                        (UserPaperInteraction.status == InteractionStatus.CITED, 5),
-                        (UserPaperInteraction.status == InteractionStatus.IMPLEMENTED, 4),
-                        (UserPaperInteraction.status == InteractionStatus.STUDIED, 3),
-                        (UserPaperInteraction.status == InteractionStatus.READ, 2),
-                        (UserPaperInteraction.status == InteractionStatus.READING, 1),
-                        else_=0
-                    )
-                ).label('engagement_score')
-            ).group_by(UserPaperInteraction.paper_id).subquery()
-            
-            # Get papers with engagement scores, ordered by combined score
-            papers_with_scores = db.query(
-                Paper.id,
-                Paper,
-                func.coalesce(engagement_subquery.c.engagement_score, 0).label('engagement')
-            ).outerjoin(
-                engagement_subquery, Paper.id == engagement_subquery.c.paper_id
-            ).order_by(
-                # Combined score: engagement (weighted) + normalized citation count
-                (
-                    func.coalesce(engagement_subquery.c.engagement_score, 0) * 10 +
-                    func.coalesce(Paper.citation_count, 0) / 10.0
-                ).desc(),
-                Paper.citation_count.desc()
-            ).limit(limit).all()
-            
-            # Extract paper IDs in order
-            if papers_with_scores:
-                paper_ids = [row[0] for row in papers_with_scores]
-                # Re-query papers in the correct order
-                from sqlalchemy import case as sql_case
-                order_case = sql_case(
-                    {pid: idx for idx, pid in enumerate(paper_ids)},
-                    value=Paper.id
-                )
-                query = db.query(Paper).filter(Paper.id.in_(paper_ids)).order_by(order_case)
-            else:
-                # Fallback: just get papers by citation count
-                query = db.query(Paper).order_by(Paper.citation_count.desc())
+            # (anonymous requests without a search are served from the snapshot above)
+            query = popular_papers_query(db)
         
         if search:
-            query = query.filter(
-                (Paper.title.contains(search)) |
-                (Paper.abstract.contains(search)) |
-                (Paper.authors.contains(search))
-            )
+            # Resolve the search terms through the inverted index instead of
+            # substring-scanning title/abstract/authors in SQL
+            matching_ids = keyword_index.match_ids(search, db, limit=max(limit, 1) * GRAPH_SEARCH_MATCH_FACTOR,
+                                                   fields=("title", "abstract", "authors"))
+            if matching_ids or keyword_index.tokenize(search):
+                query = query.filter(Paper.id.in_(matching_ids))
+            else:
+                query = query.filter(
+                    (Paper.title.contains(search)) |
+                    (Paper.abstract.contains(search)) |
+                    (Paper.authors.contains(search))
+                )
         
         # Execute query - should return Paper objects directly
         papers = query.limit(limit).all()
         
-        # Build graph structure
-        nodes = []
-        links = []
-        
-        # Create nodes
-        paper_map = {}
-        for paper in papers:
-            node = {
-                "id": int(paper.id),
-                "label": paper.title[:50] + "..." if len(paper.title) > 50 else paper.title,
-                "title": paper.title,
-                "authors": paper.authors or "",
-                "venue": paper.venue or "",
-                "year": int(paper.year) if paper.year else None,
-                "keywords": paper.keywords or "",
-                "url": paper.url or "",
-                "doi": paper.doi or "",
-                "group": paper.venue or "Other" if paper.venue else "Other"
-            }
-            nodes.append(node)
-            paper_map[paper.id] = paper
-        
-        # Create links based on topic progression (primary) and other criteria
-        # For large datasets, limit link creation to avoid performance issues
-        max_links = min(5000, len(papers) * 10)  # Cap at 5000 links or 10 per paper
-        link_count = 0
-        
-        if len(papers) > 0:
-            try:
-                # 1. Topic progression paths (PRIMARY - most important) - limit for performance
-                if len(papers) <= 500:
-                    progression_links = topic_progression.create_progression_paths(papers, max_paths_per_paper=4)
-                    links.extend(progression_links[:max_links])
-                    link_count += len(progression_links)
-                else:
-                    # For large datasets, skip expensive topic progression
-                    progression_links = []
-                
-                # Track which pairs already have progression links
-                progression_pairs = set()
-                for link in progression_links:
-                    progression_pairs.add(tuple(sorted([link["source"], link["target"]])))
-                
-                # 2. Domain/topic-based links (for papers without progression paths)
-                domain_groups = {}
-                for paper in papers:
-                    if paper.domains:
-                        for domain in paper.domains.split(','):
-                            domain = domain.strip()
-                            if domain:
-                                if domain not in domain_groups:
-                                    domain_groups[domain] = []
-                                domain_groups[domain].append(paper.id)
-                
-                # Connect papers in same domain (if no progression link exists)
-                # Limit connections per domain to avoid explosion
-                for domain, paper_ids in domain_groups.items():
-                    if len(paper_ids) > 1 and link_count < max_links:
-                        # Limit to connecting each paper to max 5 others in same domain
-                        for i, pid1 in enumerate(paper_ids[:100]):  # Limit domain size
-                            if link_count >= max_links:
-                                break
-                            connected = 0
-                            for pid2 in paper_ids[i+1:]:
-                                if connected >= 5 or link_count >= max_links:
-                                    break
-                                pair_key = tuple(sorted([pid1, pid2]))
-                                if pair_key not in progression_pairs and pid1 in paper_map and pid2 in paper_map:
-                                    if not any((l["source"] == pid1 and l["target"] == pid2) or 
-                                              (l["source"] == pid2 and l["target"] == pid1) for l in links):
-                                        links.append({
-                                            "source": int(pid1),
-                                            "target": int(pid2),
-                                            "value": 1,
-                                            "type": "domain"
-                                        })
-                                        link_count += 1
-                                        connected += 1
-                
-                # 3. Venue-based links (for additional context) - skip for very large datasets
-                if len(papers) <= 1000:
-                    venue_groups = {}
-                    for paper in papers:
-                        if paper.venue:
-                            if paper.venue not in venue_groups:
-                                venue_groups[paper.venue] = []
-                            venue_groups[paper.venue].append(paper.id)
-                    
-                    # Connect papers from same venue (if no other link exists)
-                    for venue, paper_ids in venue_groups.items():
-                        if len(paper_ids) > 1 and link_count < max_links:
-                            for i, pid1 in enumerate(paper_ids[:50]):  # Limit venue size
-                                if link_count >= max_links:
-                                    break
-                                for pid2 in paper_ids[i+1:i+6]:  # Max 5 connections per paper
-                                    if link_count >= max_links:
-                                        break
-                                    pair_key = tuple(sorted([pid1, pid2]))
-                                    if pair_key not in progression_pairs and pid1 in paper_map and pid2 in paper_map:
-                                        if not any((l["source"] == pid1 and l["target"] == pid2) or 
-                                                  (l["source"] == pid2 and l["target"] == pid1) for l in links):
-                                            links.append({
-                                                "source": int(pid1),
-                                                "target": int(pid2),
-                                                "value": 0.5,
-                                                "type": "venue"
-                                            })
-                                            link_count += 1
-            except Exception as e:
-                print(f"Error creating links: {e}")
-                import traceback
-                traceback.print_exc()
-                # Continue without links if similarity fails
-        
-        return {
-            "nodes": nodes,
-            "links": links
-        }
+        timings = SearchTimings()
+        graph = build_paper_graph(papers, db, topic_progression, timings)
+        response.headers["Server-Timing"] = timings.header()
+        return graph
     except Exception as e:
         print(f"Error in get_papers_graph: {e}")
         return {"nodes": [], "links": []}
 
+# Paper map tiles (level of detail)
+@app.get("/api/map")
+async def get_map_info(db: Session = Depends(get_db)):
+    """Version and size of the paper map, for clients choosing tiles"""
+    index = paper_map.get(db)
+    return {
+        "version": index.version,
+        "papers": len(index),
+        "edges": len(index.edge_sources),
+        "max_zoom": MAX_ZOOM,
+        "built_at": index.built_at,
+    }
+
+@app.get("/api/map/tiles/{zoom}/{tile_x}/{tile_y}")
+async def get_map_tile(zoom: int, tile_x: int, tile_y: int, db: Session = Depends(get_db)):
+    """One map tile as NDJSON: individual papers when sparse, cluster super-nodes when dense"""
+    if not 0 <= zoom <= MAX_ZOOM or not (0 <= tile_x < 1 << zoom and 0 <= tile_y < 1 << zoom):
+        raise HTTPException(status_code=400, detail="Tile outside the map")
+    index = paper_map.get(db)
+    return StreamingResponse(
+        paper_map.ndjson(index.tile(zoom, tile_x, tile_y)),
+        media_type="application/x-ndjson",
+        headers={"X-Map-Version": str(index.version)},
+    )
+
+@app.get("/api/map/viewport")
+async def get_map_viewport(
+    zoom: int,
+    x0: float = 0.0,
+    y0: float = 0.0,
+    x1: float = 1.0,
+    y1: float = 1.0,
+    db: Session = Depends(get_db)
+):
+    """Every tile at ``zoom`` overlapping a box of the unit square, streamed as NDJSON"""
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise HTTPException(status_code=400, detail="Zoom outside the map")
+    try:
+        tiles = PaperMap.viewport_tiles(zoom, x0, y0, x1, y1, MAP_MAX_VIEWPORT_TILES)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    index = paper_map.get(db)
+
+    def objects():
+        for tile_x, tile_y in tiles:
+            yield from index.tile(zoom, tile_x, tile_y)
+
+    return StreamingResponse(
+        paper_map.ndjson(objects()),
+        media_type="application/x-ndjson",
+        headers={"X-Map-Version": str(index.version)},
+    )
+
 @app.get("/api/papers/{paper_id}", response_model=PaperResponse)
 async def get_paper(paper_id: int, db: Session = Depends(get_db)):
     """Get a specific paper"""
@@ -586,10 +621,16 @@ async def update_paper(
     if not paper:
         raise HTTPException(status_code=404, detail="Paper not found")
     
-    for key, value in paper_update.dict(exclude_unset=True).items():
+    changes = paper_update.dict(exclude_unset=True)
+    for key, value in changes.items():
         setattr(paper, key, value)
     
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="A paper with this DOI or arXiv id already exists")
+    paper_catalogue.touch()
     db.refresh(paper)
     return paper
 
@@ -599,8 +640,10 @@ async def delete_paper(paper_id: int, db: Session = Depends(get_db)):
     paper = db.query(Paper).filter(Paper.id == paper_id).first()
     if not paper:
         raise HTTPException(status_code=404, detail="Paper not found")
+    delete_derived_rows(db, [paper_id])
     db.delete(paper)
     db.commit()
+    paper_catalogue.touch()
     return None
 
 # Authentication endpoints
@@ -659,6 +702,7 @@ async def register_step2(user_id: int, step2: SignupStep2, db: Session = Depends
     if additional_info:
         user.bio = "; ".join(additional_info)
     db.commit()
+    rec_engine.invalidate_profile(user_id, db)
     db.refresh(user)
     return user
 
@@ -683,6 +727,7 @@ async def register_step3(
         migrated = GuestSessionManager.migrate_guest_interactions(db, user_id, interactions_data)
         print(f"Migrated {migrated} guest interactions to user {user_id}")
     db.commit()
+    rec_engine.invalidate_profile(user_id, db)
     db.refresh(user)
     return user
 
@@ -698,6 +743,7 @@ async def migrate_guest_interactions(
         raise HTTPException(status_code=403, detail="Not authorized")
     interactions_data = [interaction.dict() for interaction in interactions]
     migrated = GuestSessionManager.migrate_guest_interactions(db, user_id, interactions_data)
+    rec_engine.cache.invalidate(user_id)
     return {"message": f"Migrated {migrated} interactions", "count": migrated}
 
 @app.post("/api/auth/login", response_model=Token)
@@ -782,6 +828,7 @@ async def update_user_profile(
         user.bio = bio
     
     db.commit()
+    rec_engine.invalidate_profile(user_id, db)
     db.refresh(user)
     return UserResponse.model_validate(user)
 
@@ -810,12 +857,14 @@ async def create_interaction(
         if interaction.where_can_use is not None:
             existing.where_can_use = interaction.where_can_use
         db.commit()
+        rec_engine.cache.invalidate(interaction.user_id)
         db.refresh(existing)
         return {"message": "Interaction updated", "interaction": InteractionResponse.model_validate(existing)}
     
     db_interaction = UserPaperInteraction(**interaction.dict())
     db.add(db_interaction)
     db.commit()
+    rec_engine.cache.invalidate(interaction.user_id)
     db.refresh(db_interaction)
     return {"message": "Interaction created", "interaction": InteractionResponse.model_validate(db_interaction)}
 
@@ -878,13 +927,25 @@ async def get_read_papers(
 async def get_recommendations(
     user_id: int,
     limit: int = 10,
+    precomputed: bool = False,
     db: Session = Depends(get_db)
 ):
-    """Get personalized paper recommendations for a user"""
+    """
+    Get personalized paper recommendations for a user
+    
+    Args:
+        precomputed: Serve the results of the last precompute_recommendations.py
+            run if they are still current, instead of scoring live
+    """
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
+    if precomputed:
+        recommendations = rec_engine.get_precomputed(user_id, db, limit)
+        if recommendations is not None:
+            return recommendations
+    
     recommendations = rec_engine.get_recommendations(user_id, db, limit)
     return recommendations
 
@@ -914,7 +975,6 @@ async def upload_bibtex(
         
         papers_data = BibTeXParser.parse_bibtex(request.bibtex_content)
         
-        saved_papers = []
         for paper_data in papers_data:
             # Enhanced tagging based on keywords from BibTeX
             existing_keywords = paper_data.get("keywords", "")
@@ -933,33 +993,15 @@ async def upload_bibtex(
                 paper_data["keywords"] = tag_result["keywords"]
             paper_data["smart_tags"] = tag_result["smart_tags"]
             paper_data["domains"] = ", ".join(tag_result["domains"]) if tag_result["domains"] else None
-            
-            # Check if paper already exists by title
-            existing = db.query(Paper).filter(Paper.title == paper_data.get("title", "")).first()
-            if existing:
-                # Update existing paper with new data (especially URL if missing)
-                if not existing.url and paper_data.get("url"):
-                    existing.url = paper_data["url"]
-                if not existing.doi and paper_data.get("doi"):
-                    existing.doi = paper_data["doi"]
-                if not existing.abstract and paper_data.get("abstract"):
-                    existing.abstract = paper_data["abstract"]
-                existing.keywords = paper_data["keywords"]
-                existing.smart_tags = paper_data["smart_tags"]
-                existing.domains = paper_data["domains"]
-                saved_papers.append(existing)
-            else:
-                db_paper = Paper(**paper_data)
-                db.add(db_paper)
-                saved_papers.append(db_paper)
-        
-        db.commit()
         
-        # Refresh all papers
-        for paper in saved_papers:
-            db.refresh(paper)
-        
-        return saved_papers
+        # Match existing papers on DOI / arXiv id / normalised title in bulk;
+        # matches get fresh tags and any URL, DOI or abstract they lack
+        paper_ids = upsert_papers(
+            db, papers_data,
+            overwrite=("keywords", "smart_tags", "domains"),
+            fill=("url", "doi", "abstract")
+        )
+        return papers_by_ids(db, paper_ids)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error parsing BibTeX: {str(e)}")
 
@@ -974,56 +1016,23 @@ async def fetch_external_papers(
         papers = []
         
         if request.query:
-            # Search with query
-            if "arxiv" in request.sources:
-                try:
-                    arxiv_papers = ArxivFetcher.search(request.query, max_results=request.max_per_source)
-                    papers.extend(arxiv_papers)
-                except Exception as e:
-                    print(f"Error fetching from arXiv: {e}")
-            
-            if "pubmed" in request.sources:
-                try:
-                    pubmed_papers = PubMedFetcher.search(request.query, max_results=request.max_per_source)
-                    papers.extend(pubmed_papers)
-                except Exception as e:
-                    print(f"Error fetching from PubMed: {e}")
+            # Search with query; sources are fetched concurrently
+            papers = await async_fetcher.search_sources(
+                request.query, request.sources, max_per_source=request.max_per_source
+            )
         else:
             # Fetch recent papers
-            try:
-                papers = PaperFetcherService.fetch_recent_papers(
-                    sources=request.sources,
-                    max_per_source=request.max_per_source
-                )
-            except Exception as e:
-                print(f"Error fetching recent papers: {e}")
+            papers = await async_fetcher.fetch_recent_papers(
+                sources=request.sources,
+                max_per_source=request.max_per_source
+            )
         
         if not papers:
             return []
         
-        # Save papers to database (avoid duplicates)
-        saved_papers = []
-        for paper_data in papers:
-            # Ensure required fields exist
-            if not paper_data.get("title") or not paper_data.get("authors"):
-                continue
-                
-            # Check if paper already exists by title
-            existing = db.query(Paper).filter(Paper.title == paper_data["title"]).first()
-            if not existing:
-                db_paper = Paper(**paper_data)
-                db.add(db_paper)
-                saved_papers.append(db_paper)
-            else:
-                saved_papers.append(existing)
-        
-        db.commit()
-        
-        # Refresh all papers
-        for paper in saved_papers:
-            db.refresh(paper)
-        
-        return saved_papers
+        # Save papers to database (avoid duplicates); existing matches are returned as stored
+        papers = [p for p in papers if p.get("title") and p.get("authors")]
+        return papers_by_ids(db, upsert_papers(db, papers))
     except Exception as e:
         print(f"Error in fetch_external_papers: {e}")
         raise HTTPException(status_code=500, detail=f"Error fetching papers: {str(e)}")
@@ -1075,6 +1084,7 @@ async def complete_onboarding(
         user.preferred_domains = ", ".join(data.preferred_domains)
 
     db.commit()
+    rec_engine.invalidate_profile(user.id, db)
     db.refresh(user)
 
     return OnboardingResponse(
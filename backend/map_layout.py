@@ -0,0 +1,377 @@
+"""
+Precomputed 2D layout of the paper map
+
+Positions are computed offline instead of by a force simulation in the
+browser. A full layout reduces the paper vectors (sentence embeddings when
+every paper has one, the shared TF-IDF rows otherwise) to LAYOUT_DIMS
+dimensions, connects each paper to its LAYOUT_NEIGHBOURS nearest
+neighbours, starts from UMAP (when ``umap-learn`` is installed) or PCA,
+and refines with Fruchterman-Reingold force steps whose repulsion is
+approximated Barnes-Hut style on a quadtree of cell centres of mass.
+Positions are scaled to the unit square and stored in paper_layout.
+
+New papers are placed at the similarity-weighted centre of their nearest
+already-placed papers, so existing positions never move between full
+layouts. Once placed papers exceed LAYOUT_REBUILD_FRACTION of the
+catalogue the next update lays everything out again. With several API
+workers, only the one holding the map_layout lease (job_lease.py) writes.
+
+Usage:
+    python map_layout.py            # lay out the catalogue, or place new papers
+    python map_layout.py --rebuild  # recompute every position
+"""
+import argparse
+import os
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.decomposition import PCA, TruncatedSVD
+from sklearn.preprocessing import normalize
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from ann_index import blocked_top_k
+from incremental_tfidf import IncrementalTfidf
+from job_lease import WorkLease
+from models import JobLease, PaperLayout
+from paper_catalogue import CatalogueTracker
+
+# UMAP is optional: without it the layout starts from PCA
+try:
+    import umap
+    UMAP_AVAILABLE = True
+except ImportError:
+    UMAP_AVAILABLE = False
+
+LAYOUT_DIMS = int(os.getenv("LAYOUT_DIMS", "32"))
+LAYOUT_NEIGHBOURS = int(os.getenv("LAYOUT_NEIGHBOURS", "10"))
+LAYOUT_ITERATIONS = int(os.getenv("LAYOUT_ITERATIONS", "50"))
+# Share of the catalogue that may be placed incrementally before a full layout
+LAYOUT_REBUILD_FRACTION = float(os.getenv("LAYOUT_REBUILD_FRACTION", "0.2"))
+LAYOUT_LEASE = "map_layout"  # job_leases row; its last_finished_at changes with every committed pass
+
+
+def unit_square(points: np.ndarray) -> np.ndarray:
+    """Scale 2D points into [0, 1], clipping the outermost 0.5% on each side"""
+    if len(points) == 0:
+        return points.astype(np.float32)
+    low = np.percentile(points, 0.5, axis=0)
+    high = np.percentile(points, 99.5, axis=0)
+    span = np.where(high > low, high - low, 1.0)
+    return np.clip((points - low) / span, 0.0, 1.0).astype(np.float32)
+
+
+def _repulsion(positions: np.ndarray, strength: float, depth: int) -> np.ndarray:
+    """
+    Approximate all-pairs repulsion ``strength * d / |d|^2`` on a quadtree
+
+    At each level a point interacts with the centres of mass of the cells
+    that are children of its parent's neighbours but not its own neighbours
+    (the cells that were too close one level up). At the deepest level the
+    points of the neighbouring cells, its own included, are summed exactly.
+    """
+    lo = positions.min(axis=0)
+    span = max(float((positions.max(axis=0) - lo).max()), 1e-9)
+    unit = (positions - lo) / span
+    force = np.zeros_like(positions)
+    for level in range(2, depth + 1):
+        size = 1 << level
+        cells = np.minimum((unit * size).astype(np.int64), size - 1)
+        cell_x, cell_y = cells[:, 0], cells[:, 1]
+        flat = cell_y * size + cell_x
+        mass = np.bincount(flat, minlength=size * size).astype(np.float64)
+        sum_x = np.bincount(flat, weights=positions[:, 0], minlength=size * size)
+        sum_y = np.bincount(flat, weights=positions[:, 1], minlength=size * size)
+
+        def interact(other_x: np.ndarray, other_y: np.ndarray, use: np.ndarray):
+            idx = np.flatnonzero(use)
+            cell = other_y[idx] * size + other_x[idx]
+            m, sx, sy = mass[cell], sum_x[cell], sum_y[cell]
+            keep = m > 0
+            idx, m, sx, sy = idx[keep], m[keep], sx[keep], sy[keep]
+            dx = positions[idx, 0] - sx / m
+            dy = positions[idx, 1] - sy / m
+            pull = strength * m / (dx * dx + dy * dy + 1e-12)
+            force[idx, 0] += pull * dx
+            force[idx, 1] += pull * dy
+
+        base_x, base_y = (cell_x >> 1) * 2 - 2, (cell_y >> 1) * 2 - 2
+        for offset_x in range(6):
+            other_x = base_x + offset_x
+            for offset_y in range(6):
+                other_y = base_y + offset_y
+                interact(other_x, other_y, (other_x >= 0) & (other_x < size) & (other_y >= 0) & (other_y < size)
+                         & ((np.abs(other_x - cell_x) > 1) | (np.abs(other_y - cell_y) > 1)))
+        if level == depth:
+            # Near field: exact point pairs with the neighbouring cells, its own included
+            order = np.argsort(flat, kind="stable")
+            cell_start = np.searchsorted(flat[order], np.arange(size * size))
+            for offset_x in (-1, 0, 1):
+                for offset_y in (-1, 0, 1):
+                    other_x, other_y = cell_x + offset_x, cell_y + offset_y
+                    idx = np.flatnonzero((other_x >= 0) & (other_x < size) & (other_y >= 0) & (other_y < size))
+                    cell = other_y[idx] * size + other_x[idx]
+                    counts = mass[cell].astype(np.int64)
+                    first = np.repeat(cell_start[cell] - (np.cumsum(counts) - counts), counts)
+                    i = np.repeat(idx, counts)
+                    j = order[first + np.arange(len(first))]
+                    i, j = i[i != j], j[i != j]
+                    dx = positions[i, 0] - positions[j, 0]
+                    dy = positions[i, 1] - positions[j, 1]
+                    pull = strength / (dx * dx + dy * dy + 1e-12)
+                    force[:, 0] += np.bincount(i, weights=pull * dx, minlength=len(positions))
+                    force[:, 1] += np.bincount(i, weights=pull * dy, minlength=len(positions))
+    return force
+
+
+def barnes_hut_layout(positions: np.ndarray, sources: np.ndarray, targets: np.ndarray, weights: np.ndarray,
+                      iterations: int = LAYOUT_ITERATIONS, step: float = 0.05) -> np.ndarray:
+    """
+    Refine 2D positions with Fruchterman-Reingold steps
+
+    Edges (sources[i], targets[i]) attract with ``weights[i] * |d|^2 / k``,
+    every pair repels with ``k^2 / |d|`` (approximated by _repulsion), and
+    moves are capped by a temperature that cools linearly to zero.
+    """
+    positions = positions.astype(np.float64).copy()
+    n = len(positions)
+    if n < 3:
+        return positions
+    depth = int(np.clip(np.ceil(np.log(n / 2) / np.log(4)), 2, 10))
+    for iteration in range(iterations):
+        span = max(float((positions.max(axis=0) - positions.min(axis=0)).max()), 1e-9)
+        spacing = span / np.sqrt(n)  # Ideal edge length
+        force = _repulsion(positions, spacing * spacing, depth)
+
+        delta = positions[targets] - positions[sources]
+        distance = np.sqrt((delta * delta).sum(axis=1))
+        pull = (weights * distance / spacing)[:, None] * delta
+        for axis in (0, 1):
+            force[:, axis] += (np.bincount(sources, weights=pull[:, axis], minlength=n)
+                               - np.bincount(targets, weights=pull[:, axis], minlength=n))
+
+        temperature = step * span * (1 - iteration / iterations)
+        length = np.sqrt((force * force).sum(axis=1)) + 1e-12
+        positions += force * (np.minimum(length, temperature) / length)[:, None]
+    return positions
+
+
+def layout_version(db: Session):
+    """End time of the last recorded layout pass of any worker; changes with every committed pass"""
+    return db.query(JobLease.last_finished_at).filter(JobLease.name == LAYOUT_LEASE).scalar()
+
+
+def layout_positions(db: Session, paper_ids: List[int]) -> Dict[int, Tuple[float, float]]:
+    """Stored (x, y) of the given papers; papers without a position are left out"""
+    positions = {}
+    for start in range(0, len(paper_ids), 1000):
+        for paper_id, x, y in db.query(PaperLayout.paper_id, PaperLayout.x, PaperLayout.y).filter(
+            PaperLayout.paper_id.in_(paper_ids[start:start + 1000])
+        ):
+            positions[paper_id] = (x, y)
+    return positions
+
+
+class MapLayout:
+    """Full layouts and incremental placement, persisted in paper_layout"""
+
+    QUERY_BLOCK = 256  # New papers placed per matrix product
+    INSERT_BATCH = 5000
+
+    def __init__(self, tfidf: IncrementalTfidf, semantic=None, neighbours: int = LAYOUT_NEIGHBOURS,
+                 rebuild_fraction: float = LAYOUT_REBUILD_FRACTION):
+        self.tfidf = tfidf
+        self.semantic = semantic  # SemanticSearchEngine whose embeddings are preferred, if available
+        self.neighbours = neighbours
+        self.rebuild_fraction = rebuild_fraction
+        self.tracker = CatalogueTracker()
+        self.ready = False
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.lease = WorkLease(LAYOUT_LEASE)
+
+    def refresh(self, bind):
+        """Fold catalogue changes in on a background thread, if due and not already running"""
+        if self.ready and not self.tracker.due():
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._background_update, args=(bind,), daemon=True)
+                self._thread.start()
+        finally:
+            self._lock.release()
+
+    def _background_update(self, bind):
+        with Session(bind=bind) as db:
+            self.update(db)
+
+    def update(self, db: Session, force: bool = False, rebuild: bool = False):
+        """Lay out or place papers until every paper in the catalogue has a position"""
+        with self._lock:
+            # Only one API worker writes paper_layout; the others catch up on a later refresh
+            if not self.lease.acquire(db):
+                return
+            state, known_ids = self.tracker.state(), set(self.tracker.known_ids)
+            started = time.perf_counter()
+            duration, error = None, None
+            try:
+                changes = self.tracker.changes(db, force=force or rebuild or not self.ready)
+                if not changes and self.ready and not rebuild:
+                    return
+                catalogue = self.tracker.known_ids
+                stored, placed = {}, 0
+                for paper_id, x, y, was_placed in db.query(
+                    PaperLayout.paper_id, PaperLayout.x, PaperLayout.y, PaperLayout.placed
+                ):
+                    stored[paper_id] = (x, y)
+                    placed += bool(was_placed)
+                missing = sorted(catalogue - stored.keys())
+                gone = sorted(stored.keys() - catalogue)
+
+                if rebuild or not stored or placed + len(missing) > self.rebuild_fraction * max(len(catalogue), 1):
+                    n = self._layout_all(db, sorted(catalogue))
+                    print(f"Laid out {n} papers in {time.perf_counter() - started:.1f}s")
+                elif missing or gone:
+                    for start in range(0, len(gone), 1000):
+                        db.query(PaperLayout).filter(
+                            PaperLayout.paper_id.in_(gone[start:start + 1000])
+                        ).delete(synchronize_session=False)
+                    for paper_id in gone:
+                        stored.pop(paper_id)
+                    n = self._place(db, missing, stored)
+                    print(f"Placed {n} new papers on the map ({len(gone)} removed) "
+                          f"in {time.perf_counter() - started:.1f}s")
+                db.commit()
+                self.ready = True
+                duration = time.perf_counter() - started
+            except Exception as e:
+                print(f"Error updating map layout: {e}")
+                db.rollback()
+                # Retry the same changes next time
+                self.tracker.restore(state, known_ids)
+                duration, error = time.perf_counter() - started, str(e) or type(e).__name__
+            finally:
+                # A recorded pass moves layout_version(), which readers in every worker watch
+                self.lease.release(db, duration, error)
+
+    def _features(self, db: Session, paper_ids: List[int]) -> Tuple[np.ndarray, object]:
+        """
+        (ids, matrix): L2-normalised vectors of the given papers
+
+        Sentence embeddings when every paper has one, otherwise TF-IDF rows;
+        papers with neither are dropped from ``ids``.
+        """
+        semantic = self.semantic
+        if semantic is not None and semantic.available:
+            semantic.sync(db)
+            store = semantic.store
+            if paper_ids and all(paper_id in store for paper_id in paper_ids):
+                return np.array(paper_ids, dtype=np.int64), normalize(store.vectors_for(paper_ids))
+        self.tfidf.sync(db, force=True)
+        vectors = self.tfidf.snapshot()
+        rows = [vectors.row_of.get(paper_id, -1) for paper_id in paper_ids]
+        found = [i for i, row in enumerate(rows) if 0 <= row < len(vectors) and vectors.alive[row]]
+        ids = np.array([paper_ids[i] for i in found], dtype=np.int64)
+        return ids, vectors.rows(np.array([rows[i] for i in found], dtype=np.int64))
+
+    def _write(self, db: Session, paper_ids: np.ndarray, positions: np.ndarray, placed: bool):
+        rows = [
+            {"paper_id": int(paper_id), "x": float(x), "y": float(y), "placed": placed}
+            for paper_id, (x, y) in zip(paper_ids.tolist(), positions.tolist())
+        ]
+        for start in range(0, len(rows), self.INSERT_BATCH):
+            db.execute(insert(PaperLayout), rows[start:start + self.INSERT_BATCH])
+
+    def _layout_all(self, db: Session, paper_ids: List[int]) -> int:
+        ids, matrix = self._features(db, paper_ids)
+        n = len(ids)
+        if n < 3:
+            positions = np.full((n, 2), 0.5)
+        else:
+            dims = min(LAYOUT_DIMS, matrix.shape[1] - 1, n - 1)
+            reduced = normalize(TruncatedSVD(n_components=dims, random_state=0).fit_transform(matrix))
+
+            # kNN graph in the reduced space, without self-matches
+            def exclude_self(scores: np.ndarray, start: int, stop: int):
+                own = np.arange(query_start, query_start + len(scores))
+                inside = (own >= start) & (own < stop)
+                scores[np.flatnonzero(inside), own[inside] - start] = -np.inf
+
+            k = min(self.neighbours, n - 1)
+            sources, targets, weights = [], [], []
+            for query_start in range(0, n, self.QUERY_BLOCK):
+                block = reduced[query_start:query_start + self.QUERY_BLOCK]
+                rows, scores = blocked_top_k(block, reduced, k, adjust=exclude_self)
+                sources.append(np.repeat(np.arange(query_start, query_start + len(block)), k))
+                targets.append(rows.ravel())
+                weights.append(np.maximum(scores.ravel(), 0.0))
+
+            if UMAP_AVAILABLE:
+                start = umap.UMAP(n_components=2, n_neighbors=max(k, 2), metric="cosine",
+                                  random_state=0).fit_transform(reduced)
+            else:
+                start = PCA(n_components=2, random_state=0).fit_transform(reduced)
+            # Break ties between identical papers
+            start = unit_square(start) + np.random.default_rng(0).normal(scale=1e-4, size=(n, 2))
+            positions = unit_square(barnes_hut_layout(
+                start, np.concatenate(sources), np.concatenate(targets), np.concatenate(weights)
+            ))
+
+        # The computation can outlast the lease; make sure no other worker took over before rewriting
+        self.lease.renew(db)
+        db.query(PaperLayout).delete(synchronize_session=False)
+        self._write(db, ids, positions, placed=False)
+        return n
+
+    def _place(self, db: Session, missing: List[int], stored: Dict[int, Tuple[float, float]]) -> int:
+        """Position new papers at the weighted centre of their most similar placed papers"""
+        if not missing:
+            return 0
+        placed_ids = sorted(stored)
+        ids, matrix = self._features(db, placed_ids + missing)
+        is_new = np.isin(ids, missing)
+        old_rows, new_rows = np.flatnonzero(~is_new), np.flatnonzero(is_new)
+        if not len(new_rows):
+            return 0
+        old_matrix = matrix[old_rows]
+        old_positions = np.array([stored[paper_id] for paper_id in ids[old_rows].tolist()]).reshape(-1, 2)
+        k = min(self.neighbours, len(old_rows))
+
+        positions = np.full((len(new_rows), 2), 0.5)
+        for start in range(0, len(new_rows), self.QUERY_BLOCK):
+            block = new_rows[start:start + self.QUERY_BLOCK]
+            if k:
+                rows, scores = blocked_top_k(matrix[block], old_matrix, k)
+                weights = np.maximum(scores, 0.0)
+                total = weights.sum(axis=1)
+                anchored = total > 0
+                centre = (weights[:, :, None] * old_positions[rows]).sum(axis=1) / np.where(total, total, 1)[:, None]
+                positions[start:start + len(block)][anchored] = centre[anchored]
+
+        # Small deterministic offset so papers with the same neighbours do not stack
+        spread = 0.5 / np.sqrt(len(ids))
+        for i, paper_id in enumerate(ids[new_rows].tolist()):
+            angle = zlib.crc32(str(paper_id).encode()) / 2**32 * 2 * np.pi
+            positions[i] += spread * np.array([np.cos(angle), np.sin(angle)])
+        self._write(db, ids[new_rows], np.clip(positions, 0.0, 1.0), placed=True)
+        return len(new_rows)
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, engine as db_engine
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rebuild", action="store_true", help="recompute every position")
+    args = parser.parse_args()
+
+    # The job may run before the API has created its tables
+    PaperLayout.__table__.create(bind=db_engine, checkfirst=True)
+    JobLease.__table__.create(bind=db_engine, checkfirst=True)
+    layout = MapLayout(IncrementalTfidf())
+    with SessionLocal() as session:
+        layout.update(session, force=True, rebuild=args.rebuild)
@@ -0,0 +1,76 @@
+"""
+Database migration script for v5 features:
+- Normalised identity keys on papers (title_key, doi_key, arxiv_id) for bulk de-duplication
+
+Existing rows are backfilled when the columns are added; migrate_v6.py
+then makes the DOI and arXiv id keys unique.
+"""
+
+from sqlalchemy import text
+from database import engine
+from paper_identity import identity_keys
+
+BACKFILL_BATCH = 5000
+
+
+def backfill_identity_keys(conn):
+    """Compute the keys of papers that have none yet"""
+    last_id, updated = 0, 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, title, doi, url FROM papers WHERE id > :last_id AND title_key IS NULL "
+            "ORDER BY id LIMIT :batch"
+        ), {"last_id": last_id, "batch": BACKFILL_BATCH}).all()
+        if not rows:
+            break
+        params = [{"paper_id": paper_id, **identity_keys(title, doi, url)} for paper_id, title, doi, url in rows]
+        conn.execute(text(
+            "UPDATE papers SET title_key = :title_key, doi_key = :doi_key, arxiv_id = :arxiv_id WHERE id = :paper_id"
+        ), params)
+        conn.commit()
+        updated += len(rows)
+        last_id = rows[-1][0]
+    if updated:
+        print(f"Backfilled identity keys of {updated} papers")
+
+
+def migrate_v5():
+    """Add identity key columns and their indexes to papers"""
+    migrations = [
+        "ALTER TABLE papers ADD COLUMN title_key VARCHAR",
+        "ALTER TABLE papers ADD COLUMN doi_key VARCHAR",
+        "ALTER TABLE papers ADD COLUMN arxiv_id VARCHAR",
+    ]
+    # Same names as Base.metadata.create_all gives them
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS ix_papers_title_key ON papers (title_key)",
+        "CREATE INDEX IF NOT EXISTS ix_papers_doi_key ON papers (doi_key)",
+        "CREATE INDEX IF NOT EXISTS ix_papers_arxiv_id ON papers (arxiv_id)",
+    ]
+
+    with engine.connect() as conn:
+        added = False
+        for migration in migrations:
+            try:
+                conn.execute(text(migration))
+                conn.commit()
+                added = True
+                print(f"Success: {migration[:50]}...")
+            except Exception as e:
+                conn.rollback()
+                if "duplicate column" in str(e).lower() or "already exists" in str(e).lower():
+                    print(f"Skipped (already exists): {migration[:50]}...")
+                else:
+                    print(f"Error: {e}")
+
+        if added:
+            backfill_identity_keys(conn)
+
+        for index in indexes:
+            conn.execute(text(index))
+            conn.commit()
+            print(f"Success: {index[:50]}...")
+
+
+if __name__ == "__main__":
+    migrate_v5()
@@ -0,0 +1,66 @@
+"""
+Database migration script for v6 features:
+- title_key is no longer unique: distinct works share titles ("Editorial")
+- doi_key and arxiv_id get partial unique indexes, which ingest.py's
+  INSERT ... ON CONFLICT DO NOTHING relies on
+
+Papers that lost their title_key to an older paper with the same title
+(migrate_v5.py) get it back. Where several papers hold the same DOI or
+arXiv key only the oldest keeps it; near_duplicates.py can merge the rest.
+"""
+
+from sqlalchemy import inspect, text
+from database import engine
+from paper_identity import title_key
+
+BACKFILL_BATCH = 5000
+
+
+def backfill_title_keys(conn):
+    """Set the title_key of titled papers that have none"""
+    last_id, updated = 0, 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, title FROM papers WHERE id > :last_id AND title_key IS NULL AND title IS NOT NULL "
+            "ORDER BY id LIMIT :batch"
+        ), {"last_id": last_id, "batch": BACKFILL_BATCH}).all()
+        if not rows:
+            break
+        conn.execute(text("UPDATE papers SET title_key = :title_key WHERE id = :paper_id"),
+                     [{"paper_id": paper_id, "title_key": title_key(title)} for paper_id, title in rows])
+        conn.commit()
+        updated += len(rows)
+        last_id = rows[-1][0]
+    if updated:
+        print(f"Backfilled title keys of {updated} papers")
+
+
+def migrate_v6():
+    """Move the uniqueness of papers from title_key to doi_key and arxiv_id"""
+    with engine.connect() as conn:
+        indexes = {index["name"]: index for index in inspect(conn).get_indexes("papers")}
+
+        if indexes.get("ix_papers_title_key", {}).get("unique"):
+            conn.execute(text("DROP INDEX ix_papers_title_key"))
+            conn.execute(text("CREATE INDEX ix_papers_title_key ON papers (title_key)"))
+            conn.commit()
+            print("Success: ix_papers_title_key is no longer unique")
+            backfill_title_keys(conn)
+
+        for column in ("doi_key", "arxiv_id"):
+            name = f"ix_papers_{column}"
+            if indexes.get(name, {}).get("unique"):
+                print(f"Skipped (already exists): unique {name}")
+                continue
+            cleared = conn.execute(text(
+                f"UPDATE papers SET {column} = NULL WHERE {column} IS NOT NULL AND id NOT IN "
+                f"(SELECT MIN(id) FROM papers WHERE {column} IS NOT NULL GROUP BY {column})"
+            )).rowcount
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+            conn.execute(text(f"CREATE UNIQUE INDEX {name} ON papers ({column}) WHERE {column} IS NOT NULL"))
+            conn.commit()
+            print(f"Success: unique {name} ({cleared} papers shared their {column} with an older paper)")
+
+
+if __name__ == "__main__":
+    migrate_v6()
@@ -1,8 +1,10 @@
-from sqlalchemy import Column, Integer, String, Text, Float, DateTime, ForeignKey, Enum, Boolean, Table
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Float, DateTime, ForeignKey, Enum, Boolean, Table, UniqueConstraint, LargeBinary
+from sqlalchemy import Index, event, inspect, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
 from database import Base
+from paper_identity import identity_keys
 
 # Association table for many-to-many relationship between papers and reading lists
 reading_list_papers = Table(
@@ -57,12 +59,49 @@ class Paper(Base):
     smart_tags = Column(String)  # Auto-generated tags
     domains = Column(String)  # Research domains
     citation_count = Column(Integer, default=0)
+    # Normalised identity keys (paper_identity.py) for de-duplicating imports;
+    # titles repeat across works, DOIs and arXiv ids do not (see __table_args__)
+    title_key = Column(String, index=True)
+    doi_key = Column(String)
+    arxiv_id = Column(String)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     interactions = relationship("UserPaperInteraction", back_populates="paper")
     reading_lists = relationship("ReadingList", secondary=reading_list_papers, back_populates="papers")
 
+    __table_args__ = tuple(
+        Index(f"ix_papers_{column}", column, unique=True,
+              sqlite_where=text(f"{column} IS NOT NULL"), postgresql_where=text(f"{column} IS NOT NULL"))
+        for column in ("doi_key", "arxiv_id")
+    )
+
+@event.listens_for(Paper, "before_insert")
+def _set_identity_keys(mapper, connection, paper):
+    """Set the identity keys from title, DOI and URL on ORM inserts"""
+    for column, value in identity_keys(paper.title, paper.doi, paper.url).items():
+        setattr(paper, column, value)
+
+@event.listens_for(Paper, "before_update")
+def _update_identity_keys(mapper, connection, paper):
+    """
+    Recompute the identity keys whose source changed on ORM updates
+
+    A DOI or arXiv id another paper already holds fails the flush with an
+    IntegrityError (unique indexes), which callers report as a conflict.
+    """
+    state = inspect(paper)
+    changed = {field for field in ("title", "doi", "url") if state.attrs[field].history.has_changes()}
+    if not changed:
+        return
+    keys = identity_keys(paper.title, paper.doi, paper.url)
+    if "title" in changed:
+        paper.title_key = keys["title_key"]
+    if changed & {"doi"}:
+        paper.doi_key = keys["doi_key"]
+    if changed & {"doi", "url"}:
+        paper.arxiv_id = keys["arxiv_id"]
+
 class User(Base):
     __tablename__ = "users"
 
@@ -127,3 +166,119 @@ class ReadingList(Base):
     
     user = relationship("User", back_populates="reading_lists")
     papers = relationship("Paper", secondary=reading_list_papers, back_populates="reading_lists")
+
+
+class PrecomputedRecommendation(Base):
+    """Top-N recommendations per user, written by precompute_recommendations.py"""
+    __tablename__ = "precomputed_recommendations"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    paper_id = Column(Integer, ForeignKey("papers.id"), nullable=False)
+    rank = Column(Integer, nullable=False)  # 0 = best
+    score = Column(Float, nullable=False)
+    reason = Column(String)
+    computed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class PaperNeighbor(Base):
+    """Precomputed most similar papers per paper, maintained by similarity_graph.py"""
+    __tablename__ = "paper_neighbors"
+    
+    paper_id = Column(Integer, primary_key=True)
+    rank = Column(Integer, primary_key=True)  # 0 = most similar
+    neighbor_id = Column(Integer, nullable=False, index=True)
+    score = Column(Float, nullable=False)
+
+
+# Same columns; similarity_graph.py writes a full rebuild here, then swaps it in
+paper_neighbors_staging = Table(
+    "paper_neighbors_staging",
+    Base.metadata,
+    Column("paper_id", Integer, primary_key=True),
+    Column("rank", Integer, primary_key=True),
+    Column("neighbor_id", Integer, nullable=False),
+    Column("score", Float, nullable=False),
+)
+
+
+class PaperLayout(Base):
+    """Precomputed 2D map position of each paper (unit square), maintained by map_layout.py"""
+    __tablename__ = "paper_layout"
+    
+    paper_id = Column(Integer, primary_key=True)
+    x = Column(Float, nullable=False)
+    y = Column(Float, nullable=False)
+    placed = Column(Boolean, default=False)  # Placed next to its neighbours rather than by the full layout
+
+
+class PaperSignature(Base):
+    """MinHash signature of a paper's title and abstract, maintained by near_duplicates.py"""
+    __tablename__ = "paper_signatures"
+    
+    paper_id = Column(Integer, primary_key=True)
+    minhash = Column(LargeBinary, nullable=False)  # uint32 per permutation
+
+
+class PaperLshBucket(Base):
+    """LSH band buckets of the MinHash signatures; papers sharing a bucket are near-duplicate candidates"""
+    __tablename__ = "paper_lsh_buckets"
+    
+    bucket = Column(BigInteger, primary_key=True)  # Hash of one band of the signature
+    paper_id = Column(Integer, primary_key=True, index=True)
+
+
+class HarvestCursor(Base):
+    """Resume point of a bulk harvest (one per source and query), maintained by harvester.py"""
+    __tablename__ = "harvest_cursors"
+    __table_args__ = (UniqueConstraint("source", "query", name="uq_harvest_source_query"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String, nullable=False)  # "arxiv" or "pubmed"
+    query = Column(String, nullable=False)
+    position = Column(Integer, default=0)  # Offset of the next page to fetch
+    total = Column(Integer)  # Result count reported by the source, once known
+    web_env = Column(String)  # PubMed history server session
+    query_key = Column(String)
+    fetched = Column(Integer, default=0)  # Papers fetched so far
+    saved = Column(Integer, default=0)  # Of which were new
+    status = Column(String, default="pending")  # pending, running, done, failed
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+
+class ImportCheckpoint(Base):
+    """Resume point of a bulk import of a local metadata dump (one per file), maintained by import_dump.py"""
+    __tablename__ = "import_checkpoints"
+
+    id = Column(Integer, primary_key=True, index=True)
+    path = Column(String, unique=True, nullable=False)
+    format = Column(String, nullable=False)  # "arxiv-jsonl" or "oai-pmh"
+    file_size = Column(BigInteger)  # Size and mtime when the import started; a changed file starts over
+    file_mtime = Column(Float)
+    records = Column(Integer, default=0)  # Records read and saved so far
+    offset = Column(BigInteger)  # Byte offset of the next record (JSON lines only)
+    saved = Column(Integer, default=0)  # Of which were new papers
+    status = Column(String, default="pending")  # pending, running, done, failed
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+
+class JobLease(Base):
+    """Schedule, lease and last run of a background job, maintained by scheduler.py"""
+    __tablename__ = "job_leases"
+
+    name = Column(String, primary_key=True)  # e.g. "fetch:arxiv:cs.LG"
+    next_run_at = Column(DateTime(timezone=True))
+    holder = Column(String)  # Worker running the job, while leased
+    lease_expires_at = Column(DateTime(timezone=True))  # Another worker may take over after this
+    last_started_at = Column(DateTime(timezone=True))
+    last_finished_at = Column(DateTime(timezone=True))
+    last_duration_seconds = Column(Float)
+    last_status = Column(String)  # done, failed
+    last_error = Column(Text)
+    last_papers = Column(Integer)  # Papers ingested by the last run
+    papers_total = Column(Integer, default=0)
+    runs = Column(Integer, default=0)
@@ -0,0 +1,422 @@
+"""
+Near-duplicate papers: MinHash signatures with an LSH bucket index
+
+The same work often arrives twice with small differences (an arXiv
+preprint and its PubMed record, a BibTeX entry with a reworded title),
+which the exact identity keys in ingest.py miss. Each paper gets a MinHash
+signature over word shingles of its normalised title and abstract; the
+share of equal values in two signatures estimates the Jaccard similarity
+of their shingle sets. Signatures are cut into LSH_BANDS bands and each
+band is hashed to a bucket in paper_lsh_buckets, so the candidates for a
+paper are the papers sharing one of its bucket keys, found with an
+indexed lookup rather than a scan of the catalogue. A candidate is a
+near-duplicate when the estimated similarity reaches
+NEAR_DUPLICATE_THRESHOLD.
+
+ingest.py checks incoming papers against the index before inserting them
+and indexes the papers it inserts. The batch job below signs papers that
+have no signature yet (older rows, papers created through the API),
+clusters the duplicates already stored and merges every cluster into its
+oldest paper, moving user interactions and reading-list memberships over.
+
+Usage:
+    python near_duplicates.py              # index, then merge duplicates
+    python near_duplicates.py --dry-run    # only report the clusters
+    python near_duplicates.py --reindex    # re-sign every paper first (after changing the parameters)
+"""
+import argparse
+import hashlib
+import os
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import delete, func, insert, or_, select
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, engine as db_engine
+from models import (
+    InteractionStatus, Paper, PaperLayout, PaperLshBucket, PaperNeighbor, PaperSignature,
+    PrecomputedRecommendation, UserPaperInteraction, reading_list_papers
+)
+from paper_identity import STRONG_KEYS, conflicting, title_key
+import paper_catalogue
+
+MINHASH_PERMUTATIONS = int(os.getenv("MINHASH_PERMUTATIONS", "128"))
+# Bands x rows = permutations; 16 bands of 8 rows find pairs at 0.8 similarity ~95% of the time
+LSH_BANDS = int(os.getenv("LSH_BANDS", "16"))
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+SHINGLE_WORDS = 3
+# Texts with fewer shingles (e.g. a title without abstract) are not signed
+MIN_SHINGLES = 10
+# Buckets shared by more papers than this hold boilerplate text; the merge job skips them
+MAX_BUCKET_SIZE = int(os.getenv("LSH_MAX_BUCKET_SIZE", "100"))
+
+KEY_BATCH = 2000  # Ids or bucket keys per IN (...) clause
+
+# Paper fields a merged duplicate fills in on the paper it is merged into
+FILL_FIELDS = ("abstract", "url", "doi", "venue", "year", "keywords", "smart_tags", "domains")
+INTERACTION_FIELDS = ("rating", "notes", "what_is_about", "is_relevant", "where_can_use")
+STATUS_ORDER = {status: rank for rank, status in enumerate(InteractionStatus)}
+SHINGLE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _batches(values: Sequence, size: int = KEY_BATCH) -> Iterable[Sequence]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _hash_parameter(name: str, i: int) -> int:
+    """Fixed pseudo-random 64-bit coefficient, the same in every process and release"""
+    return int.from_bytes(hashlib.blake2b(f"{name}{i}".encode(), digest_size=8).digest(), "big")
+
+
+def delete_derived_rows(db: Session, paper_ids: Sequence[int]):
+    """Drop the rows derived from papers about to be deleted; does not commit"""
+    for chunk in _batches(list(paper_ids)):
+        db.execute(delete(PrecomputedRecommendation).where(PrecomputedRecommendation.paper_id.in_(chunk)))
+        db.execute(delete(PaperNeighbor).where(
+            or_(PaperNeighbor.paper_id.in_(chunk), PaperNeighbor.neighbor_id.in_(chunk))
+        ))
+        db.execute(delete(PaperLayout).where(PaperLayout.paper_id.in_(chunk)))
+        db.execute(delete(PaperLshBucket).where(PaperLshBucket.paper_id.in_(chunk)))
+        db.execute(delete(PaperSignature).where(PaperSignature.paper_id.in_(chunk)))
+
+
+class NearDuplicateIndex:
+    """MinHash signatures and LSH buckets of the papers, stored in the database"""
+
+    def __init__(self, permutations: int = MINHASH_PERMUTATIONS, bands: int = LSH_BANDS,
+                 threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        if permutations % bands:
+            raise ValueError("MINHASH_PERMUTATIONS must be a multiple of LSH_BANDS")
+        self.permutations = permutations
+        self.bands = bands
+        self.rows = permutations // bands
+        self.threshold = threshold
+        # Multiply-shift hash family h_i(x) = ((a_i * x + b_i) mod 2^64) >> 32, a_i odd
+        self.a = np.array([_hash_parameter("a", i) | 1 for i in range(permutations)], dtype=np.uint64)[:, None]
+        self.b = np.array([_hash_parameter("b", i) for i in range(permutations)], dtype=np.uint64)[:, None]
+        self._shift = np.uint64(32)
+        self._tables_ready = False
+
+    def ensure_tables(self, bind):
+        if not self._tables_ready:
+            PaperSignature.__table__.create(bind=bind, checkfirst=True)
+            PaperLshBucket.__table__.create(bind=bind, checkfirst=True)
+            self._tables_ready = True
+
+    # --- signatures ---------------------------------------------------------
+
+    def signature(self, title: Optional[str], abstract: Optional[str]) -> Optional[np.ndarray]:
+        """MinHash of the word shingles of title and abstract; None for too short a text"""
+        words = (title_key(f"{title or ''} {abstract or ''}") or "").split()
+        if len(words) < SHINGLE_WORDS:
+            return None
+        # Shingle hashes combined from per-word hashes rather than joined strings
+        word_hashes = np.fromiter((zlib.crc32(w.encode()) for w in words), dtype=np.uint64, count=len(words))
+        count = len(words) - SHINGLE_WORDS + 1
+        combined = np.zeros(count, dtype=np.uint64)
+        for offset in range(SHINGLE_WORDS):
+            combined = combined * SHINGLE_MULTIPLIER + word_hashes[offset:offset + count]
+        hashes = np.unique((combined >> self._shift) ^ (combined & np.uint64(0xFFFFFFFF)))
+        if len(hashes) < MIN_SHINGLES:
+            return None
+        return ((self.a * hashes[None, :] + self.b) >> self._shift).min(axis=1).astype(np.uint32)
+
+    def bucket_keys(self, signature: np.ndarray) -> List[int]:
+        """One signed 64-bit key per band"""
+        keys = []
+        for band in range(self.bands):
+            data = bytes([self.bands, self.rows, band]) + signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            keys.append(int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big", signed=True))
+        return keys
+
+    @staticmethod
+    def similarity(a: np.ndarray, b: np.ndarray) -> float:
+        """Estimated Jaccard similarity of two signatures"""
+        return float(np.mean(a == b))
+
+    def load(self, db: Session, paper_ids: Iterable[int]) -> Dict[int, np.ndarray]:
+        """Stored signatures of existing papers"""
+        signatures = {}
+        for chunk in _batches(sorted(set(paper_ids))):
+            for paper_id, minhash in db.query(PaperSignature.paper_id, PaperSignature.minhash).join(
+                Paper, Paper.id == PaperSignature.paper_id
+            ).filter(PaperSignature.paper_id.in_(chunk)):
+                if len(minhash) == 4 * self.permutations:
+                    signatures[paper_id] = np.frombuffer(minhash, dtype=np.uint32)
+        return signatures
+
+    # --- index maintenance ---------------------------------------------------
+
+    def add(self, db: Session, paper_ids: Sequence[int], signatures: Sequence[Optional[np.ndarray]]):
+        """Store (or replace) the signatures and buckets of papers; does not commit"""
+        self.ensure_tables(db.get_bind())
+        self.remove(db, paper_ids)
+        if not paper_ids:
+            return
+        # Papers too short to sign get an empty signature, so the job does not retry them
+        db.execute(insert(PaperSignature), [
+            {"paper_id": paper_id, "minhash": signature.tobytes() if signature is not None else b""}
+            for paper_id, signature in zip(paper_ids, signatures)
+        ])
+        buckets = [
+            {"bucket": key, "paper_id": paper_id}
+            for paper_id, signature in zip(paper_ids, signatures) if signature is not None
+            for key in set(self.bucket_keys(signature))
+        ]
+        if buckets:
+            db.execute(insert(PaperLshBucket), buckets)
+
+    def remove(self, db: Session, paper_ids: Sequence[int]):
+        for chunk in _batches(list(paper_ids)):
+            db.execute(delete(PaperLshBucket).where(PaperLshBucket.paper_id.in_(chunk)))
+            db.execute(delete(PaperSignature).where(PaperSignature.paper_id.in_(chunk)))
+
+    def index_missing(self, db: Session, batch: int = KEY_BATCH, reindex: bool = False) -> int:
+        """Sign the papers that have no signature yet (all papers with ``reindex``)"""
+        self.ensure_tables(db.get_bind())
+        if reindex:
+            db.execute(delete(PaperLshBucket))
+            db.execute(delete(PaperSignature))
+            db.commit()
+        last_id, signed = 0, 0
+        while True:
+            rows = db.query(Paper.id, Paper.title, Paper.abstract).outerjoin(
+                PaperSignature, PaperSignature.paper_id == Paper.id
+            ).filter(PaperSignature.paper_id.is_(None), Paper.id > last_id).order_by(Paper.id).limit(batch).all()
+            if not rows:
+                return signed
+            self.add(db, [row.id for row in rows], [self.signature(row.title, row.abstract) for row in rows])
+            db.commit()
+            signed += len(rows)
+            last_id = rows[-1].id
+
+    def remove_orphans(self, db: Session):
+        """Drop signatures and buckets of deleted papers"""
+        existing = select(Paper.id)
+        db.execute(delete(PaperLshBucket).where(PaperLshBucket.paper_id.not_in(existing)))
+        db.execute(delete(PaperSignature).where(PaperSignature.paper_id.not_in(existing)))
+        db.commit()
+
+    # --- lookups --------------------------------------------------------------
+
+    def _bucket_members(self, db: Session, keys: Iterable[int]) -> Dict[int, List[int]]:
+        members: Dict[int, List[int]] = {}
+        for chunk in _batches(sorted(set(keys))):
+            for bucket, paper_id in db.query(PaperLshBucket.bucket, PaperLshBucket.paper_id).filter(
+                PaperLshBucket.bucket.in_(chunk)
+            ):
+                members.setdefault(bucket, []).append(paper_id)
+        return members
+
+    def _strong_keys(self, db: Session, paper_ids: Iterable[int]) -> Dict[int, Dict]:
+        """DOI and arXiv id keys of stored papers"""
+        found = {}
+        for chunk in _batches(sorted(set(paper_ids))):
+            for row in db.query(Paper.id, *(getattr(Paper, c) for c in STRONG_KEYS)).filter(Paper.id.in_(chunk)):
+                found[row.id] = {column: getattr(row, column) for column in STRONG_KEYS}
+        return found
+
+    def match(self, db: Session, signatures: Sequence[Optional[np.ndarray]],
+              identities: Optional[Sequence[Dict]] = None) -> Tuple[List[Optional[int]], List[int]]:
+        """
+        Near-duplicates of a batch of incoming papers
+
+        Returns, per signature, the id of the most similar stored paper at or
+        above the threshold (else None), and the index of the first earlier
+        signature in the batch it duplicates (else its own index). With the
+        identity keys of the papers, papers whose DOIs or arXiv ids conflict
+        are never near-duplicates.
+        """
+        self.ensure_tables(db.get_bind())
+        identities = identities if identities is not None else [{}] * len(signatures)
+        keys = [self.bucket_keys(s) if s is not None else [] for s in signatures]
+        members = self._bucket_members(db, (key for row_keys in keys for key in row_keys))
+        candidates = [sorted({pid for key in row_keys for pid in members.get(key, ())}) for row_keys in keys]
+        stored = self.load(db, (pid for row in candidates for pid in row))
+        stored_keys = self._strong_keys(db, stored) if any(identities) else {}
+
+        matches: List[Optional[int]] = [None] * len(signatures)
+        first = list(range(len(signatures)))
+        seen: Dict[int, int] = {}  # Bucket key -> first batch index in it
+        group_keys: Dict[int, Dict] = {}  # First batch index -> DOI and arXiv id of its group
+        for i, signature in enumerate(signatures):
+            if signature is None:
+                continue
+            best = 0.0
+            for paper_id in candidates[i]:  # Ascending, so ties go to the oldest paper
+                other = stored.get(paper_id)
+                if other is None or conflicting(identities[i], stored_keys.get(paper_id, {})):
+                    continue
+                score = self.similarity(signature, other)
+                if score >= self.threshold and score > best:
+                    matches[i], best = paper_id, score
+            if matches[i] is not None:
+                continue
+            for key in keys[i]:
+                j = seen.get(key)
+                if (j is not None and not conflicting(identities[i], group_keys[j])
+                        and self.similarity(signature, signatures[j]) >= self.threshold):
+                    first[i] = j
+                    break
+            if first[i] == i:
+                group_keys[i] = {}
+                for key in keys[i]:
+                    seen.setdefault(key, i)
+            for column in STRONG_KEYS:
+                if identities[i].get(column):
+                    group_keys[first[i]].setdefault(column, identities[i][column])
+        return matches, first
+
+    def clusters(self, db: Session, max_bucket: int = MAX_BUCKET_SIZE) -> List[List[int]]:
+        """
+        Groups of stored papers that are near-duplicates of each other, each sorted by id
+
+        A group never holds two different DOIs or two different arXiv ids.
+        """
+        shared = select(PaperLshBucket.bucket).group_by(PaperLshBucket.bucket).having(
+            func.count() > 1, func.count() <= max_bucket
+        )
+        pairs = set()
+        bucket, group = None, []
+        rows = db.query(PaperLshBucket.bucket, PaperLshBucket.paper_id).filter(
+            PaperLshBucket.bucket.in_(shared)
+        ).order_by(PaperLshBucket.bucket, PaperLshBucket.paper_id).yield_per(10000)
+        for key, paper_id in rows:
+            if key != bucket:
+                pairs.update((a, b) for n, a in enumerate(group) for b in group[n + 1:])
+                bucket, group = key, []
+            group.append(paper_id)
+        pairs.update((a, b) for n, a in enumerate(group) for b in group[n + 1:])
+
+        signatures = self.load(db, (pid for pair in pairs for pid in pair))
+        group_keys = self._strong_keys(db, signatures)  # Per root, the keys of its whole group
+        parent: Dict[int, int] = {}
+
+        def root(x: int) -> int:
+            while parent.get(x, x) != x:
+                parent[x] = parent.get(parent[x], parent[x])
+                x = parent[x]
+            return x
+
+        for a, b in sorted(pairs):
+            if a in signatures and b in signatures and self.similarity(signatures[a], signatures[b]) >= self.threshold:
+                ra, rb = root(a), root(b)
+                if ra == rb or conflicting(group_keys.get(ra, {}), group_keys.get(rb, {})):
+                    continue
+                low, high = min(ra, rb), max(ra, rb)
+                parent[high] = low
+                merged = group_keys.setdefault(low, {})
+                for column, value in group_keys.get(high, {}).items():
+                    if value and not merged.get(column):
+                        merged[column] = value
+        groups: Dict[int, List[int]] = {}
+        for paper_id in parent:
+            groups.setdefault(root(paper_id), []).append(paper_id)
+        return sorted(sorted(set(group) | {key}) for key, group in groups.items())
+
+    # --- merging --------------------------------------------------------------
+
+    def merge(self, db: Session, canonical_id: int, duplicate_ids: Sequence[int]) -> Dict:
+        """
+        Merge duplicate papers into one; does not commit
+
+        The canonical paper takes over missing metadata, user interactions
+        (folded into the user's own interaction with it when there is one)
+        and reading-list memberships. Derived rows of the duplicates
+        (neighbours, layout, precomputed recommendations, signatures) are
+        dropped, then the duplicates are deleted. The metadata is copied
+        last, once no duplicate holds the DOI or arXiv id it may bring.
+        """
+        ids = [pid for pid in duplicate_ids if pid != canonical_id]
+        canonical = db.get(Paper, canonical_id)
+        duplicates = db.query(Paper).filter(Paper.id.in_(ids)).order_by(Paper.id).all()
+        if canonical is None or not duplicates:
+            return {"merged": 0, "interactions_moved": 0, "interactions_folded": 0, "list_entries_moved": 0}
+        fills = {}
+        for duplicate in duplicates:
+            for field in FILL_FIELDS:
+                if not getattr(canonical, field) and field not in fills and getattr(duplicate, field):
+                    fills[field] = getattr(duplicate, field)
+        citation_count = max([canonical.citation_count or 0] + [d.citation_count or 0 for d in duplicates])
+
+        # User interactions: one per user and paper
+        kept = {i.user_id: i for i in db.query(UserPaperInteraction).filter(UserPaperInteraction.paper_id == canonical_id)}
+        moved = folded = 0
+        for interaction in db.query(UserPaperInteraction).filter(
+            UserPaperInteraction.paper_id.in_(ids)
+        ).order_by(UserPaperInteraction.id):
+            existing = kept.get(interaction.user_id)
+            if existing is None:
+                interaction.paper_id = canonical_id
+                kept[interaction.user_id] = interaction
+                moved += 1
+                continue
+            for field in INTERACTION_FIELDS:
+                if getattr(existing, field) is None and getattr(interaction, field) is not None:
+                    setattr(existing, field, getattr(interaction, field))
+            if STATUS_ORDER.get(interaction.status, -1) > STATUS_ORDER.get(existing.status, -1):
+                existing.status = interaction.status  # Keep the furthest reading progress
+            db.delete(interaction)
+            folded += 1
+        db.flush()
+
+        # Reading lists
+        table = reading_list_papers
+        lists = {lid for (lid,) in db.execute(select(table.c.reading_list_id).where(table.c.paper_id.in_(ids)))}
+        present = {lid for (lid,) in db.execute(select(table.c.reading_list_id).where(table.c.paper_id == canonical_id))}
+        added = sorted(lists - present)
+        if added:
+            db.execute(insert(table), [{"reading_list_id": lid, "paper_id": canonical_id} for lid in added])
+        db.execute(delete(table).where(table.c.paper_id.in_(ids)))
+
+        # Derived rows; the indexes rebuild them for the canonical paper
+        delete_derived_rows(db, ids)
+        db.execute(delete(Paper).where(Paper.id.in_(ids)))
+        for duplicate in duplicates:
+            db.expunge(duplicate)
+        for field, value in fills.items():
+            setattr(canonical, field, value)
+        canonical.citation_count = citation_count
+        return {"merged": len(duplicates), "interactions_moved": moved, "interactions_folded": folded,
+                "list_entries_moved": len(added)}
+
+    def merge_duplicates(self, db: Session, dry_run: bool = False, reindex: bool = False) -> Dict:
+        """Batch job: sign new papers, cluster stored duplicates and merge each cluster into its oldest paper"""
+        started = time.perf_counter()
+        signed = self.index_missing(db, reindex=reindex)
+        self.remove_orphans(db)
+        clusters = self.clusters(db)
+        totals = {"signed": signed, "clusters": len(clusters), "merged": 0, "interactions_moved": 0,
+                  "interactions_folded": 0, "list_entries_moved": 0}
+        for cluster in clusters:
+            titles = dict(db.query(Paper.id, Paper.title).filter(Paper.id.in_(cluster)))
+            print(f"[NearDuplicates] {cluster[0]} <- {cluster[1:]}: {titles.get(cluster[0], '')[:60]!r}")
+            if dry_run:
+                continue
+            for field, count in self.merge(db, cluster[0], cluster[1:]).items():
+                totals[field] += count
+            db.commit()
+        if totals["merged"]:
+            paper_catalogue.touch()
+        print(f"[NearDuplicates] Signed {signed} papers, {len(clusters)} duplicate clusters, "
+              f"merged {totals['merged']} papers in {time.perf_counter() - started:.1f}s")
+        return totals
+
+
+# Global instance
+near_duplicate_index = NearDuplicateIndex()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="report the clusters without merging")
+    parser.add_argument("--reindex", action="store_true", help="re-sign every paper first")
+    args = parser.parse_args()
+
+    near_duplicate_index.ensure_tables(db_engine)
+    with SessionLocal() as session:
+        near_duplicate_index.merge_duplicates(session, dry_run=args.dry_run, reindex=args.reindex)
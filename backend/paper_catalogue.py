@@ -0,0 +1,144 @@
+"""
+Change tracking for the papers table, shared by the search and recommendation indexes
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import Paper
+
+# How often (seconds) a tracker re-checks the table when nothing in this
+# process has reported a write
+SYNC_INTERVAL = float(os.getenv("CATALOGUE_SYNC_INTERVAL", "5"))
+
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def touch():
+    """Signal that papers were inserted, updated or deleted in this process"""
+    global _generation
+    with _generation_lock:
+        _generation += 1
+
+
+def current_generation() -> int:
+    """Number of writes reported through touch() since startup"""
+    return _generation
+
+
+class CatalogueChanges:
+    """Papers that changed since the last sync"""
+
+    def __init__(self, upserted_ids: List[int], deleted_ids: List[int]):
+        self.upserted_ids = upserted_ids
+        self.deleted_ids = deleted_ids
+
+    def __bool__(self):
+        return bool(self.upserted_ids or self.deleted_ids)
+
+
+class CatalogueTracker:
+    """
+    Incrementally discover which papers changed since the previous call.
+
+    New rows are found through ``id > max_id``, edited rows through
+    ``updated_at >= last_updated`` and deletions by comparing row counts;
+    the id column is only scanned in full when the counts disagree.
+    """
+
+    def __init__(self):
+        self.reset()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self.max_id = 0
+        self.last_updated: Optional[datetime] = None
+        self.count = 0
+        self.known_ids: Set[int] = set()
+        self._seen_generation = -1
+        self._last_check = 0.0
+
+    def state(self) -> Dict:
+        """Serializable tracker state (for indexes persisted to disk)"""
+        return {
+            "max_id": self.max_id,
+            "last_updated": self.last_updated.isoformat() if self.last_updated else None,
+            "count": self.count,
+        }
+
+    def restore(self, state: Dict, known_ids: Iterable[int]):
+        """Resume tracking from a state saved with state()"""
+        self.max_id = state.get("max_id", 0)
+        last_updated = state.get("last_updated")
+        self.last_updated = datetime.fromisoformat(last_updated) if last_updated else None
+        self.count = state.get("count", 0)
+        self.known_ids = {int(pid) for pid in known_ids}
+
+    def due(self) -> bool:
+        """True if a write was reported or the sync interval has elapsed"""
+        return (
+            self._seen_generation != current_generation()
+            or time.monotonic() - self._last_check >= SYNC_INTERVAL
+        )
+
+    def changes(self, db: Session, force: bool = False) -> CatalogueChanges:
+        """Return the papers inserted, updated or deleted since the previous call"""
+        with self._lock:
+            if not force and not self.due():
+                return CatalogueChanges([], [])
+            self._seen_generation = current_generation()
+            self._last_check = time.monotonic()
+
+            count, max_id, max_updated = db.query(
+                func.count(Paper.id), func.max(Paper.id), func.max(Paper.updated_at)
+            ).one()
+            count = count or 0
+            max_id = max_id or 0
+
+            if (count == self.count == len(self.known_ids) and max_id == self.max_id
+                    and max_updated == self.last_updated):
+                return CatalogueChanges([], [])
+
+            upserted: Set[int] = set()
+            if max_id > self.max_id:
+                upserted.update(pid for (pid,) in db.query(Paper.id).filter(Paper.id > self.max_id))
+            if max_updated is not None and max_updated != self.last_updated:
+                # >= rather than >: timestamps have limited resolution, so rows
+                # written in the same tick as the last sync are re-checked
+                edited = db.query(Paper.id).filter(Paper.updated_at.isnot(None))
+                if self.last_updated is not None:
+                    edited = edited.filter(Paper.updated_at >= self.last_updated)
+                upserted.update(pid for (pid,) in edited)
+
+            deleted: Set[int] = set()
+            if len(self.known_ids | upserted) != count:
+                all_ids = {pid for (pid,) in db.query(Paper.id)}
+                deleted = self.known_ids - all_ids
+                upserted.update(all_ids - self.known_ids)
+                upserted &= all_ids
+
+            self.known_ids |= upserted
+            self.known_ids -= deleted
+            self.count = count
+            self.max_id = max_id
+            self.last_updated = max_updated
+            return CatalogueChanges(sorted(upserted), sorted(deleted))
+
+
+def iter_papers_by_ids(db: Session, paper_ids: List[int], columns: Tuple, batch_size: int = 1000):
+    """Yield the requested columns for the given ids, one ``IN (...)`` query per batch"""
+    for start in range(0, len(paper_ids), batch_size):
+        chunk = paper_ids[start:start + batch_size]
+        yield from db.query(*columns).filter(Paper.id.in_(chunk))
+
+
+def load_papers_in_order(db: Session, paper_ids: List[int]) -> List[Paper]:
+    """Hydrate papers with a single ``IN (...)`` query, preserving the given order"""
+    if not paper_ids:
+        return []
+    by_id = {paper.id: paper for paper in db.query(Paper).filter(Paper.id.in_(paper_ids))}
+    return [by_id[pid] for pid in paper_ids if pid in by_id]
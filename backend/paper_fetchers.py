@@ -1,16 +1,335 @@
 """
 External paper API integrations for fetching papers from arXiv, PubMed, etc.
+
+The blocking fetchers here are kept for scripts; request handlers use the
+asyncio versions in async_fetchers.py, which share the parsers below.
+Responses are parsed incrementally as the body arrives (StreamingRecordParser)
+rather than loaded into one element tree.
 """
+import os
 import requests
 import xml.etree.ElementTree as ET
-from typing import List, Dict, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Union
 from datetime import datetime, timedelta
 import time
 
+# Overridable to point the fetchers at a mirror or at stub_fetch_server.py
+ARXIV_API_URL = os.getenv("ARXIV_API_URL", "http://export.arxiv.org/api/query")
+PUBMED_API_URL = os.getenv("PUBMED_API_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
+# Query used for "recent papers" from PubMed
+PUBMED_RECENT_QUERY = "machine learning[Title/Abstract] OR deep learning[Title/Abstract]"
+# Bytes of a response body fed to a parser at a time
+PARSE_CHUNK_SIZE = 64 * 1024
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+OPENSEARCH_TOTAL = "{http://a9.com/-/spec/opensearch/1.1/}totalResults"
+
+
+def arxiv_params(query: str, max_results: int = 50, sort_by: str = "submittedDate", start: int = 0,
+                 sort_order: str = "descending") -> Dict:
+    """Query parameters of an arXiv API search (one page of ``max_results`` from ``start``)"""
+    return {
+        "search_query": query,
+        "start": start,
+        "max_results": max_results,
+        "sortBy": sort_by,
+        "sortOrder": sort_order
+    }
+
+
+def _clean(text: Optional[str]) -> str:
+    return (text or "").strip().replace('\n', ' ')
+
+
+def _local(tag: str) -> str:
+    """Tag name without its {namespace} prefix"""
+    return tag.rpartition('}')[2]
+
+
+class StreamingRecordParser:
+    """
+    Incremental parser for an XML response body fed in chunks
+
+    Built on ElementTree's XMLPullParser (the push form of iterparse). A
+    record is turned into a paper dict when its element closes, and every
+    element parsed so far is then detached from the root, so memory stays
+    at roughly one record however long the response is.
+    """
+
+    # Tags of the elements handed to _record once closed
+    record_tags = frozenset()
+    # Tags of elements below the root that hold the records; pruned like the root
+    container_tags = frozenset()
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._root = None
+        self._containers = []
+
+    def feed(self, chunk: bytes) -> List[Dict]:
+        """Parse the next part of the body; returns the papers it completed"""
+        self._parser.feed(chunk)
+        return self._papers()
+
+    def close(self) -> List[Dict]:
+        """End of the body; returns any papers still pending"""
+        self._parser.close()
+        return self._papers()
+
+    def _papers(self) -> List[Dict]:
+        papers = []
+        record_tags = self.record_tags
+        for event, elem in self._parser.read_events():
+            if event == "end":
+                if elem.tag in record_tags:
+                    paper = self._record(elem)
+                    if paper is not None:
+                        papers.append(paper)
+            elif self._root is None:
+                self._root = elem
+                self._opened(elem)
+                record_tags = self.record_tags
+            elif elem.tag in self.container_tags:
+                self._containers.append(elem)
+        if self._root is not None:
+            del self._root[:]
+        for container in self._containers:
+            del container[:]
+        return papers
+
+    def _opened(self, root):
+        """Called with the root element as soon as it starts"""
+
+    def _record(self, elem) -> Optional[Dict]:
+        """Paper dict for a closed element of record_tags, if it yields one"""
+        raise NotImplementedError
+
+
+def _chunked(body) -> Iterable[bytes]:
+    """A response body as chunks; accepts the whole body or an iterable of chunks"""
+    if isinstance(body, (bytes, bytearray)):
+        return (body[i:i + PARSE_CHUNK_SIZE] for i in range(0, len(body), PARSE_CHUNK_SIZE))
+    return body
+
+
+def iter_records(parser: StreamingRecordParser, body: Union[bytes, Iterable[bytes]]) -> Iterator[Dict]:
+    """Papers yielded as ``parser`` works through the body"""
+    for chunk in _chunked(body):
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def _arxiv_paper(entry) -> Dict:
+    """Paper dict of one Atom <entry>, reading its children in a single pass"""
+    paper = {
+        "title": "",
+        "authors": "",
+        "abstract": "",
+        "url": "",
+        "doi": None,
+        "venue": "arXiv",
+        "year": None,
+        "keywords": None,
+        "citation_count": 0
+    }
+    authors, categories = [], []
+    for child in entry:
+        tag = child.tag
+        if tag == ATOM + "title":
+            paper["title"] = _clean(child.text)
+        elif tag == ATOM + "summary":
+            paper["abstract"] = _clean(child.text)
+        elif tag == ATOM + "id":
+            paper["url"] = child.text or ""
+        elif tag == ATOM + "author":
+            name = child.find(ATOM + "name")
+            if name is not None and name.text:
+                authors.append(name.text)
+        elif tag == ATOM + "category":
+            if child.get('term'):
+                categories.append(child.get('term'))
+        elif tag == ATOM + "published" and child.text:
+            # Extract year from published date
+            try:
+                paper["year"] = datetime.fromisoformat(child.text.replace('Z', '+00:00')).year
+            except ValueError:
+                pass
+    paper["authors"] = ", ".join(authors)
+    # Categories as keywords
+    if categories:
+        paper["keywords"] = ", ".join(categories[:5])
+    return paper
+
+
+class ArxivFeedParser(StreamingRecordParser):
+    """Papers from an arXiv Atom feed; ``total`` is the match count the feed reports"""
+
+    record_tags = frozenset({ATOM + "entry", OPENSEARCH_TOTAL})
+
+    def __init__(self):
+        super().__init__()
+        self.total: Optional[int] = None
+
+    def _record(self, elem) -> Optional[Dict]:
+        if elem.tag == ATOM + "entry":
+            return _arxiv_paper(elem)
+        if elem.text:
+            self.total = int(elem.text)
+        return None
+
+
+def iter_arxiv_feed(body: Union[bytes, Iterable[bytes]]) -> Iterator[Dict]:
+    """Papers from an arXiv Atom feed, yielded while it is parsed"""
+    return iter_records(ArxivFeedParser(), body)
+
+
+def parse_arxiv_feed(content: bytes) -> List[Dict]:
+    """Papers from an arXiv Atom feed"""
+    return list(iter_arxiv_feed(content))
+
+
+def pubmed_search_params(query: str, max_results: int = 50, use_history: bool = False,
+                         sort: Optional[str] = None) -> Dict:
+    """
+    Query parameters of a PubMed esearch call; ``use_history`` keeps the result set on the server
+
+    ``sort`` is an esearch sort order, e.g. "pub_date" for the newest first.
+    """
+    params = {
+        "db": "pubmed",
+        "term": query,
+        "retmax": max_results,
+        "retmode": "json"
+    }
+    if use_history:
+        params["usehistory"] = "y"
+    if sort:
+        params["sort"] = sort
+    return params
+
+
+def pubmed_fetch_params(pmids: List[str]) -> Dict:
+    """Query parameters of a PubMed efetch call"""
+    return {
+        "db": "pubmed",
+        "id": ",".join(pmids),
+        "retmode": "xml"
+    }
+
+
+def pubmed_history_fetch_params(web_env: str, query_key: str, retstart: int, retmax: int) -> Dict:
+    """Query parameters of an efetch call for one page of a result set kept with usehistory"""
+    return {
+        "db": "pubmed",
+        "WebEnv": web_env,
+        "query_key": query_key,
+        "retstart": retstart,
+        "retmax": retmax,
+        "retmode": "xml"
+    }
+
+
+def _pubmed_paper(article, fallback_pmid: str) -> Dict:
+    """Paper dict of one <PubmedArticle>, from a single walk over its elements"""
+    title = abstract = journal = pub_date = pmid = doi = None
+    authors, keywords = [], []
+    descriptors = 0
+    for elem in article.iter():
+        tag = elem.tag
+        if tag[0] == "{":
+            tag = _local(tag)
+        if tag == "ArticleTitle":
+            title = elem if title is None else title
+        elif tag == "AbstractText":
+            abstract = elem if abstract is None else abstract
+        elif tag == "Author":
+            last_name = first_name = None
+            for part in elem:
+                part_tag = _local(part.tag)
+                if part_tag == "LastName":
+                    last_name = part.text
+                elif part_tag == "FirstName":
+                    first_name = part.text
+            if last_name is not None:
+                authors.append(f"{last_name} {first_name}" if first_name is not None else last_name)
+        elif tag == "PubDate":
+            pub_date = elem if pub_date is None else pub_date
+        elif tag == "ArticleId":
+            if doi is None and elem.get('IdType') == 'doi':
+                doi = elem.text
+        elif tag == "Journal":
+            journal = elem if journal is None else journal
+        elif tag == "DescriptorName":
+            # MeSH terms as keywords
+            descriptors += 1
+            if descriptors <= 5 and elem.text:
+                keywords.append(elem.text)
+        elif tag == "PMID":
+            pmid = elem if pmid is None else pmid
+
+    year = None
+    if pub_date is not None:
+        year_text = next((part.text for part in pub_date if _local(part.tag) == "Year"), None)
+        if year_text is not None:
+            year = int(year_text)
+    venue = None
+    if journal is not None:
+        venue = next((part.text for part in journal if _local(part.tag) == "Title"), None)
+    # Corresponding PMID (from the article, else by position)
+    pmid = pmid.text if pmid is not None and pmid.text else fallback_pmid
+
+    return {
+        "title": title.text if title is not None else "",
+        "authors": ", ".join(authors[:10]),  # Limit authors
+        "abstract": abstract.text if abstract is not None else "",
+        "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}" if pmid else None,
+        "doi": doi,
+        "venue": venue or "PubMed",
+        "year": year,
+        "keywords": ", ".join(keywords) if keywords else None,
+        "citation_count": 0
+    }
+
+
+class PubmedArticleParser(StreamingRecordParser):
+    """Papers from a PubMed efetch response, for the ``pmids`` it was asked for (if known)"""
+
+    record_tags = frozenset({"PubmedArticle"})
+
+    def __init__(self, pmids: Optional[List[str]] = None):
+        super().__init__()
+        self.pmids = pmids or []
+        self.parsed = 0
+
+    def _opened(self, root):
+        # efetch output is normally not namespaced; accept either form
+        if root.tag.startswith("{"):
+            self.record_tags = frozenset({root.tag.split("}")[0] + "}PubmedArticle"})
+
+    def _record(self, elem) -> Optional[Dict]:
+        try:
+            paper = _pubmed_paper(elem, self.pmids[self.parsed] if self.parsed < len(self.pmids) else "")
+        except Exception as e:
+            print(f"Error parsing PubMed article: {e}")
+            return None
+        self.parsed += 1
+        return paper
+
+
+def iter_pubmed_articles(body: Union[bytes, Iterable[bytes]], pmids: Optional[List[str]] = None) -> Iterator[Dict]:
+    """Papers from a PubMed efetch response, yielded while it is parsed"""
+    return iter_records(PubmedArticleParser(pmids), body)
+
+
+def parse_pubmed_articles(content: bytes, pmids: List[str]) -> List[Dict]:
+    """Papers from a PubMed efetch response, for the ``pmids`` it was asked for"""
+    return list(iter_pubmed_articles(content, pmids))
+
+
 class ArxivFetcher:
     """Fetch papers from arXiv API"""
     
-    BASE_URL = "http://export.arxiv.org/api/query"
+    BASE_URL = ARXIV_API_URL
     
     @staticmethod
     def search(query: str, max_results: int = 50, sort_by: str = "submittedDate") -> List[Dict]:
@@ -22,52 +341,11 @@ class ArxivFetcher:
             max_results: Maximum number of results
             sort_by: Sort order (submittedDate, relevance, lastUpdatedDate)
         """
-        params = {
-            "search_query": query,
-            "start": 0,
-            "max_results": max_results,
-            "sortBy": sort_by,
-            "sortOrder": "descending"
-        }
-        
         try:
-            response = requests.get(ArxivFetcher.BASE_URL, params=params, timeout=10)
-            response.raise_for_status()
-            
-            root = ET.fromstring(response.content)
-            namespace = {'atom': 'http://www.w3.org/2005/Atom'}
-            
-            papers = []
-            for entry in root.findall('atom:entry', namespace):
-                paper = {
-                    "title": entry.find('atom:title', namespace).text.strip().replace('\n', ' ') if entry.find('atom:title', namespace) is not None else "",
-                    "authors": ", ".join([author.find('atom:name', namespace).text for author in entry.findall('atom:author', namespace) if author.find('atom:name', namespace) is not None]),
-                    "abstract": entry.find('atom:summary', namespace).text.strip().replace('\n', ' ') if entry.find('atom:summary', namespace) is not None else "",
-                    "url": entry.find('atom:id', namespace).text if entry.find('atom:id', namespace) is not None else "",
-                    "doi": None,
-                    "venue": "arXiv",
-                    "year": None,
-                    "keywords": None,
-                    "citation_count": 0
-                }
-                
-                # Extract year from published date
-                published = entry.find('atom:published', namespace)
-                if published is not None and published.text:
-                    try:
-                        date = datetime.fromisoformat(published.text.replace('Z', '+00:00'))
-                        paper["year"] = date.year
-                    except:
-                        pass
-                
-                # Extract categories as keywords
-                categories = [cat.get('term') for cat in entry.findall('atom:category', namespace)]
-                if categories:
-                    paper["keywords"] = ", ".join(categories[:5])
-                
-                papers.append(paper)
-            
-            return papers
+            with requests.get(ArxivFetcher.BASE_URL, params=arxiv_params(query, max_results, sort_by),
+                              timeout=10, stream=True) as response:
+                response.raise_for_status()
+                return list(iter_arxiv_feed(response.iter_content(PARSE_CHUNK_SIZE)))
         except Exception as e:
             print(f"Error fetching from arXiv: {e}")
             return []
@@ -86,7 +364,7 @@ class ArxivFetcher:
 class PubMedFetcher:
     """Fetch papers from PubMed API"""
     
-    BASE_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+    BASE_URL = PUBMED_API_URL
     
     @staticmethod
     def search(query: str, max_results: int = 50) -> List[Dict]:
@@ -99,15 +377,7 @@ class PubMedFetcher:
         """
         try:
             # Step 1: Search and get IDs
-            search_url = f"{PubMedFetcher.BASE_URL}/esearch.fcgi"
-            search_params = {
-                "db": "pubmed",
-                "term": query,
-                "retmax": max_results,
-                "retmode": "json"
-            }
-            
-            response = requests.get(search_url, params=search_params, timeout=10)
+            response = requests.get(f"{PubMedFetcher.BASE_URL}/esearch.fcgi", params=pubmed_search_params(query, max_results), timeout=10)
             response.raise_for_status()
             data = response.json()
             
@@ -116,93 +386,10 @@ class PubMedFetcher:
                 return []
             
             # Step 2: Fetch details
-            fetch_url = f"{PubMedFetcher.BASE_URL}/efetch.fcgi"
-            fetch_params = {
-                "db": "pubmed",
-                "id": ",".join(pmids),
-                "retmode": "xml"
-            }
-            
-            response = requests.get(fetch_url, params=fetch_params, timeout=10)
-            response.raise_for_status()
-            
-            root = ET.fromstring(response.content)
-            namespace = {'pubmed': 'http://www.ncbi.nlm.nih.gov'}
-            
-            papers = []
-            for article in root.findall('.//pubmed:PubmedArticle', namespace):
-                try:
-                    # Extract title
-                    title_elem = article.find('.//pubmed:ArticleTitle', namespace)
-                    title = title_elem.text if title_elem is not None else ""
-                    
-                    # Extract authors
-                    authors = []
-                    for author in article.findall('.//pubmed:Author', namespace):
-                        last_name = author.find('pubmed:LastName', namespace)
-                        first_name = author.find('pubmed:FirstName', namespace)
-                        if last_name is not None:
-                            name = last_name.text
-                            if first_name is not None:
-                                name += f" {first_name.text}"
-                            authors.append(name)
-                    
-                    # Extract abstract
-                    abstract_elem = article.find('.//pubmed:AbstractText', namespace)
-                    abstract = abstract_elem.text if abstract_elem is not None else ""
-                    
-                    # Extract year
-                    year = None
-                    pub_date = article.find('.//pubmed:PubDate', namespace)
-                    if pub_date is not None:
-                        year_elem = pub_date.find('pubmed:Year', namespace)
-                        if year_elem is not None:
-                            year = int(year_elem.text)
-                    
-                    # Extract DOI
-                    doi = None
-                    article_ids = article.findall('.//pubmed:ArticleId', namespace)
-                    for article_id in article_ids:
-                        if article_id.get('IdType') == 'doi':
-                            doi = article_id.text
-                            break
-                    
-                    # Extract journal
-                    journal_elem = article.find('.//pubmed:Journal', namespace)
-                    venue = None
-                    if journal_elem is not None:
-                        title_elem = journal_elem.find('pubmed:Title', namespace)
-                        if title_elem is not None:
-                            venue = title_elem.text
-                    
-                    # Extract MeSH terms as keywords
-                    keywords = []
-                    mesh_list = article.findall('.//pubmed:DescriptorName', namespace)
-                    for mesh in mesh_list[:5]:
-                        if mesh.text:
-                            keywords.append(mesh.text)
-                    
-                    # Get corresponding PMID
-                    pmid = pmids[len(papers)] if len(papers) < len(pmids) else ""
-                    
-                    paper = {
-                        "title": title,
-                        "authors": ", ".join(authors[:10]),  # Limit authors
-                        "abstract": abstract,
-                        "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}" if pmid else None,
-                        "doi": doi,
-                        "venue": venue or "PubMed",
-                        "year": year,
-                        "keywords": ", ".join(keywords) if keywords else None,
-                        "citation_count": 0
-                    }
-                    
-                    papers.append(paper)
-                except Exception as e:
-                    print(f"Error parsing PubMed article: {e}")
-                    continue
-            
-            return papers
+            with requests.get(f"{PubMedFetcher.BASE_URL}/efetch.fcgi", params=pubmed_fetch_params(pmids),
+                              timeout=10, stream=True) as response:
+                response.raise_for_status()
+                return list(iter_pubmed_articles(response.iter_content(PARSE_CHUNK_SIZE), pmids))
         except Exception as e:
             print(f"Error fetching from PubMed: {e}")
             return []
@@ -222,6 +409,7 @@ class PaperFetcherService:
         """
         all_papers = []
         
+        # Blocking; async callers use async_fetchers.async_fetcher.fetch_recent_papers
         if "arxiv" in sources:
             print("Fetching from arXiv...")
             arxiv_papers = ArxivFetcher.get_recent(max_results=max_per_source)
@@ -230,7 +418,7 @@ class PaperFetcherService:
         
         if "pubmed" in sources:
             print("Fetching from PubMed...")
-            pubmed_papers = PubMedFetcher.search("machine learning[Title/Abstract] OR deep learning[Title/Abstract]", max_results=max_per_source)
+            pubmed_papers = PubMedFetcher.search(PUBMED_RECENT_QUERY, max_results=max_per_source)
             all_papers.extend(pubmed_papers)
             time.sleep(1)  # Rate limiting
         
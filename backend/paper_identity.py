@@ -0,0 +1,60 @@
+"""
+Normalised identity keys of a paper, used to recognise the same work across sources
+
+A paper is the same as a stored one when its doi_key or arxiv_id matches,
+or when its title_key matches and neither of those strong ids conflicts:
+- title_key: the title case-folded, accents and punctuation removed,
+  whitespace collapsed ("{BERT}: Pre-training ..." == "bert pre training ...")
+- doi_key: the DOI lower-cased, without a resolver prefix
+- arxiv_id: the arXiv identifier without version, from the URL or an arXiv DOI
+
+Titles repeat across distinct works ("Editorial", "Reply to comment"), so two
+records that carry different DOIs or different arXiv ids are never the same
+paper, whatever their titles.
+"""
+import re
+import unicodedata
+from typing import Dict, Mapping, Optional
+
+_NON_WORD = re.compile(r"[\W_]+")
+_DOI_PREFIX = re.compile(r"^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)", re.IGNORECASE)
+_ARXIV_URL = re.compile(r"arxiv\.org/(?:abs|pdf)/([a-z\-]+(?:\.[a-z]{2})?/\d{7}|\d{4}\.\d{4,5})", re.IGNORECASE)
+_ARXIV_DOI = re.compile(r"^10\.48550/arxiv\.(.+)$")
+_ARXIV_VERSION = re.compile(r"v\d+$")
+
+# Keys that identify one work; two papers differing in either are distinct
+STRONG_KEYS = ("doi_key", "arxiv_id")
+
+
+def title_key(title: Optional[str]) -> Optional[str]:
+    if not title:
+        return None
+    decomposed = unicodedata.normalize("NFKD", title)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _NON_WORD.sub(" ", stripped.casefold()).strip() or None
+
+
+def doi_key(doi: Optional[str]) -> Optional[str]:
+    if not doi:
+        return None
+    return _DOI_PREFIX.sub("", doi.strip()).lower() or None
+
+
+def arxiv_id(url: Optional[str] = None, doi: Optional[str] = None) -> Optional[str]:
+    match = _ARXIV_URL.search(url or "")
+    if match:
+        return _ARXIV_VERSION.sub("", match.group(1).lower())
+    match = _ARXIV_DOI.match(doi_key(doi) or "")
+    if match:
+        return _ARXIV_VERSION.sub("", match.group(1))
+    return None
+
+
+def identity_keys(title: Optional[str], doi: Optional[str] = None, url: Optional[str] = None) -> Dict:
+    """Column values of the three keys"""
+    return {"title_key": title_key(title), "doi_key": doi_key(doi), "arxiv_id": arxiv_id(url, doi)}
+
+
+def conflicting(a: Mapping, b: Mapping) -> bool:
+    """True when two sets of keys carry different DOIs or different arXiv ids"""
+    return any(a.get(key) and b.get(key) and a[key] != b[key] for key in STRONG_KEYS)
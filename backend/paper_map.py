@@ -0,0 +1,255 @@
+"""
+Level-of-detail tiles for the paper map
+
+Every paper has a fixed position in the unit square (paper_layout,
+maintained by map_layout.py). The square is cut into 2^z x 2^z tiles at
+zoom z, and papers are kept sorted by the Morton (Z-order) code of their
+position, so the papers of any tile form one contiguous range found by
+binary search. A tile holding at most
+MAP_TILE_NODES papers is returned as individual nodes with their
+similarity edges (the precomputed paper_neighbors graph). Denser tiles
+are returned as cluster super-nodes (papers grouped CLUSTER_DEPTH zoom
+levels deeper), with edge counts between clusters. Tiles are streamed as
+NDJSON, one object per line.
+"""
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from map_layout import MapLayout, layout_version
+from models import Paper, PaperLayout, PaperNeighbor
+
+# Tiles with at most this many papers are sent as individual nodes
+MAP_TILE_NODES = int(os.getenv("MAP_TILE_NODES", "400"))
+# Similarity edges per paper shown on the map (the strongest neighbours)
+MAP_EDGES_PER_NODE = int(os.getenv("MAP_EDGES_PER_NODE", "3"))
+# Seconds between rebuilds after the layout changed
+MAP_REBUILD_INTERVAL = float(os.getenv("MAP_REBUILD_INTERVAL", "60"))
+# Largest number of tiles one viewport request may cover
+MAP_MAX_VIEWPORT_TILES = int(os.getenv("MAP_MAX_VIEWPORT_TILES", "64"))
+
+MAX_ZOOM = 16  # Morton codes interleave 16 bits per axis
+CLUSTER_DEPTH = 3  # A coarse tile is summarised as up to 8 x 8 clusters
+
+NODE_COLUMNS = (Paper.id, Paper.title, Paper.venue, Paper.year, Paper.citation_count, Paper.domains)
+
+
+def _spread_bits(values: np.ndarray) -> np.ndarray:
+    """Insert a zero bit between each of the low 16 bits"""
+    v = values.astype(np.uint64) & np.uint64(0xFFFF)
+    for shift, mask in ((8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333), (1, 0x55555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def morton_codes(cells_x: np.ndarray, cells_y: np.ndarray) -> np.ndarray:
+    """Z-order codes of integer cell coordinates"""
+    return _spread_bits(cells_x) | (_spread_bits(cells_y) << np.uint64(1))
+
+
+class PaperMapIndex:
+    """Immutable positions, labels and edges of one map version, in Morton order"""
+
+    def __init__(self, version: int, layout_version, paper_ids: np.ndarray, positions: np.ndarray,
+                 rows: List, edges: Tuple[np.ndarray, np.ndarray]):
+        self.version = version
+        self.layout_version = layout_version  # map_layout.layout_version() the index was built from
+        self.built_at = time.time()
+        cells = np.minimum((positions * (1 << MAX_ZOOM)).astype(np.int64), (1 << MAX_ZOOM) - 1)
+        codes = morton_codes(cells[:, 0], cells[:, 1])
+        order = np.argsort(codes, kind="stable")
+        self.codes = codes[order]
+        self.paper_ids = paper_ids[order]
+        self.x = positions[order, 0]
+        self.y = positions[order, 1]
+        rows = [rows[i] for i in order.tolist()]
+        self.titles = [row.title or "" for row in rows]
+        self.venues = [row.venue or "" for row in rows]
+        self.years = [int(row.year) if row.year else None for row in rows]
+        self.citations = np.array([row.citation_count or 0 for row in rows], dtype=np.int64)
+        self.domains = [row.domains or "" for row in rows]
+
+        # Edges as positions in Morton order, sorted by source so a tile's
+        # outgoing edges are one range too
+        position_of = {int(pid): pos for pos, pid in enumerate(self.paper_ids.tolist())}
+        sources, targets = [], []
+        for source, target in zip(*edges):
+            source_pos, target_pos = position_of.get(int(source)), position_of.get(int(target))
+            if source_pos is not None and target_pos is not None:
+                sources.append(source_pos)
+                targets.append(target_pos)
+        edge_order = np.argsort(sources, kind="stable")
+        self.edge_sources = np.array(sources, dtype=np.int64)[edge_order]
+        self.edge_targets = np.array(targets, dtype=np.int64)[edge_order]
+
+    def __len__(self):
+        return len(self.paper_ids)
+
+    def tile_range(self, zoom: int, tile_x: int, tile_y: int) -> Tuple[int, int]:
+        """[start, stop) positions of the papers inside a tile"""
+        prefix = int(morton_codes(np.array([tile_x]), np.array([tile_y]))[0])
+        shift = 2 * (MAX_ZOOM - zoom)
+        low = np.uint64(prefix << shift)
+        high = np.uint64((prefix + 1) << shift)
+        return int(np.searchsorted(self.codes, low)), int(np.searchsorted(self.codes, high))
+
+    def _edges_from(self, start: int, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+        lo, hi = np.searchsorted(self.edge_sources, [start, stop])
+        return self.edge_sources[lo:hi], self.edge_targets[lo:hi]
+
+    def _node(self, pos: int) -> Dict:
+        title = self.titles[pos]
+        return {
+            "type": "node",
+            "id": int(self.paper_ids[pos]),
+            "x": round(float(self.x[pos]), 5),
+            "y": round(float(self.y[pos]), 5),
+            "label": title[:50] + "..." if len(title) > 50 else title,
+            "venue": self.venues[pos],
+            "year": self.years[pos],
+            "citations": int(self.citations[pos]),
+        }
+
+    def tile(self, zoom: int, tile_x: int, tile_y: int, max_nodes: int = MAP_TILE_NODES) -> Iterator[Dict]:
+        """Objects of one tile: a header, then nodes and edges or clusters and cluster edges"""
+        start, stop = self.tile_range(zoom, tile_x, tile_y)
+        detail = stop - start <= max_nodes or zoom >= MAX_ZOOM - CLUSTER_DEPTH
+        yield {"type": "tile", "zoom": zoom, "x": tile_x, "y": tile_y, "papers": stop - start,
+               "detail": detail, "version": self.version}
+        if start == stop:
+            return
+
+        if detail:
+            for pos in range(start, stop):
+                yield self._node(pos)
+            sources, targets = self._edges_from(start, stop)
+            for source, target in zip(sources.tolist(), targets.tolist()):
+                yield {"type": "edge", "source": int(self.paper_ids[source]), "target": int(self.paper_ids[target])}
+            return
+
+        # Cluster super-nodes: papers grouped by their cell CLUSTER_DEPTH levels deeper
+        level = zoom + CLUSTER_DEPTH
+        keys = self.codes[start:stop] >> np.uint64(2 * (MAX_ZOOM - level))
+        cluster_keys, first, members = np.unique(keys, return_index=True, return_counts=True)
+        group = np.repeat(np.arange(len(cluster_keys)), members)  # codes are sorted, so groups are runs
+        x = np.bincount(group, weights=self.x[start:stop]) / members
+        y = np.bincount(group, weights=self.y[start:stop]) / members
+        citations = self.citations[start:stop]
+        for i, key in enumerate(cluster_keys.tolist()):
+            # Label a cluster with its most cited paper
+            lead = start + first[i] + int(np.argmax(citations[first[i]:first[i] + members[i]]))
+            yield {
+                "type": "cluster",
+                "id": f"{level}:{key}",
+                "x": round(float(x[i]), 5),
+                "y": round(float(y[i]), 5),
+                "papers": int(members[i]),
+                "label": self.titles[lead][:50],
+                "lead_id": int(self.paper_ids[lead]),
+                "citations": int(citations[first[i]:first[i] + members[i]].sum()),
+            }
+
+        # Edge counts between clusters of this tile
+        sources, targets = self._edges_from(start, stop)
+        inside = (targets >= start) & (targets < stop)
+        source_groups, target_groups = group[sources[inside] - start], group[targets[inside] - start]
+        between = source_groups != target_groups
+        low = np.minimum(source_groups[between], target_groups[between])
+        high = np.maximum(source_groups[between], target_groups[between])
+        pairs, weights = np.unique(np.stack([low, high], axis=1), axis=0, return_counts=True)
+        for (a, b), weight in zip(pairs.tolist(), weights.tolist()):
+            yield {"type": "cluster_edge", "source": f"{level}:{int(cluster_keys[a])}",
+                   "target": f"{level}:{int(cluster_keys[b])}", "weight": int(weight)}
+
+
+class PaperMap:
+    """Builds the map index from the stored layout and serves tiles"""
+
+    def __init__(self, layout: MapLayout, rebuild_interval: float = MAP_REBUILD_INTERVAL):
+        self.layout = layout
+        self.rebuild_interval = rebuild_interval
+        self._index: Optional[PaperMapIndex] = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self, db: Session) -> PaperMapIndex:
+        """Current index; built inline the first time, then rebuilt in the background"""
+        # Papers without a position yet are laid out in the background
+        self.layout.refresh(db.get_bind())
+        index = self._index
+        if index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._build(db)
+                return self._index
+        if index.layout_version != layout_version(db) and (
+            len(index) == 0 or time.time() - index.built_at >= self.rebuild_interval
+        ) and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._rebuild, args=(db.get_bind(),), daemon=True)
+            self._thread.start()
+        return index
+
+    def _rebuild(self, bind):
+        with Session(bind=bind) as db:
+            try:
+                with self._lock:
+                    self._index = self._build(db)
+            except Exception as e:
+                print(f"Error rebuilding paper map: {e}")
+
+    def _build(self, db: Session) -> PaperMapIndex:
+        started = time.perf_counter()
+        version = layout_version(db)
+        rows = db.query(PaperLayout.x, PaperLayout.y, *NODE_COLUMNS).join(
+            Paper, Paper.id == PaperLayout.paper_id
+        ).all()
+        paper_ids = np.array([row.id for row in rows], dtype=np.int64)
+        coordinates = np.array([(row.x, row.y) for row in rows], dtype=np.float32).reshape(-1, 2)
+
+        edges = db.query(PaperNeighbor.paper_id, PaperNeighbor.neighbor_id).filter(
+            PaperNeighbor.rank < MAP_EDGES_PER_NODE
+        ).all()
+        edge_arrays = (np.array([e[0] for e in edges], dtype=np.int64), np.array([e[1] for e in edges], dtype=np.int64))
+
+        self._version += 1
+        index = PaperMapIndex(self._version, version, paper_ids, coordinates, rows, edge_arrays)
+        print(f"Built paper map v{self._version}: {len(index)} papers, {len(index.edge_sources)} edges "
+              f"in {time.perf_counter() - started:.1f}s")
+        return index
+
+    @staticmethod
+    def viewport_tiles(zoom: int, x0: float, y0: float, x1: float, y1: float,
+                       max_tiles: int = MAP_MAX_VIEWPORT_TILES) -> Iterator[Tuple[int, int]]:
+        """
+        Tiles at ``zoom`` overlapping the box [x0, x1] x [y0, y1] of the unit square
+
+        Raises ValueError for a non-finite box or one covering more than
+        ``max_tiles`` tiles, checked before any tile is generated.
+        """
+        if not all(math.isfinite(v) for v in (x0, y0, x1, y1)):
+            raise ValueError("Viewport coordinates must be finite")
+        n = 1 << zoom
+        first_x, last_x = (min(n - 1, max(0, int(v * n))) for v in (min(x0, x1), max(x0, x1)))
+        first_y, last_y = (min(n - 1, max(0, int(v * n))) for v in (min(y0, y1), max(y0, y1)))
+        if (last_x - first_x + 1) * (last_y - first_y + 1) > max_tiles:
+            raise ValueError(f"Viewport covers more than {max_tiles} tiles")
+        return ((tx, ty) for ty in range(first_y, last_y + 1) for tx in range(first_x, last_x + 1))
+
+    @staticmethod
+    def ndjson(objects: Iterator[Dict]) -> Iterator[bytes]:
+        """Encode objects one per line, in chunks of a few hundred lines"""
+        lines = []
+        for obj in objects:
+            lines.append(json.dumps(obj, separators=(",", ":")))
+            if len(lines) >= 256:
+                yield ("\n".join(lines) + "\n").encode()
+                lines = []
+        if lines:
+            yield ("\n".join(lines) + "\n").encode()
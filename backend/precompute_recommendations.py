@@ -0,0 +1,230 @@
+"""
+Precompute top-N recommendations for every active user (e.g. for the nightly email digest)
+
+Calling get_recommendations once per user repeats a pass over the whole
+corpus for each of them. This job stacks all user profile vectors into one
+sparse matrix and scores them against the paper matrix block by block,
+optionally spreading user batches over a process pool, and writes the
+top-N per user to the precomputed_recommendations table, which
+/api/users/{user_id}/recommendations?precomputed=true serves directly.
+
+Scores, boosts and reasons are the same as RecommendationEngine's.
+
+Usage:
+    python precompute_recommendations.py
+    python precompute_recommendations.py --top-n 20 --paper-block 20000 --user-batch 256 --workers 4
+    python precompute_recommendations.py --since-days 30
+"""
+import argparse
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, engine as db_engine
+from ann_index import blocked_top_k
+from incremental_tfidf import TfidfSnapshot, split_domains
+from models import User, UserPaperInteraction, PrecomputedRecommendation
+from recommendation_engine import RecommendationEngine
+
+# State shared with worker processes (inherited through fork)
+_JOB: Dict = {}
+
+
+def active_user_ids(db: Session, since_days: int = 0) -> List[int]:
+    """Active users; with ``since_days``, only those with an interaction in that window"""
+    query = db.query(User.id).filter(User.is_active.isnot(False))
+    if since_days:
+        cutoff = datetime.utcnow() - timedelta(days=since_days)
+        recent = db.query(UserPaperInteraction.user_id).filter(
+            (UserPaperInteraction.created_at >= cutoff) | (UserPaperInteraction.updated_at >= cutoff)
+        )
+        query = query.filter(User.id.in_(recent))
+    return [user_id for (user_id,) in query.order_by(User.id)]
+
+
+def build_profiles(db: Session, vectors: TfidfSnapshot, user_ids: List[int]):
+    """
+    Stack every user's profile into one matrix
+
+    Returns:
+        (profiles, interacted): L2-normalised users x features profile
+        matrix, and a users x papers matrix marking papers each user has
+        already interacted with (weighted as get_recommendations does)
+    """
+    index_of = {user_id: i for i, user_id in enumerate(user_ids)}
+    rows, cols, weights = [], [], []
+    for start in range(0, len(user_ids), 1000):
+        chunk = user_ids[start:start + 1000]
+        interactions = db.query(
+            UserPaperInteraction.user_id, UserPaperInteraction.paper_id,
+            UserPaperInteraction.status, UserPaperInteraction.rating
+        ).filter(UserPaperInteraction.user_id.in_(chunk))
+        for interaction in interactions:
+            position = vectors.row_of.get(interaction.paper_id)
+            if position is None or position >= len(vectors):
+                continue
+            rows.append(index_of[interaction.user_id])
+            cols.append(position)
+            weights.append(RecommendationEngine._interaction_weight(interaction))
+
+    # Duplicate (user, paper) pairs are summed, as the per-user loop does
+    interacted = sp.csr_matrix((weights, (rows, cols)), shape=(len(user_ids), len(vectors)))
+    profiles = normalize(interacted @ vectors.matrix, norm='l2')
+    return profiles.tocsr(), interacted
+
+
+def user_boost_features(users: List[User], vectors: TfidfSnapshot):
+    """Per-user domain bitsets and (users x keywords) research-interest matches"""
+    domain_masks = np.zeros((len(users), vectors.domain_bits.shape[1]), dtype=np.uint64)
+    rows, cols = [], []
+    for i, user in enumerate(users):
+        if user.preferred_domains:
+            domain_masks[i] = vectors.domain_mask(split_domains(user.preferred_domains))
+        if user.research_interests:
+            keyword_ids = vectors.keywords_in(user.research_interests.lower())
+            rows.extend([i] * len(keyword_ids))
+            cols.extend(keyword_ids.tolist())
+    interests = sp.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=(len(users), max(vectors.n_keywords, 1))
+    )
+    return domain_masks, interests
+
+
+def score_users(batch: Tuple[int, int]) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Top-N paper rows for users ``batch[0]:batch[1]``
+
+    Returns:
+        (start, rows, scores, domain_flags), each users x top-N; unused slots
+        have score -inf
+    """
+    start, stop = batch
+    job = _JOB
+    profiles = job["profiles"][start:stop]
+    interacted = job["interacted"][start:stop]
+    domain_masks = job["domain_masks"][start:stop]
+    interests = job["interests"][start:stop]
+    matrix, keywords, domain_bits, alive = job["matrix"], job["keywords"], job["domain_bits"], job["alive"]
+
+    def adjust(scores: np.ndarray, block_start: int, block_stop: int):
+        in_domain = (domain_masks[:, None, :] & domain_bits[None, block_start:block_stop, :]).any(axis=2)
+        scores[in_domain] *= RecommendationEngine.DOMAIN_BOOST
+        keyword_block = keywords[block_start:block_stop]
+        hits = (interests[:, :keyword_block.shape[1]] @ keyword_block.T).toarray() > 0
+        scores[hits] *= RecommendationEngine.INTEREST_BOOST
+
+        scores[:, ~alive[block_start:block_stop]] = -np.inf
+        seen_users, seen_rows = interacted[:, block_start:block_stop].nonzero()
+        scores[seen_users, seen_rows] = -np.inf
+
+    best_rows, best_scores = blocked_top_k(profiles, matrix, job["top_n"], job["paper_block"], adjust)
+    domain_flags = (domain_masks[:, None, :] & domain_bits[best_rows]).any(axis=2)
+    return start, best_rows, best_scores, domain_flags
+
+
+def write_results(db: Session, results: Dict[int, List[Tuple[int, float, str]]]):
+    """Replace the stored recommendations of the given users"""
+    user_ids = list(results)
+    db.query(PrecomputedRecommendation).filter(
+        PrecomputedRecommendation.user_id.in_(user_ids)
+    ).delete(synchronize_session=False)
+    rows = [
+        {"user_id": user_id, "paper_id": paper_id, "rank": rank, "score": score, "reason": reason}
+        for user_id, ranked in results.items()
+        for rank, (paper_id, score, reason) in enumerate(ranked)
+    ]
+    if rows:
+        db.execute(insert(PrecomputedRecommendation), rows)
+    db.commit()
+
+
+def precompute(top_n: int = 20, paper_block: int = 20000, user_batch: int = 256,
+               workers: int = 0, since_days: int = 0):
+    """Score all active users and store their top-N recommendations"""
+    # The job may run before the API has created its tables
+    PrecomputedRecommendation.__table__.create(bind=db_engine, checkfirst=True)
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        engine = RecommendationEngine()
+        vectors = engine._paper_vectors(db)
+        user_ids = active_user_ids(db, since_days)
+        if not user_ids or len(vectors) == 0:
+            print(f"Nothing to do: {len(user_ids)} active users, {len(vectors)} papers")
+            return
+
+        users = {user.id: user for user in db.query(User).filter(User.id.in_(user_ids))}
+        profiles, interacted = build_profiles(db, vectors, user_ids)
+        domain_masks, interests = user_boost_features([users[user_id] for user_id in user_ids], vectors)
+        _JOB.update(
+            profiles=profiles, interacted=interacted.tocsr(), domain_masks=domain_masks, interests=interests,
+            matrix=vectors.matrix, keywords=vectors.keyword_matrix,
+            domain_bits=vectors.domain_bits, alive=vectors.alive, top_n=top_n, paper_block=paper_block,
+        )
+        has_profile = np.diff(profiles.indptr) > 0
+        print(f"Scoring {int(has_profile.sum())} user profiles against {len(vectors)} papers "
+              f"(setup {time.perf_counter() - started:.1f}s)")
+
+        batches = [(start, min(len(user_ids), start + user_batch)) for start in range(0, len(user_ids), user_batch)]
+        if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+            scored = pool.map(score_users, batches)
+        else:
+            pool = None
+            scored = map(score_users, batches)
+
+        written = 0
+        try:
+            for start, best_rows, best_scores, domain_flags in scored:
+                results = {}
+                for i in range(len(best_rows)):
+                    user_id = user_ids[start + i]
+                    if not has_profile[start + i]:
+                        # No interactions with indexed papers: popular papers, as the API would return
+                        results[user_id] = [
+                            (rec.paper.id, rec.score, rec.reason)
+                            for rec in engine._compute_recommendations(user_id, db, top_n)
+                        ]
+                        continue
+                    valid = np.isfinite(best_scores[i])
+                    results[user_id] = [
+                        (int(vectors.paper_ids[row]), float(score), engine.reason(float(score), bool(flag)))
+                        for row, score, flag in zip(best_rows[i][valid], best_scores[i][valid], domain_flags[i][valid])
+                    ]
+                write_results(db, results)
+                written += len(results)
+                print(f"Stored recommendations for {written}/{len(user_ids)} users...")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        print(f"Precomputed top-{top_n} recommendations for {written} users "
+              f"in {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        print(f"Error precomputing recommendations: {e}")
+        import traceback
+        traceback.print_exc()
+        db.rollback()
+    finally:
+        _JOB.clear()
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--top-n", type=int, default=20, help="recommendations stored per user")
+    parser.add_argument("--paper-block", type=int, default=20000, help="papers scored per matrix product")
+    parser.add_argument("--user-batch", type=int, default=256, help="users scored together")
+    parser.add_argument("--workers", type=int, default=0, help="process pool size (0 = run inline)")
+    parser.add_argument("--since-days", type=int, default=0,
+                        help="only users with an interaction in the last N days (0 = all active users)")
+    args = parser.parse_args()
+    precompute(args.top_n, args.paper_block, args.user_batch, args.workers, args.since_days)
@@ -0,0 +1,103 @@
+"""
+Per-user recommendation cache with TTL expiry, LRU eviction and event-driven invalidation
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import paper_catalogue
+
+RECOMMENDATION_CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", "600"))
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "1000"))
+
+
+class _Entry:
+    __slots__ = ("results", "limit", "expires_at", "generation")
+
+    def __init__(self, results: List, limit: int, expires_at: float, generation: int):
+        self.results = results
+        self.limit = limit
+        self.expires_at = expires_at
+        self.generation = generation
+
+
+class RecommendationCache:
+    """
+    Cache of each user's ranked recommendations.
+
+    An entry answers any request for at most as many results as it holds.
+    Entries expire after ``ttl`` seconds, the least recently used entry is
+    evicted once ``max_size`` users are cached, and an entry is dropped when
+    the user's interactions or profile change (invalidate()) or when papers
+    were added, edited or deleted since it was computed (see
+    paper_catalogue.touch()).
+    """
+
+    def __init__(self, ttl: float = RECOMMENDATION_CACHE_TTL, max_size: int = RECOMMENDATION_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int, limit: int) -> Optional[List]:
+        """Cached recommendations for the user, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and (
+                entry.expires_at <= time.monotonic()
+                or entry.generation != paper_catalogue.current_generation()
+            ):
+                del self._entries[user_id]
+                entry = None
+            if entry is None or entry.limit < limit:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry.results[:limit]
+
+    def put(self, user_id: int, limit: int, results: List, generation: int):
+        """
+        Store results computed for ``limit`` while the catalogue was at ``generation``
+
+        Pass the generation read before computing, so a write that lands
+        during the computation leaves the entry already stale.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = _Entry(results, limit, time.monotonic() + self.ttl, generation)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: int):
+        """Drop a user's entry after their interactions or profile changed"""
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
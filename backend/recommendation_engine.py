@@ -1,76 +1,140 @@
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from models import Paper, UserPaperInteraction, InteractionStatus
+import scipy.sparse as sp
+import scipy.sparse.linalg
+from incremental_tfidf import IncrementalTfidf, TfidfSnapshot, split_domains
+import paper_catalogue
+from paper_catalogue import load_papers_in_order
+from recommendation_cache import RecommendationCache
+from similarity_graph import SimilarityGraph
+from ann_index import top_k as select_top_k
+from models import Paper, UserPaperInteraction, InteractionStatus, PrecomputedRecommendation
 from schemas import RecommendationResponse, PaperResponse
 
 class RecommendationEngine:
+    # Results computed (and cached) per user; smaller requests are served from the same entry
+    CACHE_DEPTH = 50
+    
     def __init__(self):
-        self.vectorizer = TfidfVectorizer(max_features=100, stop_words='english')
-        self.paper_vectors = None
-        self.paper_ids = None
+        self.tfidf = IncrementalTfidf()
+        self.cache = RecommendationCache()
+        self.similarity = SimilarityGraph(self.tfidf)
     
-    def _build_paper_vectors(self, db: Session):
-        """Build TF-IDF vectors for all papers"""
-        papers = db.query(Paper).all()
-        if not papers:
-            return
-        
-        # Combine title, abstract, and keywords for each paper
-        texts = []
-        paper_ids = []
+    # Multiplier on an interaction's rating (1.0 if unrated) when building the profile
+    STATUS_WEIGHTS = {
+        InteractionStatus.STUDIED: 2.0,
+        InteractionStatus.READ: 1.5,
+        InteractionStatus.IMPLEMENTED: 2.5,
+        InteractionStatus.CITED: 2.5,
+    }
+    
+    DOMAIN_BOOST = 1.3  # Paper is in one of the user's preferred domains
+    INTEREST_BOOST = 1.2  # A paper keyword occurs in the user's research interests
+    
+    @classmethod
+    def _interaction_weight(cls, interaction) -> float:
+        # Weight by rating if available
+        weight = interaction.rating if interaction.rating else 1.0
+        return weight * cls.STATUS_WEIGHTS.get(interaction.status, 1.0)
+    
+    @staticmethod
+    def reason(score: float, matches_domain: bool) -> str:
+        """Human-readable explanation for a recommendation score"""
+        reason = "Similar to papers you've read"
+        if score > 0.3:
+            reason = "Highly relevant to your interests"
+        elif score > 0.1:
+            reason = "Related to your reading history"
         
-        for paper in papers:
-            text = f"{paper.title} {paper.abstract}"
-            if paper.keywords:
-                text += f" {paper.keywords}"
-            texts.append(text)
-            paper_ids.append(paper.id)
+        # Add domain match info if applicable
+        if matches_domain:
+            reason += " (matches your preferred domains)"
+        return reason
+    
+    def _paper_vectors(self, db: Session) -> TfidfSnapshot:
+        """Fold catalogue changes into the TF-IDF model and return its current vectors"""
+        self.tfidf.sync(db)
+        return self.tfidf.snapshot()
+    
+    def get_recommendations(
+        self,
+        user_id: int,
+        db: Session,
+        limit: int = 10
+    ) -> List[RecommendationResponse]:
+        """Get personalized recommendations for a user, from the per-user cache when possible"""
+        cached = self.cache.get(user_id, limit)
+        if cached is not None:
+            return cached
         
-        if texts:
-            self.paper_vectors = self.vectorizer.fit_transform(texts)
-            self.paper_ids = np.array(paper_ids)
+        generation = paper_catalogue.current_generation()
+        depth = max(limit, self.CACHE_DEPTH)
+        recommendations = self._compute_recommendations(user_id, db, depth)
+        self.cache.put(user_id, depth, recommendations, generation)
+        return recommendations[:limit]
+    
+    def invalidate_profile(self, user_id: int, db: Session):
+        """Drop the cached and precomputed recommendations of a user whose profile changed; commits"""
+        self.cache.invalidate(user_id)
+        db.query(PrecomputedRecommendation).filter(
+            PrecomputedRecommendation.user_id == user_id
+        ).delete(synchronize_session=False)
+        db.commit()
     
-    def _build_paper_vectors(self, db: Session):
-        """Build TF-IDF vectors for all papers"""
-        papers = db.query(Paper).all()
-        if not papers:
-            return
+    def get_precomputed(
+        self,
+        user_id: int,
+        db: Session,
+        limit: int = 10
+    ) -> Optional[List[RecommendationResponse]]:
+        """
+        Recommendations stored by precompute_recommendations.py
         
-        # Combine title, abstract, and keywords for each paper
-        texts = []
-        paper_ids = []
+        Returns None if there are none for the user, or if the user recorded
+        an interaction after they were computed. Profile changes delete the
+        user's rows (invalidate_profile).
+        """
+        rows = db.query(PrecomputedRecommendation).filter(
+            PrecomputedRecommendation.user_id == user_id
+        ).order_by(PrecomputedRecommendation.rank).limit(limit).all()
+        if not rows:
+            return None
         
-        for paper in papers:
-            text = f"{paper.title} {paper.abstract}"
-            if paper.keywords:
-                text += f" {paper.keywords}"
-            texts.append(text)
-            paper_ids.append(paper.id)
+        computed_at = rows[0].computed_at
+        last_interaction = db.query(
+            func.max(func.coalesce(UserPaperInteraction.updated_at, UserPaperInteraction.created_at))
+        ).filter(UserPaperInteraction.user_id == user_id).scalar()
+        # >= because timestamps may only have one-second resolution
+        if last_interaction is not None and computed_at is not None and last_interaction >= computed_at:
+            return None
         
-        if texts:
-            self.paper_vectors = self.vectorizer.fit_transform(texts)
-            self.paper_ids = np.array(paper_ids)
+        papers = {paper.id: paper for paper in load_papers_in_order(db, [row.paper_id for row in rows])}
+        return [
+            RecommendationResponse(
+                paper=PaperResponse.model_validate(papers[row.paper_id]),
+                score=row.score,
+                reason=row.reason
+            )
+            for row in rows if row.paper_id in papers
+        ]
     
-    def get_recommendations(
+    def _compute_recommendations(
         self,
         user_id: int,
         db: Session,
-        limit: int = 10
+        limit: int
     ) -> List[RecommendationResponse]:
-        """Get personalized recommendations for a user"""
+        """Score the catalogue for a user"""
         from models import User
         
         # Get user to check preferences
         user = db.query(User).filter(User.id == user_id).first()
         
-        # Build vectors if not already built
-        if self.paper_vectors is None or self.paper_ids is None:
-            self._build_paper_vectors(db)
+        vectors = self._paper_vectors(db)
         
-        if self.paper_vectors is None or self.paper_ids is None:
+        if len(vectors.row_of) == 0:
             # If no papers, return papers matching user preferences or popular papers
             query = db.query(Paper)
             
@@ -98,7 +162,9 @@ class RecommendationEngine:
             ]
         
         # Get user's interactions
-        interactions = db.query(UserPaperInteraction).filter(
+        interactions = db.query(
+            UserPaperInteraction.paper_id, UserPaperInteraction.status, UserPaperInteraction.rating
+        ).filter(
             UserPaperInteraction.user_id == user_id
         ).all()
         
@@ -129,94 +195,62 @@ class RecommendationEngine:
                 for p in papers
             ]
         
-        # Get papers user has already interacted with
-        interacted_paper_ids = {interaction.paper_id for interaction in interactions}
-        
-        # Build user profile vector from their interactions
-        user_vector = None
+        # Build user profile vector from their interactions: the weighted sum
+        # of the interacted papers' vectors, as one sparse product
+        positions, weights = [], []
         for interaction in interactions:
-            if interaction.paper_id in self.paper_ids:
-                idx = np.where(self.paper_ids == interaction.paper_id)[0][0]
-                paper_vector = self.paper_vectors[idx]
-                
-                # Weight by rating if available
-                weight = interaction.rating if interaction.rating else 1.0
-                if interaction.status == InteractionStatus.STUDIED:
-                    weight *= 2.0
-                elif interaction.status == InteractionStatus.READ:
-                    weight *= 1.5
-                elif interaction.status == InteractionStatus.IMPLEMENTED or interaction.status == InteractionStatus.CITED:
-                    weight *= 2.5
-                
-                if user_vector is None:
-                    user_vector = paper_vector * weight
-                else:
-                    user_vector += paper_vector * weight
+            position = vectors.row_of.get(interaction.paper_id)
+            if position is not None and position < len(vectors):
+                positions.append(position)
+                weights.append(self._interaction_weight(interaction))
         
-        if user_vector is None:
+        if not positions:
             return []
         
+        user_vector = sp.csr_matrix(np.array([weights])) @ vectors.rows(np.array(positions))
+        
         # Normalize user vector
-        norm = np.linalg.norm(user_vector.toarray())
+        norm = sp.linalg.norm(user_vector)
         if norm > 0:
             user_vector = user_vector / norm
         
-        # Calculate similarity with all papers
-        similarities = cosine_similarity(user_vector, self.paper_vectors)[0]
+        # Calculate similarity with all papers (rows are L2-normalised)
+        similarities = vectors.dot(user_vector)
         
-        # Get top recommendations excluding already interacted papers
-        recommendations = []
-        for idx, paper_id in enumerate(self.paper_ids):
-            if paper_id not in interacted_paper_ids:
-                score = float(similarities[idx])
-                
-                # Boost score if paper matches user's preferred domains or research interests
-                paper = db.query(Paper).filter(Paper.id == paper_id).first()
-                if paper and user:
-                    # Check preferred domains
-                    if user.preferred_domains and paper.domains:
-                        user_domains = [d.strip().lower() for d in user.preferred_domains.split(',')]
-                        paper_domains = [d.strip().lower() for d in paper.domains.split(',')]
-                        if any(domain in paper_domains for domain in user_domains):
-                            score *= 1.3  # Boost by 30%
-                    
-                    # Check research interests (simple keyword matching)
-                    if user.research_interests and paper.keywords:
-                        user_interests = user.research_interests.lower()
-                        paper_keywords = paper.keywords.lower()
-                        # Check if any keywords from paper match user interests
-                        if any(keyword in user_interests for keyword in paper_keywords.split(',') if len(keyword.strip()) > 3):
-                            score *= 1.2  # Boost by 20%
-                
-                recommendations.append((paper_id, score))
+        # Boost papers that match the user's preferred domains or research
+        # interests, using the per-paper features kept next to the vectors
+        scores = similarities.copy()
+        domain_match = np.zeros(len(scores), dtype=bool)
+        if user and user.preferred_domains:
+            domain_match = vectors.domain_match(split_domains(user.preferred_domains))
+            scores[domain_match] *= self.DOMAIN_BOOST
+        if user and user.research_interests:
+            user_interests = user.research_interests.lower()
+            # Papers with any keyword occurring in the user's interests
+            interest_match = vectors.keyword_match(vectors.keywords_in(user_interests))
+            scores[interest_match] *= self.INTEREST_BOOST
         
-        # Sort by score and get top N
-        recommendations.sort(key=lambda x: x[1], reverse=True)
-        top_recommendations = recommendations[:limit]
+        # Get top recommendations excluding already interacted papers
+        candidates = vectors.alive.copy()
+        candidates[positions] = False
+        rows = np.flatnonzero(candidates)
+        top_recommendations = [
+            (idx, int(vectors.paper_ids[idx]), score)
+            for idx, score in select_top_k(rows, scores[rows], limit)
+        ]
         
-        # Fetch papers and create response
+        # Fetch papers with one query and create response
+        papers = load_papers_in_order(db, [paper_id for _, paper_id, _ in top_recommendations])
+        paper_map = {paper.id: paper for paper in papers}
         result = []
-        for paper_id, score in top_recommendations:
-            paper = db.query(Paper).filter(Paper.id == paper_id).first()
+        for idx, paper_id, score in top_recommendations:
+            paper = paper_map.get(paper_id)
             if paper:
-                reason = "Similar to papers you've read"
-                if score > 0.3:
-                    reason = "Highly relevant to your interests"
-                elif score > 0.1:
-                    reason = "Related to your reading history"
-                
-                # Add domain match info if applicable
-                if user and user.preferred_domains and paper.domains:
-                    user_domains = [d.strip().lower() for d in user.preferred_domains.split(',')]
-                    paper_domains = [d.strip().lower() for d in paper.domains.split(',')]
-                    if any(domain in paper_domains for domain in user_domains):
-                        reason += " (matches your preferred domains)"
-                
                 result.append(
                     RecommendationResponse(
                         paper=PaperResponse.model_validate(paper),
                         score=score,
-                        reason=reason
+                        reason=self.reason(score, domain_match[idx])
                     )
                 )
         
@@ -229,36 +263,40 @@ class RecommendationEngine:
         limit: int = 5
     ) -> List[PaperResponse]:
         """Get papers similar to a given paper"""
-        if self.paper_vectors is None:
-            self._build_paper_vectors(db)
+        # Precomputed neighbour lists: one indexed lookup and one bulk fetch
+        neighbour_ids = self.similarity.neighbours(paper_id, db, limit)
+        self.similarity.refresh(db.get_bind())
+        if neighbour_ids is not None:
+            return [PaperResponse.model_validate(paper) for paper in load_papers_in_order(db, neighbour_ids)]
         
-        if self.paper_vectors is None:
-            return []
+        return self._live_similar_papers(paper_id, db, limit)
+    
+    def _live_similar_papers(
+        self,
+        paper_id: int,
+        db: Session,
+        limit: int
+    ) -> List[PaperResponse]:
+        """Score a paper against the whole matrix (for papers not in the similarity graph yet)"""
+        vectors = self._paper_vectors(db)
         
         # Find the paper in our vectors
-        if paper_id not in self.paper_ids:
+        paper_vector = vectors.row(paper_id)
+        if paper_vector is None:
             return []
         
-        idx = np.where(self.paper_ids == paper_id)[0][0]
-        paper_vector = self.paper_vectors[idx]
-        
-        # Calculate similarity with all papers
-        similarities = cosine_similarity(paper_vector, self.paper_vectors)[0]
+        # Calculate similarity with all papers (rows are L2-normalised)
+        similarities = vectors.dot(paper_vector)
         
         # Get top similar papers (excluding the paper itself)
-        recommendations = []
-        for i, pid in enumerate(self.paper_ids):
-            if pid != paper_id:
-                recommendations.append((pid, float(similarities[i])))
-        
-        recommendations.sort(key=lambda x: x[1], reverse=True)
-        top_similar = recommendations[:limit]
+        candidates = vectors.alive.copy()
+        candidates[vectors.row_of[paper_id]] = False
+        rows = np.flatnonzero(candidates)
+        top_similar = [
+            (int(vectors.paper_ids[idx]), score)
+            for idx, score in select_top_k(rows, similarities[rows], limit)
+        ]
         
-        # Fetch papers
-        result = []
-        for pid, _ in top_similar:
-            paper = db.query(Paper).filter(Paper.id == pid).first()
-            if paper:
-                result.append(PaperResponse.model_validate(paper))
-        
-        return result
+        # Fetch papers with one query
+        papers = load_papers_in_order(db, [pid for pid, _ in top_similar])
+        return [PaperResponse.model_validate(paper) for paper in papers]
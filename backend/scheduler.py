@@ -0,0 +1,250 @@
+"""
+Background job scheduler with database leases, started from the API lifespan
+
+Each job runs every SCHEDULE_FETCH_INTERVAL seconds plus up to
+SCHEDULE_FETCH_JITTER seconds of random delay, so sources are not hit in
+lockstep. A job has a row in job_leases holding its next run time and a
+lease. A worker runs a due job only after claiming the lease with one
+conditional UPDATE, so with several uvicorn workers or nodes each run
+happens once. A running job renews its lease; if the worker dies, the
+lease expires after SCHEDULER_LEASE_SECONDS and another worker reruns the job.
+
+Jobs (one per arXiv category in SCHEDULE_ARXIV_CATEGORIES, comma
+separated, and one per PubMed query in SCHEDULE_PUBMED_QUERIES,
+semicolon separated) fetch with the async fetchers and save through the
+ingest pipeline, so nothing blocks the event loop. SCHEDULER_ENABLED=0
+keeps a process from running any of them.
+"""
+import asyncio
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from auto_fetch import fetch_arxiv_category, fetch_pubmed_query
+from database import SessionLocal
+from models import JobLease
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") not in ("0", "false", "no")
+SCHEDULER_TICK = float(os.getenv("SCHEDULER_TICK", "30"))  # Seconds between checks for due jobs
+SCHEDULER_LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", "300"))
+
+SCHEDULE_ARXIV_CATEGORIES = [
+    c.strip() for c in os.getenv("SCHEDULE_ARXIV_CATEGORIES", "cs.LG,cs.AI,cs.CL,cs.CV").split(",") if c.strip()
+]
+SCHEDULE_PUBMED_QUERIES = [
+    q.strip() for q in os.getenv("SCHEDULE_PUBMED_QUERIES", "machine learning[Title/Abstract]").split(";") if q.strip()
+]
+SCHEDULE_FETCH_INTERVAL = int(os.getenv("SCHEDULE_FETCH_INTERVAL", "3600"))
+SCHEDULE_FETCH_JITTER = int(os.getenv("SCHEDULE_FETCH_JITTER", "300"))
+SCHEDULE_FETCH_MAX_RESULTS = int(os.getenv("SCHEDULE_FETCH_MAX_RESULTS", "50"))
+
+LEASE_FIELDS = ("next_run_at", "holder", "lease_expires_at", "last_started_at", "last_finished_at",
+                "last_duration_seconds", "last_status", "last_error", "last_papers", "papers_total", "runs")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ScheduledJob:
+    """A periodic job; ``run`` returns the number of papers it ingested"""
+
+    def __init__(self, name: str, run: Callable[[], Awaitable[int]], interval: int = SCHEDULE_FETCH_INTERVAL,
+                 jitter: int = SCHEDULE_FETCH_JITTER):
+        self.name = name
+        self.run = run
+        self.interval = interval
+        self.jitter = jitter
+
+    def next_run(self, after: datetime) -> datetime:
+        return after + timedelta(seconds=self.interval + random.uniform(0, self.jitter))
+
+
+def fetch_jobs() -> List[ScheduledJob]:
+    """The configured arXiv category and PubMed query fetch jobs"""
+    jobs = [
+        ScheduledJob(f"fetch:arxiv:{category}",
+                     lambda category=category: fetch_arxiv_category(category, SCHEDULE_FETCH_MAX_RESULTS))
+        for category in SCHEDULE_ARXIV_CATEGORIES
+    ]
+    jobs += [
+        ScheduledJob(f"fetch:pubmed:{query}",
+                     lambda query=query: fetch_pubmed_query(query, SCHEDULE_FETCH_MAX_RESULTS))
+        for query in SCHEDULE_PUBMED_QUERIES
+    ]
+    return jobs
+
+
+class Scheduler:
+    """Runs due jobs whose lease this worker wins; database work happens on worker threads"""
+
+    def __init__(self, jobs: Optional[List[ScheduledJob]] = None, tick: float = SCHEDULER_TICK,
+                 lease_seconds: int = SCHEDULER_LEASE_SECONDS, session_factory=SessionLocal):
+        self.jobs: Dict[str, ScheduledJob] = {job.name: job for job in (jobs if jobs is not None else fetch_jobs())}
+        self.tick = tick
+        self.lease_seconds = lease_seconds
+        self.session_factory = session_factory
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.running: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # --- leases -------------------------------------------------------------
+
+    def _register(self):
+        """Create the rows of new jobs, first runs spread over their jitter"""
+        now = _now()
+        with self.session_factory() as db:
+            known = {name for (name,) in db.query(JobLease.name).filter(JobLease.name.in_(list(self.jobs)))}
+            for name, job in self.jobs.items():
+                if name not in known:
+                    db.add(JobLease(name=name, next_run_at=now + timedelta(seconds=random.uniform(0, job.jitter)),
+                                    papers_total=0, runs=0))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()  # Another worker registered them first
+
+    def _claim(self, name: str) -> bool:
+        """Take the lease of a due job; True if this worker should run it"""
+        now = _now()
+        with self.session_factory() as db:
+            claimed = db.query(JobLease).filter(
+                JobLease.name == name,
+                JobLease.next_run_at <= now,
+                or_(JobLease.holder.is_(None), JobLease.lease_expires_at < now),
+            ).update({
+                "holder": self.holder,
+                "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                "last_started_at": now,
+            }, synchronize_session=False)
+            db.commit()
+            return claimed == 1
+
+    def _renew(self, name: str) -> bool:
+        with self.session_factory() as db:
+            renewed = db.query(JobLease).filter(JobLease.name == name, JobLease.holder == self.holder).update({
+                "lease_expires_at": _now() + timedelta(seconds=self.lease_seconds),
+            }, synchronize_session=False)
+            db.commit()
+            return renewed == 1
+
+    def _finish(self, name: str, duration: float, papers: int, error: Optional[str]):
+        """Record the run, schedule the next one and release the lease"""
+        now = _now()
+        with self.session_factory() as db:
+            db.query(JobLease).filter(JobLease.name == name, JobLease.holder == self.holder).update({
+                "holder": None,
+                "lease_expires_at": None,
+                "next_run_at": self.jobs[name].next_run(now),
+                "last_finished_at": now,
+                "last_duration_seconds": round(duration, 3),
+                "last_status": "failed" if error else "done",
+                "last_error": error,
+                "last_papers": papers,
+                "papers_total": JobLease.papers_total + papers,
+                "runs": JobLease.runs + 1,
+            }, synchronize_session=False)
+            db.commit()
+
+    def _release(self, names: List[str]):
+        """Give up leases without recording a run, so another worker can run the jobs"""
+        with self.session_factory() as db:
+            db.query(JobLease).filter(JobLease.name.in_(names), JobLease.holder == self.holder).update({
+                "holder": None, "lease_expires_at": None,
+            }, synchronize_session=False)
+            db.commit()
+
+    def run_now(self, name: str) -> bool:
+        """Make a job due immediately; False if there is no such job"""
+        if name not in self.jobs:
+            return False
+        self._register()
+        with self.session_factory() as db:
+            db.query(JobLease).filter(JobLease.name == name).update({"next_run_at": _now()},
+                                                                     synchronize_session=False)
+            db.commit()
+        return True
+
+    def status(self) -> List[Dict]:
+        """Schedule, lease and last run of every configured job"""
+        with self.session_factory() as db:
+            rows = {row.name: row for row in db.query(JobLease).filter(JobLease.name.in_(list(self.jobs)))}
+        result = []
+        for name, job in self.jobs.items():
+            row = rows.get(name)
+            entry = {"name": name, "interval_seconds": job.interval, "jitter_seconds": job.jitter,
+                     "running_here": name in self.running}
+            entry.update({field: getattr(row, field) if row else None for field in LEASE_FIELDS})
+            result.append(entry)
+        return result
+
+    # --- running ------------------------------------------------------------
+
+    async def _run(self, job: ScheduledJob):
+        started = time.perf_counter()
+        papers, error = 0, None
+        run = asyncio.create_task(job.run())
+        try:
+            # Renew the lease while the job runs
+            while True:
+                done, _ = await asyncio.wait({run}, timeout=self.lease_seconds / 3)
+                if done:
+                    break
+                if not await asyncio.to_thread(self._renew, job.name):
+                    print(f"[Scheduler] Lost the lease of {job.name} while running it")
+            papers = run.result() or 0
+        except asyncio.CancelledError:
+            run.cancel()
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            print(f"[Scheduler] {job.name} failed: {error}")
+        duration = time.perf_counter() - started
+        await asyncio.to_thread(self._finish, job.name, duration, papers, error)
+        print(f"[Scheduler] {job.name} {'failed' if error else 'done'} in {duration:.1f}s ({papers} papers)")
+
+    async def _loop(self):
+        await asyncio.to_thread(self._register)
+        while True:
+            for name, job in self.jobs.items():
+                if name in self.running:
+                    continue
+                try:
+                    claimed = await asyncio.to_thread(self._claim, name)
+                except Exception as e:
+                    print(f"[Scheduler] Could not check {name}: {e}")
+                    continue
+                if claimed:
+                    task = asyncio.create_task(self._run(job))
+                    self.running[name] = task
+                    task.add_done_callback(lambda _, name=name: self.running.pop(name, None))
+            await asyncio.sleep(self.tick)
+
+    def start(self):
+        """Start checking for due jobs in the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+            print(f"[Scheduler] Started as {self.holder} with {len(self.jobs)} jobs")
+
+    async def stop(self):
+        """Stop checking and cancel running jobs, releasing their leases"""
+        tasks = [self._task] if self._task else []
+        running = list(self.running)
+        tasks += list(self.running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        if running:
+            await asyncio.to_thread(self._release, running)
+
+
+# Global instance
+scheduler = Scheduler()
@@ -166,6 +166,12 @@ class FetchPapersRequest(BaseModel):
     query: Optional[str] = None
     max_per_source: int = 20
 
+class HarvestRequest(BaseModel):
+    source: str  # "arxiv" or "pubmed"
+    query: str
+    max_papers: int = 1000  # Stop after this many papers (resumable later), at most HARVEST_MAX_PAPERS
+    restart: bool = False  # Start over instead of resuming from the stored cursor
+
 class BibTeXUploadRequest(BaseModel):
     bibtex_content: str
 
@@ -1,11 +1,16 @@
 """
 Semantic search using sentence transformers
 """
-from typing import List, Dict, Optional
+import os
+import threading
+from typing import List, Dict, Optional, Tuple
 from sqlalchemy.orm import Session
 from models import Paper
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from embedding_store import EmbeddingStore
+from ann_index import ANNManager, top_k as select_top_k
+from paper_catalogue import CatalogueTracker, iter_papers_by_ids, load_papers_in_order
+from keyword_index import keyword_index
 
 # Try to import sentence transformers, but make it optional
 try:
@@ -15,153 +20,295 @@ except ImportError:
     SENTENCE_TRANSFORMERS_AVAILABLE = False
     print("sentence-transformers not available, using keyword search only")
 
+MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "./data/embeddings")
+EMBEDDING_STORE_DTYPE = os.getenv("EMBEDDING_STORE_DTYPE", "float16")
+ENCODE_BATCH_SIZE = 256
+
+# Nearest-neighbour backend: "auto" (exact below ANN_MIN_PAPERS, IVF above),
+# "exact" or "ivf". ANN_NPROBE trades recall for latency.
+ANN_BACKEND = os.getenv("SEMANTIC_ANN_BACKEND", "auto")
+ANN_MIN_PAPERS = int(os.getenv("SEMANTIC_ANN_MIN_PAPERS", "20000"))
+ANN_NPROBE = int(os.getenv("SEMANTIC_ANN_NPROBE", "16"))
+
+# Columns needed to (re)compute a paper's embedding text
+TEXT_COLUMNS = (Paper.id, Paper.title, Paper.abstract, Paper.keywords, Paper.domains)
+
 class SemanticSearchEngine:
     """Semantic search engine for papers"""
-    
-    def __init__(self):
+
+    def __init__(self, store_dir: str = EMBEDDING_STORE_DIR):
         self.model = None
-        self.paper_embeddings = {}
-        self.paper_ids = []
-        self.embeddings_matrix = None
+        self.store: Optional[EmbeddingStore] = None
+        self.ann: Optional[ANNManager] = None
+        self.store_dir = store_dir
+        self.tracker = CatalogueTracker()
+        self._lock = threading.RLock()
         self._load_model()
-    
+        self._open_store()
+
     def _load_model(self):
         """Load sentence transformer model"""
         if not SENTENCE_TRANSFORMERS_AVAILABLE:
             self.model = None
             print("Semantic search not available - using keyword search")
             return
-        
+
         try:
             # Use a lightweight model for faster inference
             # Try to load model, but don't fail if it doesn't work
             import warnings
             warnings.filterwarnings('ignore')
-            self.model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
+            self.model = SentenceTransformer(MODEL_NAME, device='cpu')
             print("Semantic search model loaded successfully")
         except Exception as e:
             print(f"Error loading semantic search model: {e}")
             print("Falling back to keyword search")
             self.model = None
-    
+
+    def _open_store(self):
+        """Open the on-disk embedding store for the loaded model"""
+        if not self.model:
+            return
+        try:
+            dim = self.model.get_sentence_embedding_dimension()
+            self.store = EmbeddingStore(self.store_dir, dim=dim, model_name=MODEL_NAME, dtype=EMBEDDING_STORE_DTYPE)
+            self.tracker.restore(self.store.tracker_state, self.store.ids)
+            self.ann = ANNManager(
+                self.store, self._lock, backend=ANN_BACKEND,
+                min_size=ANN_MIN_PAPERS, nprobe=ANN_NPROBE
+            )
+            self.ann.maybe_rebuild()
+        except Exception as e:
+            print(f"Error opening embedding store: {e}")
+            self.store = None
+            self.ann = None
+
+    @staticmethod
+    def _text_from_fields(title, abstract, keywords, domains) -> str:
+        return " ".join(part for part in (title, abstract, keywords, domains) if part)
+
     def _get_paper_text(self, paper: Paper) -> str:
         """Combine paper fields into searchable text"""
-        text_parts = []
-        if paper.title:
-            text_parts.append(paper.title)
-        if paper.abstract:
-            text_parts.append(paper.abstract)
-        if paper.keywords:
-            text_parts.append(paper.keywords)
-        if paper.domains:
-            text_parts.append(paper.domains)
-        return " ".join(text_parts)
-    
+        return self._text_from_fields(paper.title, paper.abstract, paper.keywords, paper.domains)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=64, show_progress_bar=False)
+
+    def _index_texts(self, items: List[Tuple[int, str]]) -> List[int]:
+        """Encode (paper_id, text) pairs whose content hash is not in the store yet"""
+        pending = []
+        for paper_id, text in items:
+            digest = EmbeddingStore.content_hash(text)
+            if self.store.hash_of(paper_id) != digest:
+                pending.append((paper_id, digest, text))
+
+        for start in range(0, len(pending), ENCODE_BATCH_SIZE):
+            batch = pending[start:start + ENCODE_BATCH_SIZE]
+            vectors = self._encode([text for _, _, text in batch])
+            batch_ids = [pid for pid, _, _ in batch]
+            self.store.upsert(batch_ids, [digest for _, digest, _ in batch], vectors)
+            self.ann.upsert(batch_ids)
+        return [pid for pid, _, _ in pending]
+
+    def _after_write(self):
+        self.ann.maybe_rebuild()
+        self.ann.save()
+
+    def encode_papers(self, papers: List[Dict]) -> Optional[np.ndarray]:
+        """Embeddings of paper dicts (title, abstract, keywords, domains), or None if unavailable"""
+        if not self.available:
+            return None
+        texts = [self._text_from_fields(p.get("title"), p.get("abstract"), p.get("keywords"), p.get("domains"))
+                 for p in papers]
+        return self._encode(texts)
+
+    def add_encoded(self, paper_ids: List[int], papers: List[Dict], vectors: np.ndarray):
+        """
+        Store embeddings from encode_papers() for papers just written
+
+        The content hashes match what sync() computes, so it will not
+        encode these papers again.
+        """
+        if not self.available or not paper_ids:
+            return
+        hashes = [
+            EmbeddingStore.content_hash(
+                self._text_from_fields(p.get("title"), p.get("abstract"), p.get("keywords"), p.get("domains"))
+            )
+            for p in papers
+        ]
+        with self._lock:
+            self.store.upsert(paper_ids, hashes, vectors)
+            self.ann.upsert(paper_ids)
+            self.store.flush()
+            self._after_write()
+
     def build_index(self, papers: List[Paper]):
-        """Build semantic index for papers"""
-        if not self.model:
+        """Add papers to the semantic index, encoding only new or changed ones"""
+        if not self.model or self.store is None:
             return
-        
+
         try:
-            texts = [self._get_paper_text(paper) for paper in papers]
-            if not texts:
-                return
-            
-            # Generate embeddings
-            embeddings = self.model.encode(texts, show_progress_bar=False)
-            
-            # Store embeddings
-            self.paper_ids = [paper.id for paper in papers]
-            self.embeddings_matrix = embeddings
-            self.paper_embeddings = {paper.id: embedding for paper, embedding in zip(papers, embeddings)}
-            
-            print(f"Built semantic index for {len(papers)} papers")
+            with self._lock:
+                encoded = self._index_texts([(paper.id, self._get_paper_text(paper)) for paper in papers])
+                if encoded:
+                    self.store.flush()
+                    self._after_write()
+                    print(f"Encoded {len(encoded)} new or changed papers into the semantic index")
         except Exception as e:
             print(f"Error building semantic index: {e}")
-    
+
+    def sync(self, db: Session, force: bool = False):
+        """Bring the embedding store up to date with the papers table"""
+        if not self.model or self.store is None:
+            return
+
+        with self._lock:
+            try:
+                changes = self.tracker.changes(db, force=force)
+                if not changes:
+                    return
+
+                if changes.deleted_ids:
+                    self.store.remove(changes.deleted_ids)
+                    self.ann.remove(changes.deleted_ids)
+
+                encoded = 0
+                items = []
+                for row in iter_papers_by_ids(db, changes.upserted_ids, TEXT_COLUMNS):
+                    items.append((row.id, self._text_from_fields(row.title, row.abstract, row.keywords, row.domains)))
+                    if len(items) >= ENCODE_BATCH_SIZE * 4:
+                        encoded += len(self._index_texts(items))
+                        items = []
+                encoded += len(self._index_texts(items))
+
+                self.store.flush(self.tracker.state())
+                self._after_write()
+                if encoded or changes.deleted_ids:
+                    print(f"Semantic index synced: {encoded} encoded, {len(changes.deleted_ids)} removed")
+            except Exception as e:
+                print(f"Error syncing semantic index: {e}")
+                # Rescan on the next call; content hashes avoid re-encoding
+                self.tracker.reset()
+
+    def _encode_query(self, query: str) -> np.ndarray:
+        query_embedding = self._encode([query])[0].astype(np.float32)
+        return query_embedding / max(float(np.linalg.norm(query_embedding)), 1e-12)
+
+    def search_ids(self, query: str, db: Session, top_k: int = 20,
+                   nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Semantic search over the persisted embedding store
+
+        Args:
+            nprobe: IVF cells to scan (higher = better recall, slower);
+                ignored while exact search is in use
+
+        Returns:
+            List of (paper_id, similarity) pairs, best first. Empty if
+            semantic search is unavailable.
+        """
+        if not self.model or self.store is None:
+            return []
+
+        self.sync(db)
+        return self.search_index(query, top_k, nprobe)
+
+    def search_index(self, query: str, top_k: int = 20, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """search_ids() without syncing first; touches no database session"""
+        if not self.model or self.store is None:
+            return []
+
+        query_embedding = self._encode_query(query)
+        with self._lock:
+            if len(self.store) == 0:
+                return []
+            return self.ann.search(query_embedding, top_k, nprobe=nprobe)
+
+    @property
+    def available(self) -> bool:
+        return self.model is not None and self.store is not None
+
+    def search_papers(self, query: str, db: Session, top_k: int = 20) -> List[Paper]:
+        """
+        Search the whole catalogue, hydrating only the top-k result rows
+
+        Uses the persisted semantic index when available, otherwise the
+        BM25F keyword index; either way the matching papers are loaded with
+        a single IN (...) query.
+        """
+        ranked = self.search_ids(query, db, top_k)
+        if not ranked:
+            ranked = keyword_index.search_ids(query, db, top_k)
+        return load_papers_in_order(db, [paper_id for paper_id, _ in ranked])
+
     def search(self, query: str, papers: List[Paper], top_k: int = 20) -> List[Paper]:
         """
         Perform semantic search
-        
+
         Args:
             query: Search query
             papers: List of papers to search in
             top_k: Number of results to return
-            
+
         Returns:
             List of papers sorted by relevance
         """
-        if not self.model:
+        if not self.model or self.store is None:
             # Fallback to keyword search
             return self._keyword_search(query, papers, top_k)
-        
+
         try:
-            # Build index if not already built or if papers changed
-            current_ids = {p.id for p in papers}
-            indexed_ids = set(self.paper_ids)
-            
-            if current_ids != indexed_ids or len(papers) != len(self.paper_ids):
-                self.build_index(papers)
-            
-            if self.embeddings_matrix is None or len(self.paper_ids) == 0:
-                return self._keyword_search(query, papers, top_k)
-            
-            # Encode query
-            query_embedding = self.model.encode([query], show_progress_bar=False)[0]
-            
-            # Calculate similarities
-            similarities = cosine_similarity(
-                query_embedding.reshape(1, -1),
-                self.embeddings_matrix
-            )[0]
-            
-            # Get top K papers
-            top_indices = np.argsort(similarities)[::-1][:top_k]
-            
-            # Create paper map for quick lookup
-            paper_map = {paper.id: paper for paper in papers}
-            
-            # Return papers sorted by similarity
-            results = []
-            for idx in top_indices:
-                paper_id = self.paper_ids[idx]
-                if paper_id in paper_map:
-                    paper = paper_map[paper_id]
-                    results.append(paper)
-            
-            return results
+            # Only papers that are new or changed since they were stored get encoded
+            self.build_index(papers)
+
+            with self._lock:
+                indexed = [paper for paper in papers if paper.id in self.store]
+                if not indexed:
+                    return self._keyword_search(query, papers, top_k)
+
+                similarities = self.store.vectors_for([paper.id for paper in indexed]) @ self._encode_query(query)
+
+            ranked = select_top_k(np.arange(len(indexed)), similarities, top_k)
+            return [indexed[idx] for idx, _ in ranked]
         except Exception as e:
             print(f"Error in semantic search: {e}")
             return self._keyword_search(query, papers, top_k)
-    
+
+    def _keyword_score(self, query_lower: str, query_words: List[str], title, abstract, keywords, domains) -> int:
+        score = 0
+        text = self._text_from_fields(title, abstract, keywords, domains).lower()
+
+        # Title matches are most important
+        if query_lower in (title or "").lower():
+            score += 10
+        # Abstract matches
+        if query_lower in (abstract or "").lower():
+            score += 5
+        # Keyword matches
+        if query_lower in (keywords or "").lower():
+            score += 3
+
+        # Count word matches
+        for word in query_words:
+            if word in text:
+                score += 1
+        return score
+
     def _keyword_search(self, query: str, papers: List[Paper], top_k: int) -> List[Paper]:
         """Fallback keyword search"""
         query_lower = query.lower()
+        query_words = query_lower.split()
         scored_papers = []
-        
+
         for paper in papers:
-            score = 0
-            text = self._get_paper_text(paper).lower()
-            
-            # Title matches are most important
-            if query_lower in (paper.title or "").lower():
-                score += 10
-            # Abstract matches
-            if query_lower in (paper.abstract or "").lower():
-                score += 5
-            # Keyword matches
-            if query_lower in (paper.keywords or "").lower():
-                score += 3
-            
-            # Count word matches
-            query_words = query_lower.split()
-            for word in query_words:
-                if word in text:
-                    score += 1
-            
+            score = self._keyword_score(
+                query_lower, query_words, paper.title, paper.abstract, paper.keywords, paper.domains
+            )
             if score > 0:
                 scored_papers.append((score, paper))
-        
+
         # Sort by score and return top K
         scored_papers.sort(key=lambda x: x[0], reverse=True)
         return [paper for _, paper in scored_papers[:top_k]]
@@ -0,0 +1,335 @@
+"""
+Precomputed top-K similar-paper graph over the recommendation TF-IDF vectors
+
+The K most similar papers of every paper (cosine over the rows
+RecommendationEngine scores with) are stored in the paper_neighbors table,
+so /api/papers/{paper_id}/similar is one indexed lookup plus one bulk fetch
+instead of a pass over the whole matrix per request.
+
+The graph is built with blocked sparse matrix products and then kept up to
+date incrementally: new and edited papers get their own lists, are merged
+into the lists of existing papers they now rank in, and papers whose lists
+pointed at a deleted or edited paper are recomputed. Updates run on a
+background thread; papers without a list yet are scored live by the caller.
+A full rebuild is written to paper_neighbors_staging and swapped in with
+one transaction, so readers never see a half-written table. With several
+API workers, only the one holding the similarity_graph lease (job_lease.py)
+writes.
+
+Usage:
+    python similarity_graph.py            # build the graph, or catch up with the catalogue
+    python similarity_graph.py --rebuild  # recompute every list
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from ann_index import blocked_top_k
+from incremental_tfidf import IncrementalTfidf, TfidfSnapshot
+from job_lease import WorkLease
+from models import JobLease, PaperNeighbor, paper_neighbors_staging
+from paper_catalogue import CatalogueChanges, CatalogueTracker
+
+SIMILAR_PAPERS_K = int(os.getenv("SIMILAR_PAPERS_K", "20"))
+SIMILARITY_GRAPH_DIR = os.getenv("SIMILARITY_GRAPH_DIR", "./data/similarity_graph")
+# Share of the catalogue that may change before an update rebuilds the whole graph
+SIMILARITY_GRAPH_REBUILD_FRACTION = float(os.getenv("SIMILARITY_GRAPH_REBUILD_FRACTION", "0.2"))
+
+
+class SimilarityGraph:
+    """
+    Top-K neighbour lists of every paper, persisted in paper_neighbors.
+
+    ``meta.json`` and ``ids.npy`` in ``directory`` hold the catalogue
+    tracker state of the last update, so a restart resumes incrementally.
+    """
+
+    QUERY_BLOCK = 256  # Papers whose lists are computed together
+    PAPER_BLOCK = 20000  # Papers scored per matrix product
+    ID_BATCH = 1000  # Ids per IN (...) clause
+
+    def __init__(self, tfidf: IncrementalTfidf, k: int = SIMILAR_PAPERS_K,
+                 directory: str = SIMILARITY_GRAPH_DIR,
+                 rebuild_fraction: float = SIMILARITY_GRAPH_REBUILD_FRACTION):
+        self.tfidf = tfidf
+        self.k = k
+        self.directory = directory
+        self.rebuild_fraction = rebuild_fraction
+        self.tracker = CatalogueTracker()
+        self.ready = False
+        # Papers whose lists are committed (the tracker runs ahead during an update)
+        self.indexed: Set[int] = set()
+        # Score a paper must beat to enter each stored list (0 while a list is not full)
+        self._floors: Optional[Dict[int, float]] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # Only one API worker rewrites paper_neighbors at a time
+        self.lease = WorkLease("similarity_graph")
+        self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        try:
+            with open(self._path("meta.json")) as f:
+                meta = json.load(f)
+            if meta.get("k") != self.k:
+                print(f"Similarity graph was built with k={meta.get('k')}, rebuilding for k={self.k}")
+                return
+            self.tracker.restore(meta["tracker"], np.load(self._path("ids.npy")).tolist())
+            self.indexed = set(self.tracker.known_ids)
+            self.ready = True
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error loading similarity graph state: {e}")
+
+    def _save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        np.save(self._path("ids.npy"), np.array(sorted(self.tracker.known_ids), dtype=np.int64))
+        tmp_path = self._path("meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"k": self.k, "tracker": self.tracker.state()}, f)
+        os.replace(tmp_path, self._path("meta.json"))
+
+    # --- reads ------------------------------------------------------------
+
+    def neighbours(self, paper_id: int, db: Session, limit: int) -> Optional[List[int]]:
+        """
+        Stored neighbour ids of a paper, most similar first
+
+        Returns None when the graph cannot answer (not built yet, paper
+        added since the last update, or ``limit`` above K).
+        """
+        if not self.ready or limit > self.k or paper_id not in self.indexed:
+            return None
+        return [
+            neighbor_id for (neighbor_id,) in db.query(PaperNeighbor.neighbor_id).filter(
+                PaperNeighbor.paper_id == paper_id
+            ).order_by(PaperNeighbor.rank).limit(limit)
+        ]
+
+    # --- updates ----------------------------------------------------------
+
+    def refresh(self, bind):
+        """Fold catalogue changes in on a background thread, if due and not already running"""
+        if not self.tracker.due() or not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._background_update, args=(bind,), daemon=True)
+                self._thread.start()
+        finally:
+            self._lock.release()
+
+    def _background_update(self, bind):
+        db = Session(bind=bind)
+        try:
+            self.update(db)
+        finally:
+            db.close()
+
+    def update(self, db: Session, force: bool = False, rebuild: bool = False):
+        """Bring the stored lists up to date with the catalogue; skipped while another worker holds the lease"""
+        with self._lock:
+            if not self.lease.acquire(db):
+                return
+            if not self.ready:
+                # Pick up lists another worker built since this one started
+                self._load()
+            full = rebuild or not self.ready
+            if rebuild:
+                self.tracker.reset()  # The stored lists stay readable until the rebuild swaps in
+            state, known_ids = self.tracker.state(), set(self.tracker.known_ids)
+            started = time.perf_counter()
+            duration, error = None, None
+            try:
+                changes = self.tracker.changes(db, force=force or full)
+                if not changes and not full:
+                    return
+                self.tfidf.sync(db, force=True)
+                vectors = self.tfidf.snapshot()
+
+                n_changed = len(changes.upserted_ids) + len(changes.deleted_ids)
+                if full or n_changed > self.rebuild_fraction * max(len(self.tracker.known_ids), 1):
+                    self._rebuild(db, vectors)
+                    print(f"Built similarity graph for {len(self.tracker.known_ids)} papers "
+                          f"in {time.perf_counter() - started:.1f}s")
+                else:
+                    self._apply(db, vectors, changes)
+                    print(f"Updated similarity graph for {n_changed} changed papers "
+                          f"in {time.perf_counter() - started:.1f}s")
+                self.ready = True
+                self.indexed = set(self.tracker.known_ids)
+                self._save()
+                duration = time.perf_counter() - started
+            except Exception as e:
+                print(f"Error updating similarity graph: {e}")
+                db.rollback()
+                # Retry the same changes next time
+                self.tracker.restore(state, known_ids)
+                self._floors = None
+                duration, error = time.perf_counter() - started, str(e) or type(e).__name__
+            finally:
+                self.lease.release(db, duration, error)
+
+    def _neighbour_lists(self, vectors: TfidfSnapshot, positions: np.ndarray) -> Iterable[Dict]:
+        """Yield {paper_id: [(neighbor_id, score), ...]} for the given rows, QUERY_BLOCK papers at a time"""
+        matrix, alive, paper_ids = vectors.matrix, vectors.alive, vectors.paper_ids
+        for query_start in range(0, len(positions), self.QUERY_BLOCK):
+            query_rows = positions[query_start:query_start + self.QUERY_BLOCK]
+
+            def exclude(scores: np.ndarray, start: int, stop: int):
+                scores[:, ~alive[start:stop]] = -np.inf
+                own = (query_rows >= start) & (query_rows < stop)
+                scores[np.flatnonzero(own), query_rows[own] - start] = -np.inf
+
+            rows, scores = blocked_top_k(matrix[query_rows], matrix, self.k, self.PAPER_BLOCK, exclude)
+            lists = {}
+            for i, position in enumerate(query_rows.tolist()):
+                valid = scores[i] > 0
+                lists[int(paper_ids[position])] = list(zip(
+                    paper_ids[rows[i][valid]].tolist(), scores[i][valid].tolist()
+                ))
+            yield lists
+
+    def _load_floors(self, db: Session) -> Dict[int, float]:
+        if self._floors is None:
+            self._floors = {
+                paper_id: (lowest if count >= self.k else 0.0)
+                for paper_id, lowest, count in db.query(
+                    PaperNeighbor.paper_id, func.min(PaperNeighbor.score), func.count()
+                ).group_by(PaperNeighbor.paper_id)
+            }
+        return self._floors
+
+    def _delete_lists(self, db: Session, paper_ids: Iterable[int]):
+        paper_ids = sorted(paper_ids)
+        for start in range(0, len(paper_ids), self.ID_BATCH):
+            db.query(PaperNeighbor).filter(
+                PaperNeighbor.paper_id.in_(paper_ids[start:start + self.ID_BATCH])
+            ).delete(synchronize_session=False)
+
+    def _write_lists(self, db: Session, lists: Dict[int, List[Tuple[int, float]]], table=PaperNeighbor.__table__):
+        rows = [
+            {"paper_id": paper_id, "rank": rank, "neighbor_id": neighbor_id, "score": score}
+            for paper_id, ranked in lists.items()
+            for rank, (neighbor_id, score) in enumerate(ranked)
+        ]
+        if rows:
+            db.execute(insert(table), rows)
+        for paper_id, ranked in lists.items():
+            self._floors[paper_id] = ranked[-1][1] if len(ranked) >= self.k else 0.0
+
+    def _rebuild(self, db: Session, vectors: TfidfSnapshot):
+        # Lookups keep reading the previous lists until the swap below
+        staging = paper_neighbors_staging
+        staging.create(bind=db.get_bind(), checkfirst=True)
+        db.execute(delete(staging))  # Left over by a failed rebuild
+        db.commit()
+        self._floors = {}
+        positions = np.flatnonzero(vectors.alive)
+        done = 0
+        for lists in self._neighbour_lists(vectors, positions):
+            self._write_lists(db, lists, staging)
+            db.commit()
+            self.lease.renew(db)
+            done += len(lists)
+            if done % 10000 < self.QUERY_BLOCK:
+                print(f"Similarity graph: {done}/{len(positions)} papers...")
+        columns = [column.name for column in staging.columns]
+        db.execute(delete(PaperNeighbor))
+        db.execute(insert(PaperNeighbor).from_select(columns, select(*staging.columns)))
+        db.execute(delete(staging))
+        db.commit()
+
+    def _apply(self, db: Session, vectors: TfidfSnapshot, changes: CatalogueChanges):
+        floors = self._load_floors(db)
+        deleted = set(changes.deleted_ids)
+        stale = deleted | set(changes.upserted_ids)
+
+        # Lists that contain a deleted or edited paper are recomputed from scratch
+        stale_ids = sorted(stale)
+        affected: Set[int] = set()
+        for start in range(0, len(stale_ids), self.ID_BATCH):
+            affected.update(paper_id for (paper_id,) in db.query(PaperNeighbor.paper_id).filter(
+                PaperNeighbor.neighbor_id.in_(stale_ids[start:start + self.ID_BATCH])
+            ).distinct())
+        self._delete_lists(db, stale | affected)
+        for paper_id in deleted:
+            floors.pop(paper_id, None)
+
+        def positions_of(paper_ids: Iterable[int]) -> np.ndarray:
+            positions = [vectors.row_of.get(paper_id) for paper_id in paper_ids]
+            positions = np.array([p for p in positions if p is not None and p < len(vectors)], dtype=np.int64)
+            return positions[vectors.alive[positions]] if len(positions) else positions
+
+        fresh = positions_of(sorted((affected | set(changes.upserted_ids)) - deleted))
+        for lists in self._neighbour_lists(vectors, fresh):
+            self._write_lists(db, lists)
+
+        self._merge_newcomers(db, vectors, positions_of(changes.upserted_ids), fresh)
+        db.commit()
+
+    def _merge_newcomers(self, db: Session, vectors: TfidfSnapshot, newcomers: np.ndarray, fresh: np.ndarray):
+        """Add new or edited papers to the stored lists of papers they now rank in"""
+        if not len(newcomers):
+            return
+        matrix, paper_ids = vectors.matrix, vectors.paper_ids
+        # Only scores above a paper's current K-th neighbour change its list;
+        # dead rows and lists computed in this update are left alone
+        floor = np.full(len(vectors), np.inf)
+        alive_rows = np.flatnonzero(vectors.alive)
+        floor[alive_rows] = [self._floors.get(paper_id, 0.0) for paper_id in paper_ids[alive_rows].tolist()]
+        floor[fresh] = np.inf
+
+        candidates: Dict[int, List[Tuple[int, float]]] = {}
+        for query_start in range(0, len(newcomers), self.QUERY_BLOCK):
+            query_rows = newcomers[query_start:query_start + self.QUERY_BLOCK]
+            queries = matrix[query_rows]
+            for start in range(0, len(vectors), self.PAPER_BLOCK):
+                stop = min(len(vectors), start + self.PAPER_BLOCK)
+                scores = (queries @ matrix[start:stop].T).toarray()
+                hit_queries, hit_rows = np.nonzero(scores > floor[start:stop])
+                for q, row in zip(hit_queries.tolist(), hit_rows.tolist()):
+                    candidates.setdefault(int(paper_ids[start + row]), []).append(
+                        (int(paper_ids[query_rows[q]]), float(scores[q, row]))
+                    )
+        if not candidates:
+            return
+
+        targets = sorted(candidates)
+        for start in range(0, len(targets), self.ID_BATCH):
+            for paper_id, neighbor_id, score in db.query(
+                PaperNeighbor.paper_id, PaperNeighbor.neighbor_id, PaperNeighbor.score
+            ).filter(PaperNeighbor.paper_id.in_(targets[start:start + self.ID_BATCH])):
+                candidates[paper_id].append((neighbor_id, score))
+        merged = {
+            paper_id: sorted(ranked, key=lambda pair: -pair[1])[:self.k]
+            for paper_id, ranked in candidates.items()
+        }
+        self._delete_lists(db, targets)
+        self._write_lists(db, merged)
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, engine as db_engine
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rebuild", action="store_true", help="recompute every list")
+    args = parser.parse_args()
+
+    # The job may run before the API has created its tables
+    PaperNeighbor.__table__.create(bind=db_engine, checkfirst=True)
+    JobLease.__table__.create(bind=db_engine, checkfirst=True)
+    graph = SimilarityGraph(IncrementalTfidf())
+    with SessionLocal() as session:
+        graph.update(session, force=True, rebuild=args.rebuild)
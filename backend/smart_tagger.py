@@ -59,6 +59,40 @@ class SmartTagger:
         'theory': ['theory', 'algorithm', 'complexity', 'optimization'],
     }
     
+    _stop_words: Optional[frozenset] = None
+    _TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+    @staticmethod
+    def stop_words() -> frozenset:
+        """English stopwords (with fallback if NLTK data not available)"""
+        if SmartTagger._stop_words is None:
+            try:
+                words = set(stopwords.words('english'))
+            except LookupError:
+                # Fallback to basic English stopwords if NLTK data not available
+                words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'from', 'as', 'is', 'was', 'are', 'were', 'been', 'be', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'should', 'could', 'may', 'might', 'must', 'can', 'this', 'that', 'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they', 'what', 'which', 'who', 'when', 'where', 'why', 'how'}
+            SmartTagger._stop_words = frozenset(words)
+        return SmartTagger._stop_words
+
+    @staticmethod
+    def tokenize(text: str, min_length: int = 3) -> List[str]:
+        """
+        Fast tokenizer using the same normalisation as extract_keywords
+        (lowercase, alphanumeric tokens, stopwords and short tokens dropped)
+        without NLTK's slower word_tokenize
+
+        Args:
+            text: Input text
+            min_length: Shortest token to keep
+        """
+        if not text:
+            return []
+        stop_words = SmartTagger.stop_words()
+        return [
+            w for w in SmartTagger._TOKEN_PATTERN.findall(text.lower())
+            if len(w) >= min_length and w not in stop_words
+        ]
+
     @staticmethod
     def extract_keywords(text: str, max_keywords: int = 10) -> List[str]:
         """
@@ -71,12 +105,7 @@ class SmartTagger:
         if not text:
             return []
         
-        # Combine common stopwords (with fallback if NLTK data not available)
-        try:
-            stop_words = set(stopwords.words('english'))
-        except LookupError:
-            # Fallback to basic English stopwords if NLTK data not available
-            stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'from', 'as', 'is', 'was', 'are', 'were', 'been', 'be', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'should', 'could', 'may', 'might', 'must', 'can', 'this', 'that', 'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they', 'what', 'which', 'who', 'when', 'where', 'why', 'how'}
+        stop_words = set(SmartTagger.stop_words())
         stop_words.update(['paper', 'propose', 'proposed', 'method', 'approach', 'result', 'show', 'demonstrate'])
         
         # Tokenize and filter
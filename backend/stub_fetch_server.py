@@ -0,0 +1,224 @@
+"""
+Local stand-in for the arXiv and PubMed APIs, for exercising the fetchers offline
+
+Serves deterministic, generated results in the formats the real services
+return (an Atom feed for arXiv, esearch JSON and efetch XML for PubMed),
+with optional latency and injected failures (503 with Retry-After) to
+exercise rate limiting and retries.
+
+Usage:
+    python stub_fetch_server.py --port 8765 --latency 0.2 --fail-rate 0.1
+    ARXIV_API_URL=http://127.0.0.1:8765/arxiv/api/query \\
+    PUBMED_API_URL=http://127.0.0.1:8765/pubmed uvicorn main:app
+
+In-process:
+    server = start_stub_server()
+    fetcher = AsyncPaperFetcher(arxiv_url=server.arxiv_url, pubmed_url=server.pubmed_url)
+    ...
+    server.shutdown()
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+TOPICS = ["graph neural networks", "protein folding", "reinforcement learning", "language models",
+          "causal inference", "federated learning", "diffusion models", "single-cell sequencing"]
+
+
+def _topic(query: str, i: int) -> str:
+    return TOPICS[(zlib.crc32(query.encode()) + i) % len(TOPICS)]
+
+
+def arxiv_feed(query: str, max_results: int, start: int = 0, total: int = 10000) -> bytes:
+    """Atom feed with entries ``start`` .. ``start + max_results`` of ``total`` generated matches"""
+    entries = []
+    for i in range(start, min(start + max_results, total)):
+        topic = _topic(query, i)
+        entries.append(f"""
+  <entry>
+    <id>http://arxiv.org/abs/{2401 + i // 100000}.{i % 100000:05d}v1</id>
+    <published>2024-01-{i % 28 + 1:02d}T00:00:00Z</published>
+    <title>{escape(f"{topic.title()} for {query}: study {i}")}</title>
+    <summary>{escape(f"We study {topic} in the context of {query}. Result {i} improves on prior work.")}</summary>
+    <author><name>Author {i % 7}</name></author>
+    <author><name>Author {i % 5 + 7}</name></author>
+    <category term="cs.LG"/>
+    <category term="stat.ML"/>
+  </entry>""")
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/">
+  <title>ArXiv Query: {escape(query)}</title>
+  <opensearch:totalResults>{total}</opensearch:totalResults>
+  <opensearch:startIndex>{start}</opensearch:startIndex>{"".join(entries)}
+</feed>
+""".encode()
+
+
+def _pmid(term: str, i: int) -> str:
+    return str(30000000 + zlib.crc32(term.encode()) % 1000000 * 1000 + i)
+
+
+def pubmed_ids(term: str, retmax: int, total: int = 10000, use_history: bool = False) -> bytes:
+    """esearch JSON; with ``use_history`` the result set is kept under a WebEnv named after the term"""
+    result = {"count": str(total), "idlist": [_pmid(term, i) for i in range(min(retmax, total))]}
+    if use_history:
+        result.update(webenv=f"STUB_{term}", querykey="1")
+    return json.dumps({"esearchresult": result}).encode()
+
+
+def pubmed_articles(pmids: list) -> bytes:
+    """efetch XML for the given ids (not namespaced, like the real service)"""
+    articles = []
+    for i, pmid in enumerate(pmids):
+        topic = _topic(pmid, i)
+        authors = "".join(
+            f"<Author ValidYN=\"Y\"><LastName>Author{(i + a) % 13}</LastName><ForeName>A</ForeName>"
+            f"<FirstName>A</FirstName><Initials>A</Initials><AffiliationInfo><Affiliation>Department of "
+            f"{escape(topic.title())}, University {a}</Affiliation></AffiliationInfo></Author>"
+            for a in range(4)
+        )
+        mesh = "".join(
+            f"<MeshHeading><DescriptorName UI=\"D{i % 9000 + m:06d}\" MajorTopicYN=\"N\">"
+            f"{escape(_topic(pmid, i + m))}</DescriptorName></MeshHeading>"
+            for m in range(8)
+        )
+        # Real records list cited works, each with its own ids
+        references = "".join(
+            f"<Reference><Citation>{escape(_topic(pmid, r).title())} review {r}.</Citation><ArticleIdList>"
+            f"<ArticleId IdType=\"doi\">10.1000/ref.{pmid}.{r}</ArticleId>"
+            f"<ArticleId IdType=\"pubmed\">{int(pmid) - r - 1}</ArticleId></ArticleIdList></Reference>"
+            for r in range(8)
+        )
+        articles.append(f"""
+  <PubmedArticle>
+    <MedlineCitation Status="MEDLINE" Owner="NLM">
+      <PMID Version="1">{pmid}</PMID>
+      <Article PubModel="Print">
+        <Journal><Title>Journal of {escape(topic.title())}</Title><JournalIssue><PubDate><Year>{2015 + i % 10}</Year></PubDate></JournalIssue></Journal>
+        <ArticleTitle>{escape(f"{topic.title()} study {pmid}")}</ArticleTitle>
+        <Abstract><AbstractText>{escape(f"An analysis of {topic}. " * 12).strip()}</AbstractText></Abstract>
+        <AuthorList CompleteYN="Y">{authors}</AuthorList>
+      </Article>
+      <MeshHeadingList>{mesh}</MeshHeadingList>
+    </MedlineCitation>
+    <PubmedData>
+      <ArticleIdList><ArticleId IdType="pubmed">{pmid}</ArticleId><ArticleId IdType="doi">10.1000/{pmid}</ArticleId></ArticleIdList>
+      <ReferenceList>{references}</ReferenceList>
+    </PubmedData>
+  </PubmedArticle>""")
+    return f"""<?xml version="1.0" ?>
+<PubmedArticleSet>{"".join(articles)}
+</PubmedArticleSet>
+""".encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server: "StubFetchServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        server = self.server
+        server.hits[url.path] += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if server.take_failure():
+            self._send(503, b"busy", "text/plain", {"Retry-After": "0"})
+            return
+
+        if url.path == "/arxiv/api/query":
+            body = arxiv_feed(params.get("search_query", ""), int(params.get("max_results", 10)),
+                              int(params.get("start", 0)), server.total)
+            self._send(200, body, "application/atom+xml")
+        elif url.path == "/pubmed/esearch.fcgi":
+            body = pubmed_ids(params.get("term", ""), int(params.get("retmax", 10)), server.total,
+                              params.get("usehistory") == "y")
+            self._send(200, body, "application/json")
+        elif url.path == "/pubmed/efetch.fcgi":
+            if "WebEnv" in params:
+                term = params["WebEnv"].removeprefix("STUB_")
+                start = int(params.get("retstart", 0))
+                stop = min(start + int(params.get("retmax", 20)), server.total)
+                pmids = [_pmid(term, i) for i in range(start, stop)]
+            else:
+                pmids = [pmid for pmid in params.get("id", "").split(",") if pmid]
+            self._send(200, pubmed_articles(pmids), "text/xml")
+        else:
+            self._send(404, b"not found", "text/plain")
+
+
+class StubFetchServer(ThreadingHTTPServer):
+    """Stub server with request counters and failure injection"""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0, fail_rate: float = 0.0, total: int = 10000):
+        super().__init__(address, StubHandler)
+        self.total = total  # Matches reported for every query
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.fail_next = 0  # Fail this many upcoming requests
+        self.hits = Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+
+    def take_failure(self) -> bool:
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return True
+            return self.fail_rate > 0 and self._random.random() < self.fail_rate
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def arxiv_url(self) -> str:
+        return f"{self.base_url}/arxiv/api/query"
+
+    @property
+    def pubmed_url(self) -> str:
+        return f"{self.base_url}/pubmed"
+
+
+def start_stub_server(port: int = 0, latency: float = 0.0, fail_rate: float = 0.0,
+                      total: int = 10000) -> StubFetchServer:
+    """Start a stub server on a background thread (port 0 picks a free port)"""
+    server = StubFetchServer(("127.0.0.1", port), latency=latency, fail_rate=fail_rate, total=total)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--total", type=int, default=10000, help="matches reported for every query")
+    args = parser.parse_args()
+
+    stub = StubFetchServer(("127.0.0.1", args.port), latency=args.latency, fail_rate=args.fail_rate,
+                           total=args.total)
+    print(f"Stub arXiv API at {stub.arxiv_url}, PubMed at {stub.pubmed_url}")
+    stub.serve_forever()
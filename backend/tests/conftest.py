@@ -0,0 +1,24 @@
+import os
+import sys
+import tempfile
+
+# database.py reads DATABASE_URL at import, so point it at a throwaway SQLite file first
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from database import Base, SessionLocal, engine
+import models  # noqa: F401  (registers the tables)
+
+
+@pytest.fixture
+def db():
+    """Session on freshly created tables"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,116 @@
+from types import SimpleNamespace
+
+import numpy as np
+from sqlalchemy import select
+
+from ingest import upsert_papers
+from models import InteractionStatus, Paper, ReadingList, User, UserPaperInteraction, reading_list_papers
+from near_duplicates import near_duplicate_index
+from paper_identity import arxiv_id, conflicting, doi_key, identity_keys, title_key
+from paper_map import PaperMapIndex
+
+ABSTRACT = ("We study how sparse attention patterns in transformer language models trade accuracy "
+            "for speed on long documents, and propose a routing scheme that keeps both.")
+REPLY = ("The comment misreads our sampling protocol; rerunning the survey with the corrected "
+         "weights leaves every reported prevalence estimate within its confidence interval.")
+
+
+def test_key_normalisation():
+    assert title_key("{BERT}: Pre-training of Deep  Bidirectional Transformers") == \
+        "bert pre training of deep bidirectional transformers"
+    assert title_key("Études   sur l'Ávila") == "etudes sur l avila"
+    assert title_key("  ?! ") is None
+    assert doi_key("https://doi.org/10.1000/ABC.1") == "10.1000/abc.1"
+    assert doi_key("doi: 10.1000/abc.1") == "10.1000/abc.1"
+    assert arxiv_id("https://arxiv.org/abs/2101.00001v3") == "2101.00001"
+    assert arxiv_id("http://arxiv.org/pdf/cs/0112017v1") == "cs/0112017"
+    assert arxiv_id(doi="10.48550/arXiv.2101.00001") == "2101.00001"
+    assert identity_keys("Editorial", "10.1000/AAA.1", None) == \
+        {"title_key": "editorial", "doi_key": "10.1000/aaa.1", "arxiv_id": None}
+    assert conflicting({"doi_key": "a"}, {"doi_key": "b"})
+    assert not conflicting({"doi_key": "a"}, {"arxiv_id": "2101.00001"})
+
+
+def test_same_title_different_doi_are_distinct(db):
+    ids = upsert_papers(db, [
+        {"title": "Editorial", "abstract": ABSTRACT, "doi": "10.1000/aaa.1"},
+        {"title": "Editorial", "abstract": ABSTRACT, "doi": "10.1000/bbb.2"},
+        {"title": "Reply to comment", "abstract": REPLY, "url": "https://arxiv.org/abs/2101.00001"},
+        {"title": "Reply to comment", "abstract": REPLY, "url": "https://arxiv.org/abs/2202.00002"},
+    ])
+    assert len(set(ids)) == 4
+
+    # The same DOI, or the same title without a conflicting id, is the stored paper
+    again = upsert_papers(db, [
+        {"title": "Another title", "abstract": ABSTRACT, "doi": "https://doi.org/10.1000/AAA.1"},
+        {"title": "Reply to Comment!", "abstract": REPLY},
+    ])
+    assert again[0] == ids[0]
+    assert again[1] in (ids[2], ids[3])
+    assert db.query(Paper).count() == 4
+
+
+def test_near_duplicates_are_merged_with_interactions_and_lists(db):
+    original = Paper(title="Sparse attention routing for long documents", authors="A", abstract=ABSTRACT,
+                     doi="10.1000/sparse.1")
+    duplicate = Paper(title="Sparse Attention Routing for Long Documents (preprint)", authors="A",
+                      abstract=ABSTRACT, url="https://arxiv.org/abs/2303.00003")
+    db.add_all([original, duplicate])
+    reader, other = User(username="reader", email="r@example.com"), User(username="other", email="o@example.com")
+    db.add_all([reader, other])
+    db.flush()
+    db.add_all([
+        UserPaperInteraction(user_id=reader.id, paper_id=original.id, status=InteractionStatus.WANT_TO_READ),
+        UserPaperInteraction(user_id=reader.id, paper_id=duplicate.id, status=InteractionStatus.READ, rating=5),
+        UserPaperInteraction(user_id=other.id, paper_id=duplicate.id, status=InteractionStatus.READING),
+    ])
+    reading_list = ReadingList(user_id=other.id, name="Later")
+    db.add(reading_list)
+    db.flush()
+    db.execute(reading_list_papers.insert().values(reading_list_id=reading_list.id, paper_id=duplicate.id))
+    db.commit()
+    original_id, duplicate_id = original.id, duplicate.id
+
+    totals = near_duplicate_index.merge_duplicates(db)
+
+    assert totals["merged"] == 1
+    assert db.get(Paper, duplicate_id) is None
+    merged = db.get(Paper, original_id)
+    assert merged.arxiv_id == "2303.00003"  # Filled in from the duplicate
+    interactions = {i.user_id: i for i in db.query(UserPaperInteraction)}
+    assert {i.paper_id for i in interactions.values()} == {original_id}
+    assert interactions[reader.id].status == InteractionStatus.READ  # Furthest progress kept
+    assert interactions[reader.id].rating == 5
+    assert interactions[other.id].status == InteractionStatus.READING
+    assert db.execute(select(reading_list_papers.c.paper_id)).scalars().all() == [original_id]
+
+
+def test_near_duplicates_with_different_dois_are_kept(db):
+    db.add_all([
+        Paper(title="Editorial", authors="A", abstract=ABSTRACT, doi="10.1000/aaa.1"),
+        Paper(title="Editorial", authors="A", abstract=ABSTRACT, doi="10.1000/bbb.2"),
+    ])
+    db.commit()
+    assert near_duplicate_index.merge_duplicates(db)["merged"] == 0
+    assert db.query(Paper).count() == 2
+
+
+def test_tile_ranges_partition_the_papers():
+    rng = np.random.default_rng(0)
+    positions = np.vstack([rng.random((500, 2)), [[0.0, 0.0], [1.0, 1.0], [0.0, 1.0], [0.5, 0.5]]])
+    rows = [SimpleNamespace(title=f"Paper {i}", venue=None, year=None, citation_count=0, domains=None)
+            for i in range(len(positions))]
+    index = PaperMapIndex(1, None, np.arange(len(positions)), positions.astype(np.float32), rows,
+                          (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)))
+
+    for zoom in range(4):
+        tiles = 1 << zoom
+        ranges = sorted(index.tile_range(zoom, x, y) for x in range(tiles) for y in range(tiles))
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(index)
+        assert all(stop == next_start for (_, stop), (next_start, _) in zip(ranges, ranges[1:]))
+        for x in range(tiles):
+            for y in range(tiles):
+                start, stop = index.tile_range(zoom, x, y)
+                inside = ((np.minimum(index.x[start:stop] * tiles, tiles - 1).astype(int) == x) &
+                          (np.minimum(index.y[start:stop] * tiles, tiles - 1).astype(int) == y))
+                assert inside.all()
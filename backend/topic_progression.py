@@ -1,48 +1,117 @@
 """
 Topic progression analysis for creating logical paths between papers
 """
-from typing import List, Dict, Tuple
+import os
+from typing import List, Dict, Optional, Tuple
 from sqlalchemy.orm import Session
 from models import Paper
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from collections import defaultdict
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+from ann_index import top_k as select_top_k
+from incremental_tfidf import IncrementalTfidf, paper_text
+
+# Graphs with up to this many papers get topic progression links
+PROGRESSION_MAX_PAPERS = int(os.getenv("GRAPH_PROGRESSION_MAX_PAPERS", "50000"))
+# Dimensions of the topic space: the corpus' most common terms
+TOPIC_FEATURES = int(os.getenv("TOPIC_FEATURES", "200"))
+
+PROGRESSION_TYPES = np.array([
+    "application", "context", "related_work", "alternative_approach", "related_survey", "unrelated"
+])
+# Score multiplier per progression type, in PROGRESSION_TYPES order
+PROGRESSION_WEIGHTS = np.array([1.5, 1.2, 1.4, 1.1, 1.1, 0.8])
 
 class TopicProgressionAnalyzer:
-    """Analyze topic progression between papers"""
+    """
+    Analyze topic progression between papers
+    
+    Topic vectors are sliced from a corpus-wide IncrementalTfidf (pass the
+    recommendation engine's to share it) rather than fitted per request.
+    """
+    
+    HIGHLY_CITED = 100  # Citation count above which a paper gets the importance boost
+    SCORE_BLOCK = 64  # Source papers scored per matrix product
     
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(max_features=200, stop_words='english')
+    def __init__(self, tfidf: Optional[IncrementalTfidf] = None, n_features: int = TOPIC_FEATURES):
+        self.tfidf = tfidf or IncrementalTfidf()
+        self.n_features = n_features
+        self._features_for = None  # IDF array the cached topic features were chosen from
+        self._features = np.zeros(0, dtype=np.int64)
         self.paper_vectors = None
         self.paper_ids = None
         self.paper_domains = {}
+        # Per-paper features, aligned with paper_ids
+        self.row_of: Dict[int, int] = {}
+        self.is_general = np.zeros(0, dtype=bool)
+        self.years = np.zeros(0, dtype=np.int64)
+        self.highly_cited = np.zeros(0, dtype=bool)
+        self.domain_matrix = sp.csr_matrix((0, 0))
+    
+    def _topic_features(self) -> np.ndarray:
+        """Hashed term columns with the lowest IDF (most common terms), re-chosen after each refit"""
+        idf = self.tfidf.idf
+        if self._features_for is not idf:
+            k = min(self.n_features, len(idf))
+            self._features = np.sort(np.argpartition(idf, k - 1)[:k])
+            self._features_for = idf
+        return self._features
+    
+    def build_topic_space(self, papers: List[Paper], db: Optional[Session] = None):
+        """
+        Topic vectors and the per-paper feature table for ``papers``
+        
+        Rows come from the shared TF-IDF matrix (synced first when ``db`` is
+        given); papers it does not cover yet are vectorized with its current IDF.
+        """
+        if not papers:
+            return
+        if db is not None:
+            self.tfidf.sync(db)
+        vectors = self.tfidf.snapshot()
+        
+        paper_ids = np.array([int(paper.id) for paper in papers], dtype=np.int64)
+        positions = np.array([vectors.row_of.get(paper_id, -1) for paper_id in paper_ids.tolist()], dtype=np.int64)
+        indexed = (positions >= 0) & (positions < len(vectors))
+        missing = np.flatnonzero(~indexed)
+        parts = []
+        if indexed.any():
+            parts.append(vectors.rows(positions[indexed]))
+        if len(missing):
+            parts.append(self.tfidf.transform([
+                paper_text(papers[i].title, papers[i].abstract, papers[i].keywords) for i in missing
+            ]))
+        matrix = sp.vstack(parts, format="csr")
+        # Back to the order of ``papers``
+        matrix = matrix[np.argsort(np.concatenate([np.flatnonzero(indexed), missing]), kind="stable")]
+        
+        self.paper_vectors = normalize(matrix[:, self._topic_features()], norm='l2')
+        self.paper_ids = paper_ids
+        self.paper_domains = {
+            int(paper.id): [d.strip() for d in paper.domains.split(',') if d.strip()] if paper.domains else []
+            for paper in papers
+        }
+        self._build_features(papers)
     
-    def build_topic_space(self, papers: List[Paper]):
-        """Build topic vector space from papers"""
-        texts = []
-        paper_ids = []
-        domains_map = {}
-        
-        for paper in papers:
-            # Combine title, abstract, keywords, and domains
-            text = f"{paper.title} {paper.abstract}"
-            if paper.keywords:
-                text += f" {paper.keywords}"
-            if paper.domains:
-                text += f" {paper.domains}"
-            
-            texts.append(text)
-            paper_ids.append(int(paper.id))
-            if paper.domains:
-                domains_map[int(paper.id)] = [d.strip() for d in paper.domains.split(',') if d.strip()]
-            else:
-                domains_map[int(paper.id)] = []
-        
-        if texts:
-            self.paper_vectors = self.vectorizer.fit_transform(texts)
-            self.paper_ids = np.array(paper_ids)
-            self.paper_domains = domains_map
+    def _build_features(self, papers: List[Paper]):
+        """Classify and describe every paper once, so pair scoring is pure array arithmetic"""
+        self.row_of = {int(paper_id): row for row, paper_id in enumerate(self.paper_ids)}
+        self.is_general = np.array([self._is_general_paper(paper) for paper in papers], dtype=bool)
+        self.years = np.array([paper.year or 0 for paper in papers], dtype=np.int64)
+        self.highly_cited = np.array(
+            [(paper.citation_count or 0) > self.HIGHLY_CITED for paper in papers], dtype=bool
+        )
+        
+        # Paper x domain incidence: row products count shared domains
+        domain_ids: Dict[str, int] = {}
+        rows, cols = [], []
+        for row, paper_id in enumerate(self.paper_ids.tolist()):
+            for domain in set(self.paper_domains[paper_id]):
+                rows.append(row)
+                cols.append(domain_ids.setdefault(domain, len(domain_ids)))
+        self.domain_matrix = sp.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(len(papers), max(len(domain_ids), 1))
+        )
     
     def _is_general_paper(self, paper: Paper) -> bool:
         """Determine if a paper is general (broad topic) or specific (narrow topic)"""
@@ -76,7 +145,73 @@ class TopicProgressionAnalyzer:
         
         return is_general
     
-    def find_topic_progression(self, paper_id: int, papers: List[Paper], limit: int = 5) -> List[Tuple[int, float, str]]:
+    def _progression_scores(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Progression scores from the papers at ``rows`` to every paper
+        
+        Returns:
+            (scores, types): len(rows) x n_papers arrays; types index
+            PROGRESSION_TYPES and a paper's score for itself is -inf
+        """
+        # TF-IDF rows are L2-normalised, so dot products are cosine similarities
+        similarities = (self.paper_vectors[rows] @ self.paper_vectors.T).toarray()
+        
+        # Logical progression rules:
+        # 1. General papers connect to specific papers (foundation → application)
+        # 2. Specific papers connect to other specific papers (related work)
+        # 3. Specific papers connect back to general papers (context)
+        # 4. General → General: weak connection unless very similar
+        source_general = self.is_general[rows][:, None]
+        other_general = self.is_general[None, :]
+        specific_pair = ~source_general & ~other_general
+        types = np.select(
+            [
+                source_general & ~other_general,
+                ~source_general & other_general,
+                specific_pair & (similarities > 0.3),
+                specific_pair,
+                similarities > 0.4,
+            ],
+            [0, 1, 2, 3, 4],
+            default=5,
+        )
+        scores = similarities * PROGRESSION_WEIGHTS[types]
+        
+        # Temporal progression: recent follow-up work, recent foundational
+        # work, slight reduction for very old/new papers
+        gap = self.years[None, :] - self.years[rows][:, None]
+        scores *= np.select(
+            [(gap > 0) & (gap <= 5), (gap < 0) & (gap >= -5), np.abs(gap) > 10],
+            [1.3, 1.2, 0.9],
+            default=1.0,
+        )
+        
+        # Boost for domain overlap
+        overlap = (self.domain_matrix[rows] @ self.domain_matrix.T).toarray()
+        scores *= 1 + overlap * 0.25
+        
+        # Boost for high citation count (important papers)
+        scores[:, self.highly_cited] *= 1.15
+        
+        scores[np.arange(len(rows)), rows] = -np.inf
+        return scores, types
+    
+    def _top_progressions(self, rows: np.ndarray, limit: int) -> List[List[Tuple[int, float, str]]]:
+        """Best progressions (paper_id, score, progression_type) for each of the papers at ``rows``"""
+        results = []
+        for start in range(0, len(rows), self.SCORE_BLOCK):
+            block = rows[start:start + self.SCORE_BLOCK]
+            scores, types = self._progression_scores(block)
+            for i in range(len(block)):
+                # Only include if score is above threshold
+                eligible = np.flatnonzero(scores[i] > 0.1)
+                results.append([
+                    (int(self.paper_ids[j]), score, str(PROGRESSION_TYPES[types[i, j]]))
+                    for j, score in select_top_k(eligible, scores[i][eligible], limit)
+                ])
+        return results
+    
+    def find_topic_progression(self, paper_id: int, limit: int = 5) -> List[Tuple[int, float, str]]:
         """
         Find papers that represent topic progression from a given paper
         Logic: General papers connect to specific papers, specific papers connect to related specific papers
@@ -84,100 +219,13 @@ class TopicProgressionAnalyzer:
         Returns:
             List of (paper_id, similarity_score, progression_type) tuples
         """
-        if self.paper_vectors is None or paper_id not in self.paper_ids:
+        row = self.row_of.get(paper_id)
+        if self.paper_vectors is None or row is None:
             return []
-        
-        # Find paper index
-        idx = np.where(self.paper_ids == paper_id)[0][0]
-        paper_vector = self.paper_vectors[idx]
-        
-        # Get paper year for temporal analysis
-        paper = next((p for p in papers if p.id == paper_id), None)
-        if not paper:
-            return []
-        
-        paper_year = paper.year or 0
-        paper_domains = self.paper_domains.get(paper_id, [])
-        is_paper_general = self._is_general_paper(paper)
-        
-        # Calculate similarity with all papers
-        similarities = cosine_similarity(paper_vector, self.paper_vectors)[0]
-        
-        # Score papers based on progression criteria
-        progression_scores = []
-        
-        for i, other_paper_id in enumerate(self.paper_ids):
-            if other_paper_id == paper_id:
-                continue
-            
-            other_paper = next((p for p in papers if p.id == other_paper_id), None)
-            if not other_paper:
-                continue
-            
-            similarity = float(similarities[i])
-            other_year = other_paper.year or 0
-            other_domains = self.paper_domains.get(other_paper_id, [])
-            is_other_general = self._is_general_paper(other_paper)
-            
-            # Calculate progression score
-            score = similarity
-            
-            # Logical progression rules:
-            # 1. General papers connect to specific papers (foundation → application)
-            # 2. Specific papers connect to other specific papers (related work)
-            # 3. Specific papers connect back to general papers (context)
-            
-            if is_paper_general and not is_other_general:
-                # General → Specific: Strong connection (foundation to application)
-                score *= 1.5
-                progression_type = "application"
-            elif not is_paper_general and is_other_general:
-                # Specific → General: Moderate connection (application to context)
-                score *= 1.2
-                progression_type = "context"
-            elif not is_paper_general and not is_other_general:
-                # Specific → Specific: Strong if similar, moderate if different
-                if similarity > 0.3:
-                    score *= 1.4
-                    progression_type = "related_work"
-                else:
-                    score *= 1.1
-                    progression_type = "alternative_approach"
-            else:
-                # General → General: Weak connection unless very similar
-                if similarity > 0.4:
-                    score *= 1.1
-                    progression_type = "related_survey"
-                else:
-                    score *= 0.8  # Reduce score for unrelated general papers
-                    progression_type = "unrelated"
-            
-            # Temporal progression (newer papers building on older)
-            if other_year > paper_year and other_year - paper_year <= 5:
-                score *= 1.3  # Recent follow-up work
-            elif other_year < paper_year and paper_year - other_year <= 5:
-                score *= 1.2  # Recent foundational work
-            elif abs(other_year - paper_year) > 10:
-                score *= 0.9  # Slightly reduce for very old/new papers
-            
-            # Boost for domain overlap
-            domain_overlap = len(set(paper_domains) & set(other_domains))
-            if domain_overlap > 0:
-                score *= (1 + domain_overlap * 0.25)
-            
-            # Boost for high citation count (important papers)
-            if other_paper.citation_count > 100:
-                score *= 1.15
-            
-            # Only include if score is above threshold
-            if score > 0.1:
-                progression_scores.append((other_paper_id, score, progression_type))
-        
-        # Sort by score and return top N
-        progression_scores.sort(key=lambda x: x[1], reverse=True)
-        return progression_scores[:limit]
+        return self._top_progressions(np.array([row]), limit)[0]
     
-    def create_progression_paths(self, papers: List[Paper], max_paths_per_paper: int = 4) -> List[Dict]:
+    def create_progression_paths(self, papers: List[Paper], max_paths_per_paper: int = 4,
+                                 db: Optional[Session] = None) -> List[Dict]:
         """
         Create topic progression paths between papers
         Creates logical connections: General → Specific, Specific → Related Specific
@@ -188,26 +236,25 @@ class TopicProgressionAnalyzer:
         if len(papers) == 0:
             return []
         
-        self.build_topic_space(papers)
+        self.build_topic_space(papers, db)
         
         links = []
         processed_pairs = set()
         
         # Separate general and specific papers
-        general_papers = [p for p in papers if self._is_general_paper(p)]
-        specific_papers = [p for p in papers if not self._is_general_paper(p)]
+        general_rows = np.flatnonzero(self.is_general)[:30]
+        specific_rows = np.flatnonzero(~self.is_general)[:40]
         
         # Create progression paths
         # 1. General papers connect to specific papers (foundation → application)
-        for paper in general_papers[:30]:
-            progressions = self.find_topic_progression(paper.id, papers, limit=max_paths_per_paper)
-            
+        for row, progressions in zip(general_rows, self._top_progressions(general_rows, max_paths_per_paper)):
+            paper_id = int(self.paper_ids[row])
             for target_id, score, prog_type in progressions:
-                pair_key = tuple(sorted([paper.id, target_id]))
+                pair_key = tuple(sorted([paper_id, target_id]))
                 
                 if pair_key not in processed_pairs and score > 0.12:
                     links.append({
-                        "source": int(paper.id),
+                        "source": paper_id,
                         "target": int(target_id),
                         "value": float(min(score * 12, 5)),  # Scale to 1-5
                         "type": "topic_progression",
@@ -217,15 +264,14 @@ class TopicProgressionAnalyzer:
                     processed_pairs.add(pair_key)
         
         # 2. Specific papers connect to related specific papers and general context
-        for paper in specific_papers[:40]:
-            progressions = self.find_topic_progression(paper.id, papers, limit=max_paths_per_paper)
-            
+        for row, progressions in zip(specific_rows, self._top_progressions(specific_rows, max_paths_per_paper)):
+            paper_id = int(self.paper_ids[row])
             for target_id, score, prog_type in progressions:
-                pair_key = tuple(sorted([paper.id, target_id]))
+                pair_key = tuple(sorted([paper_id, target_id]))
                 
                 if pair_key not in processed_pairs and score > 0.15:
                     links.append({
-                        "source": int(paper.id),
+                        "source": paper_id,
                         "target": int(target_id),
                         "value": float(min(score * 10, 4)),  # Slightly lower value for specific-specific
                         "type": "topic_progression",
@@ -5,6 +5,9 @@ import { Search, ExternalLink, X, Sparkles, Eye } from 'lucide-react'
 import { papersAPI } from '../services/api'
 import { useUser } from '../context/UserContext'
 
+// Canvas size (px) of the unit square the backend layout positions are in
+const LAYOUT_SCALE = 4000
+
 // Particle system for cosmic background
 const CosmicBackground = () => {
   const canvasRef = useRef(null)
@@ -181,6 +184,8 @@ const PaperCard = ({ node, onClose, onOpenPaper, onViewDetails }) => {
 const PaperMap = () => {
   const { currentUser: user } = useUser()
   const [graphData, setGraphData] = useState({ nodes: [], links: [] })
+  // With every position precomputed there is nothing left to simulate
+  const allPinned = graphData.nodes.length > 0 && graphData.nodes.every(node => node.fx !== undefined)
   const [loading, setLoading] = useState(true)
   const [searchQuery, setSearchQuery] = useState('')
   const [matchingNodes, setMatchingNodes] = useState(new Set())
@@ -202,7 +207,13 @@ const PaperMap = () => {
       setLoading(true)
       const searchArxiv = search.length > 0
       const response = await papersAPI.getGraph(search, user?.id, searchArxiv)
-      setGraphData(response.data)
+      // Pin papers at their precomputed layout positions; the rest are simulated around them
+      const nodes = response.data.nodes.map(node => (
+        node.layout_x != null && node.layout_y != null
+          ? { ...node, fx: (node.layout_x - 0.5) * LAYOUT_SCALE, fy: (node.layout_y - 0.5) * LAYOUT_SCALE }
+          : node
+      ))
+      setGraphData({ ...response.data, nodes })
     } catch (err) {
       console.error('Error fetching graph data:', err)
     } finally {
@@ -628,10 +639,10 @@ const PaperMap = () => {
           enablePanInteraction={true}
           enableZoomInteraction={true}
           enableNodeDrag={true}
-          cooldownTicks={300}
+          cooldownTicks={allPinned ? 0 : 300}
           d3AlphaDecay={0.022}
           d3VelocityDecay={0.4}
-          warmupTicks={150}
+          warmupTicks={allPinned ? 0 : 150}
           minZoom={0.05}
           maxZoom={10}
           onEngineStop={() => {